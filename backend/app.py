@@ -5,11 +5,11 @@ UseDesk Backend - Главный файл приложения
 import logging
 import threading
 import time
-from datetime import datetime
 from flask import Flask, jsonify
 from flask_cors import CORS
 
 from backend.config.settings import APP_VERSION, DEBUG_MODE, print_config
+from backend.config.constants import CACHE_PURGE_INTERVAL, CACHE_EVICTION_CHECK_INTERVAL
 
 app = Flask(__name__)
 CORS(app)
@@ -19,12 +19,21 @@ logger = logging.getLogger(__name__)
 
 
 class CacheCleanupScheduler:
-    """Планировщик автоматической очистки кеша каждый день в полночь"""
+    """
+    Планировщик фоновой очистки кеша
+    Записи истекают по одной (TTL + stale-while-revalidate в BotResponseCache),
+    поэтому раз в CACHE_PURGE_INTERVAL удаляются только вышедшие за окно.
+    Раз в CACHE_EVICTION_CHECK_INTERVAL проверяется размер кеша и лишние
+    записи вытесняются пачками (BotResponseCache.evict)
+    """
     
-    def __init__(self):
+    def __init__(self, interval=CACHE_PURGE_INTERVAL, eviction_interval=CACHE_EVICTION_CHECK_INTERVAL):
         self.running = False
         self.thread = None
-        self.last_cleanup_date = None
+        self.interval = interval
+        self.eviction_interval = eviction_interval
+        self.last_cleanup_at = None
+        self.last_eviction_at = None
         
     def start(self):
         """Запускает фоновый поток очистки кеша"""
@@ -32,7 +41,7 @@ class CacheCleanupScheduler:
             self.running = True
             self.thread = threading.Thread(target=self._cleanup_loop, daemon=True)
             self.thread.start()
-            logger.info("🧹 Запущен планировщик очистки кеша (каждый день в 00:00)")
+            logger.info(f"🧹 Запущен планировщик очистки кеша (каждые {self.interval} сек)")
     
     def stop(self):
         """Останавливает фоновый поток"""
@@ -41,46 +50,45 @@ class CacheCleanupScheduler:
             self.thread.join()
     
     def _cleanup_loop(self):
-        """Основной цикл проверки времени и очистки"""
+        """Основной цикл: периодически удаляет устаревшие записи"""
         while self.running:
             try:
-                now = datetime.now()
-                current_date = now.date()
-                
-                if (now.hour == 0 and now.minute == 0 and 
-                    self.last_cleanup_date != current_date):
-                    
-                    logger.info("🕛 Полночь! Запускаем автоочистку кеша...")
+                now = time.time()
+                if self.last_cleanup_at is None or now - self.last_cleanup_at >= self.interval:
                     self._perform_cleanup()
-                    self.last_cleanup_date = current_date
+                    self.last_cleanup_at = now
+                    self.last_eviction_at = now
+                elif self.last_eviction_at is None or now - self.last_eviction_at >= self.eviction_interval:
+                    self._perform_eviction()
+                    self.last_eviction_at = now
                     
-                time.sleep(30)
+                time.sleep(min(30, self.eviction_interval))
                 
             except Exception as e:
                 logger.error(f"❌ Ошибка в планировщике очистки кеша: {e}")
                 time.sleep(60)
     
     def _perform_cleanup(self):
-        """Выполняет ПОЛНУЮ очистку кеша - удаляет ВСЕ файлы"""
+        """Удаляет записи кеша, вышедшие за окно stale-while-revalidate, и вытесняет лишние"""
         try:
             from backend.core.cache_manager import bot_cache
             
-            # Получаем статистику до очистки
-            stats_before = bot_cache.get_stats()
-            
-            # Выполняем ПОЛНУЮ очистку (удаляем все файлы)
-            bot_cache.clear_all()
-            
-            # Получаем статистику после очистки
+            report = bot_cache.cleanup()
             stats_after = bot_cache.get_stats()
+            logger.info(f"📊 Очистка кеша: удалено {report['evicted']} ({report['reasons']}), осталось записей: {stats_after.get('total_files', 0)}")
             
-            # Логируем результат
-            deleted_files = stats_before.get('total_files', 0)
-            logger.info(f"🧹 ПОЛНАЯ очистка кеша завершена! Удалено всех файлов: {deleted_files}")
-            logger.info(f"📊 Кеш полностью очищен! Файлов: {stats_after.get('total_files', 0)}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при очистке кеша: {e}")
+    
+    def _perform_eviction(self):
+        """Вытесняет записи, если кеш вышел за CACHE_MAX_ENTRIES / CACHE_MAX_BYTES"""
+        try:
+            from backend.core.cache_manager import bot_cache
+            
+            bot_cache.evict()
             
         except Exception as e:
-            logger.error(f"❌ Ошибка при полной очистке кеша: {e}")
+            logger.error(f"❌ Ошибка при вытеснении записей кеша: {e}")
 
 
 # Создаем глобальный экземпляр планировщика
@@ -130,6 +138,13 @@ def init_app():
         cache_scheduler.start()
         logger.info("🚀 Планировщик кеша запущен")
         
+        from backend.services.cache_refresher import cache_refresher
+        cache_refresher.start()
+        
+        # Поднимаем Telegram демон заранее, чтобы первый запрос не ждал подключения
+        from backend.services.telegram_service import ensure_telegram_daemon
+        threading.Thread(target=ensure_telegram_daemon, daemon=True).start()
+        
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации: {e}")
 
@@ -23,6 +23,13 @@ TELEGRAM_UID_PATTERN = r'^\d+$'
 TELEGRAM_DEFAULT_TIMEOUT = 30
 TELEGRAM_REPLACE_KEY_TIMEOUT = 60
 
+TELEGRAM_FLOOD_WAIT_PREFIX = "❌ FloodWait"
+
+REPLACE_KEY_STAGE_QUEUED = 'queued'
+REPLACE_KEY_STAGE_COMMAND_SENT = 'command_sent'
+REPLACE_KEY_STAGE_SUBSCRIPTION_ADDED = 'subscription_added'
+REPLACE_KEY_STAGE_KEY_RECEIVED = 'key_received'
+
 TELEGRAM_MAX_RETRY_ATTEMPTS = 3
 TELEGRAM_RETRY_MIN_WAIT = 2
 TELEGRAM_RETRY_MAX_WAIT = 10
@@ -34,8 +41,54 @@ QUICKINSTALL_CHOOSE_DEVICE_PATH = "/choose_device"
 QUICKINSTALL_URL_PATTERN = r'https://domain\.com/choose_device\?url=([^\s\)\,\"]+)'
 
 
+# Сколько секунд запись кеша считается свежей (expires_at = сохранение + TTL)
 CACHE_DEFAULT_TTL = 3600
+# TTL по умолчанию для ответа бота "подписок нет" (см. CACHE_NEGATIVE_TTLS в settings)
 CACHE_BOT_RESPONSE_TTL = 300
+# Виды негативных записей кеша (у каждого свой TTL, после истечения -
+# повторный запрос без окна stale-while-revalidate)
+CACHE_NEGATIVE_NO_SUBSCRIPTIONS = 'no_subscriptions'
+CACHE_NEGATIVE_BOT_TIMEOUT = 'bot_timeout'
+CACHE_NEGATIVE_REMNAWAVE_NOT_FOUND = 'remnawave_not_found'
+CACHE_NEGATIVE_REMNAWAVE_UNAUTHORIZED = 'remnawave_unauthorized'
+# Версия формата данных записи кеша подписок (backend.utils.cache_schema):
+# 2 - подписки хранятся уже обработанными (status, days_left, type)
+CACHE_SCHEMA_VERSION = 2
+# Как часто удаляются записи, вышедшие за окно stale-while-revalidate
+CACHE_PURGE_INTERVAL = 3600
+
+# Refresh-ahead: обновлять записи активных клиентов за столько секунд до истечения
+CACHE_REFRESH_AHEAD = 300
+# Клиент активен, если его виджет открывали не раньше чем столько секунд назад
+CACHE_ACTIVE_CLIENT_WINDOW = 2 * 3600
+CACHE_REFRESH_CHECK_INTERVAL = 30
+CACHE_REFRESH_WORKERS = 2
+# Максимум обновлений за один проход (остальные - в следующих проходах)
+CACHE_REFRESH_BATCH = 5
+
+# Вытеснение при превышении CACHE_MAX_ENTRIES / CACHE_MAX_BYTES: записей за пачку,
+# пауза между пачками (сек) и как часто проверять размер кеша
+CACHE_EVICTION_BATCH = 50
+CACHE_EVICTION_PAUSE = 0.05
+CACHE_EVICTION_CHECK_INTERVAL = 60
+
+# Шина инвалидаций между воркерами: слотов в кольцевом буфере и размер слота (байт)
+CACHE_INVALIDATION_SLOTS = 1024
+CACHE_INVALIDATION_SLOT_SIZE = 256
+
+# Межпроцессные блокировки по ключу (single-flight, записи кеша): фиксированный
+# набор lock файлов, ключ попадает в файл по хешу - каталог .locks не растет
+LOCK_FILE_STRIPES = 256
+
+# Загрузка виджета: параллельные запросы к боту и RemnaWave
+USER_LOOKUP_WORKERS = 8
+# Сколько секунд запрос виджета ждет RemnaWave (отсчет от начала загрузки,
+# бот ограничен своим TELEGRAM_SUBPROCESS_TIMEOUT)
+USER_LOOKUP_DEADLINE = 20
+# Фоновая загрузка HWID устройств при открытии виджета (для manage_keys)
+HWID_PREFETCH_WORKERS = 2
+# Массовая проверка пользователей RemnaWave: максимум Telegram ID за запрос
+BULK_LOOKUP_MAX_IDS = 1000
 
 CACHE_DIR_NAME = "cache"
 CACHE_FILE_NAME = "bot_responses.json"
@@ -4,6 +4,14 @@
 import os
 from dotenv import load_dotenv
 
+from backend.config.constants import (
+    CACHE_BOT_RESPONSE_TTL,
+    CACHE_NEGATIVE_NO_SUBSCRIPTIONS,
+    CACHE_NEGATIVE_BOT_TIMEOUT,
+    CACHE_NEGATIVE_REMNAWAVE_NOT_FOUND,
+    CACHE_NEGATIVE_REMNAWAVE_UNAUTHORIZED
+)
+
 load_dotenv()
 
 
@@ -27,12 +35,56 @@ CACHE_DIR = os.getenv('CACHE_DIR', '/app/cache')
 
 CACHE_TIMEOUT = 300
 
+# Движок хранения кеша ответов бота: 'file' (JSON файл на клиента) или 'sqlite'
+CACHE_STORAGE = os.getenv('CACHE_STORAGE', 'file').lower()
+CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH', os.path.join(CACHE_DIR, 'bot_cache.sqlite3'))
+# Redis движок (CACHE_STORAGE=redis): общий кеш для нескольких реплик
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', '')
+CACHE_REDIS_PREFIX = os.getenv('CACHE_REDIS_PREFIX', 'usedesk:cache:')
+# TTL негативных записей кеша (секунды): ответ без подписок, таймаут бота,
+# RemnaWave not_found / неверный токен
+CACHE_NEGATIVE_TTLS = {
+    CACHE_NEGATIVE_NO_SUBSCRIPTIONS: int(os.getenv('CACHE_NEGATIVE_TTL_NO_SUBSCRIPTIONS', str(CACHE_BOT_RESPONSE_TTL))),
+    CACHE_NEGATIVE_BOT_TIMEOUT: int(os.getenv('CACHE_NEGATIVE_TTL_BOT_TIMEOUT', '60')),
+    CACHE_NEGATIVE_REMNAWAVE_NOT_FOUND: int(os.getenv('CACHE_NEGATIVE_TTL_REMNAWAVE_NOT_FOUND', '600')),
+    CACHE_NEGATIVE_REMNAWAVE_UNAUTHORIZED: int(os.getenv('CACHE_NEGATIVE_TTL_REMNAWAVE_UNAUTHORIZED', '60')),
+}
+# Сериализация записей: json / orjson / msgpack, сжатие: none / zlib / zstd
+CACHE_CODEC = os.getenv('CACHE_CODEC', 'json').lower()
+CACHE_COMPRESSION = os.getenv('CACHE_COMPRESSION', 'none').lower()
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv('CACHE_COMPRESS_MIN_BYTES', '2048'))
+
+# LRU в памяти перед файловым кешем (на каждый воркер)
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv('CACHE_MEMORY_MAX_ENTRIES', '500'))
+CACHE_MEMORY_MAX_BYTES = int(os.getenv('CACHE_MEMORY_MAX_BYTES', str(16 * 1024 * 1024)))
+CACHE_MEMORY_TTL = int(os.getenv('CACHE_MEMORY_TTL', '60'))
+# TTL памяти при общем для реплик хранилище (redis): инвалидации других хостов
+# сюда не доходят, поэтому по умолчанию уровень в памяти отключен (0)
+CACHE_SHARED_MEMORY_TTL = int(os.getenv('CACHE_SHARED_MEMORY_TTL', '0'))
+
+# Сколько секунд истекшая запись еще отдается сразу (с одним фоновым обновлением).
+# Часы, а не дни: агенты не должны видеть подписки многодневной давности
+CACHE_STALE_WHILE_REVALIDATE = int(os.getenv('CACHE_STALE_WHILE_REVALIDATE', str(6 * 3600)))
+
+# Ограничение размера хранилища кеша (0 - без ограничения) и политика вытеснения: lru / lfu
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '50000'))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+CACHE_EVICTION_POLICY = os.getenv('CACHE_EVICTION_POLICY', 'lru').lower()
+
 
 TELEGRAM_SUBPROCESS_TIMEOUT = 15
 
 TELEGRAM_REPLACE_KEY_TIMEOUT = 60
 
 
+TELEGRAM_DAEMON_ENABLED = os.getenv('TELEGRAM_DAEMON_ENABLED', 'True').lower() == 'true'
+TELEGRAM_DAEMON_SOCKET = os.getenv('TELEGRAM_DAEMON_SOCKET', '/tmp/usedesk_telegram.sock')
+TELEGRAM_DAEMON_AUTOSTART = os.getenv('TELEGRAM_DAEMON_AUTOSTART', 'True').lower() == 'true'
+TELEGRAM_DAEMON_START_TIMEOUT = 10
+# Вывод (логи) автоматически запущенного демона
+TELEGRAM_DAEMON_LOG_FILE = os.getenv('TELEGRAM_DAEMON_LOG_FILE', '/tmp/usedesk_telegram_daemon.log')
+
+
 DEBUG_MODE = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
 
 FLASK_HOST = os.getenv('FLASK_HOST', '0.0.0.0')
@@ -47,6 +99,16 @@ SUBSCRIPTION_EXPIRING_DAYS = 14
 
 REMNA_API_DOMAIN = os.getenv('REMNA_API_DOMAIN', 'domain.com')
 REMNA_API_TOKEN = os.getenv('REMNA_API_TOKEN')
+# Keep-alive пул соединений к RemnaWave (на воркер) и таймауты запроса (сек)
+REMNA_POOL_SIZE = int(os.getenv('REMNA_POOL_SIZE', '10'))
+REMNA_CONNECT_TIMEOUT = float(os.getenv('REMNA_CONNECT_TIMEOUT', '3'))
+REMNA_READ_TIMEOUT = float(os.getenv('REMNA_READ_TIMEOUT', '10'))
+# Кеш ответов RemnaWave в памяти воркера: TTL пользователей и списков HWID устройств (сек)
+REMNA_USER_CACHE_TTL = int(os.getenv('REMNA_USER_CACHE_TTL', '60'))
+REMNA_DEVICES_CACHE_TTL = int(os.getenv('REMNA_DEVICES_CACHE_TTL', '30'))
+REMNA_CACHE_MAX_ENTRIES = int(os.getenv('REMNA_CACHE_MAX_ENTRIES', '1000'))
+# Параллельных запросов массовой проверки (на воркер) - по умолчанию размер пула соединений
+BULK_LOOKUP_WORKERS = int(os.getenv('BULK_LOOKUP_WORKERS', str(REMNA_POOL_SIZE)))
 
 
 def validate_config():
@@ -2,18 +2,36 @@
 """
 Дополнительные настройки для оптимизации Telegram API
 """
+import os
 
 TELEGRAM_CONFIG = {
-    'flood_sleep_threshold': 60,
+    # 0 - Telethon не спит сам, а пробрасывает FloodWaitError:
+    # очередь команд ставится на паузу ровно на указанное время (telegram_scheduler.py)
+    'flood_sleep_threshold': 0,
     'request_retries': 5,
     'retry_delay': 2,
     
-    'min_request_interval': 1.0,
+    # Token bucket лимиты, общие для всех процессов (backend/core/rate_limiter.py)
+    # rate - токенов в секунду, burst - сколько запросов можно сделать подряд
+    'rate_limits': {
+        'send_message': {'rate': 1.0, 'burst': 2},
+        'history': {'rate': 2.0, 'burst': 4},
+    },
+    'rate_limit_state_file': os.getenv(
+        'TELEGRAM_RATE_LIMIT_FILE',
+        os.path.join(os.getenv('CACHE_DIR', '/app/cache'), '.telegram_rate_limit.json')
+    ),
+    
+    'use_update_events': True,
+    'max_concurrent_commands': 4,
+    'concurrency_increase_after': 20,
     'message_check_interval': 0.5,
     'max_message_attempts': 6,
     
     'extended_check_interval': 1.0,
     'extended_max_attempts': 20,
+    # Замена ключа: сколько ждать "Вот ваш ключ" после "Новая подписка успешно добавлена"
+    'replace_key_second_message_timeout': 10,
     
     'message_limit': 8,
     'max_message_limit': 10,
@@ -37,11 +55,14 @@ def get_client_config():
 def get_request_config():
     """Возвращает настройки для запросов"""
     return {
-        'min_interval': TELEGRAM_CONFIG['min_request_interval'],
+        'use_update_events': TELEGRAM_CONFIG['use_update_events'],
+        'max_concurrent_commands': TELEGRAM_CONFIG['max_concurrent_commands'],
+        'concurrency_increase_after': TELEGRAM_CONFIG['concurrency_increase_after'],
         'check_interval': TELEGRAM_CONFIG['message_check_interval'],
         'max_attempts': TELEGRAM_CONFIG['max_message_attempts'],
         'extended_check_interval': TELEGRAM_CONFIG['extended_check_interval'],
         'extended_max_attempts': TELEGRAM_CONFIG['extended_max_attempts'],
+        'replace_key_second_message_timeout': TELEGRAM_CONFIG['replace_key_second_message_timeout'],
         'message_limit': TELEGRAM_CONFIG['message_limit'],
         'max_message_limit': TELEGRAM_CONFIG['max_message_limit'],
     }
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Кодеки сериализации записей кеша
+Закодированная запись начинается с короткого заголовка:
+    BRC:<версия формата>:<кодек>:<сжатие>\\n<payload>
+Записи без заголовка (старый формат) читаются как обычный JSON
+
+Кодеки: json (компактный, stdlib), orjson и msgpack (если установлены)
+Сжатие: none, zlib (stdlib), zstd (если установлен zstandard).
+Сжимаются только записи больше CACHE_COMPRESS_MIN_BYTES
+
+Сравнение кодеков на типичных списках подписок:
+    python -m backend.core.cache_codecs benchmark
+"""
+
+import sys
+import json
+import time
+import zlib
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_FORMAT_VERSION = 1
+HEADER_MAGIC = b"BRC:"
+
+
+def _json_dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _json_loads(payload):
+    return json.loads(payload.decode('utf-8'))
+
+
+def _msgpack_dumps(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _msgpack_loads(payload):
+    return msgpack.unpackb(payload, raw=False)
+
+
+# имя -> (dumps, loads) для доступных кодеков
+CODECS = {'json': (_json_dumps, _json_loads)}
+if orjson is not None:
+    CODECS['orjson'] = (orjson.dumps, orjson.loads)
+if msgpack is not None:
+    CODECS['msgpack'] = (_msgpack_dumps, _msgpack_loads)
+
+COMPRESSIONS = {
+    'none': (lambda payload: payload, lambda payload: payload),
+    'zlib': (lambda payload: zlib.compress(payload, 6), zlib.decompress),
+}
+if zstandard is not None:
+    COMPRESSIONS['zstd'] = (
+        lambda payload: zstandard.ZstdCompressor(level=3).compress(payload),
+        lambda payload: zstandard.ZstdDecompressor().decompress(payload)
+    )
+
+
+class CacheCodec:
+    def __init__(self, codec='json', compression='none', compress_min_bytes=2048):
+        """
+        Args:
+            codec: Имя кодека из CODECS (недоступный заменяется на json)
+            compression: Имя сжатия из COMPRESSIONS (недоступное отключается)
+            compress_min_bytes: Записи меньше этого размера не сжимаются
+        """
+        if codec not in CODECS:
+            logger.warning(f"⚠️ Кодек кеша '{codec}' недоступен, используем json")
+            codec = 'json'
+        if compression not in COMPRESSIONS:
+            logger.warning(f"⚠️ Сжатие кеша '{compression}' недоступно, отключаем")
+            compression = 'none'
+
+        self.codec = codec
+        self.compression = compression
+        self.compress_min_bytes = compress_min_bytes
+
+    def encode(self, value):
+        """Кодирует значение в bytes с заголовком"""
+        payload = CODECS[self.codec][0](value)
+
+        compression = self.compression
+        if compression != 'none' and len(payload) < self.compress_min_bytes:
+            compression = 'none'
+        payload = COMPRESSIONS[compression][0](payload)
+
+        header = f"{CODEC_FORMAT_VERSION}:{self.codec}:{compression}\n".encode('ascii')
+        return HEADER_MAGIC + header + payload
+
+    @staticmethod
+    def decode(raw):
+        """
+        Декодирует bytes, записанные encode() или старым json.dump
+
+        Raises:
+            ValueError: Неизвестная версия формата, кодек или сжатие недоступны,
+                поврежденные данные (ошибки распаковки и разбора тоже ValueError -
+                хранилища считают такую запись промахом)
+        """
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+
+        if not raw.startswith(HEADER_MAGIC):
+            return _json_loads(raw)
+
+        header_end = raw.index(b"\n")
+        version, codec, compression = raw[len(HEADER_MAGIC):header_end].decode('ascii').split(':')
+        if int(version) != CODEC_FORMAT_VERSION:
+            raise ValueError(f"Неизвестная версия формата кеша: {version}")
+        if codec not in CODECS:
+            raise ValueError(f"Кодек '{codec}' не установлен")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Сжатие '{compression}' не установлено")
+
+        try:
+            payload = COMPRESSIONS[compression][1](raw[header_end + 1:])
+        except Exception as e:
+            # zlib.error, zstandard.ZstdError не наследуют ValueError
+            raise ValueError(f"Поврежденные сжатые данные ({compression}): {e}") from e
+        try:
+            return CODECS[codec][1](payload)
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Поврежденные данные ({codec}): {e}") from e
+
+
+def _sample_payload(subscriptions_count):
+    """Запись кеша, похожая на реальный ответ бота + данные RemnaWave"""
+    subscriptions = []
+    for i in range(subscriptions_count):
+        uuid = f"{i:08x}-4f1c-4d2a-9b7e-{i:012x}"
+        subscriptions.append({
+            'name': f"Подписка {i} (iPhone)" if i % 3 else f"{i:012X}-router",
+            'uuid': uuid,
+            'expires': f"{(i % 28) + 1:02d}.{(i % 12) + 1:02d}.26",
+            'quickinstall': f"https://domain.com/choose_device?url=https%3A%2F%2Fsub.domain.com%2F{uuid}",
+            'traffic_used': f"{i * 1.7:.1f} GB",
+        })
+    return {
+        'subscriptions': subscriptions,
+        'client_name': "Иван Петров",
+        'timestamp': time.time(),
+        'remnawave_user': {
+            'uuid': '7c0e2a9e-6a37-4e4e-9f2f-3b1b1f9d2c11',
+            'username': 'user_123456789',
+            'shortUuid': 'aB3dE5fG',
+            'status': 'ACTIVE',
+            'usedTrafficBytes': 123456789,
+            'subscriptionUrl': 'https://sub.domain.com/aB3dE5fG',
+        },
+    }
+
+
+def benchmark(sizes=(1, 5, 20, 100), iterations=2000):
+    """Печатает размер и время кодирования/декодирования для всех доступных комбинаций"""
+    print(f"{'подписок':>8} {'кодек':>8} {'сжатие':>6} {'байт':>8} {'encode мкс':>11} {'decode мкс':>11}")
+
+    for size in sizes:
+        value = _sample_payload(size)
+        legacy = json.dumps(value, ensure_ascii=False, indent=2).encode('utf-8')
+        start = time.perf_counter()
+        for _ in range(iterations):
+            json.loads(legacy.decode('utf-8'))
+        legacy_decode = (time.perf_counter() - start) / iterations * 1e6
+        print(f"{size:>8} {'indent=2':>8} {'none':>6} {len(legacy):>8} {'-':>11} {legacy_decode:>11.1f}")
+
+        for codec in CODECS:
+            for compression in COMPRESSIONS:
+                cache_codec = CacheCodec(codec, compression, compress_min_bytes=0)
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    encoded = cache_codec.encode(value)
+                encode_us = (time.perf_counter() - start) / iterations * 1e6
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    cache_codec.decode(encoded)
+                decode_us = (time.perf_counter() - start) / iterations * 1e6
+
+                print(f"{size:>8} {codec:>8} {compression:>6} {len(encoded):>8} {encode_us:>11.1f} {decode_us:>11.1f}")
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'benchmark':
+        print("Использование: python -m backend.core.cache_codecs benchmark")
+        sys.exit(1)
+
+    benchmark()
+
+
+if __name__ == "__main__":
+    main()
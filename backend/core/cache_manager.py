@@ -1,173 +1,702 @@
 #!/usr/bin/env python3
 """
-JSON файловый кеш для ответов бота с 12-часовым временем жизни
-Каждый клиент хранится в отдельном JSON файле
+Кеш ответов бота с временем жизни на каждую запись
+Записи хранит движок из cache_storage (JSON файл на пользователя или SQLite,
+выбирается CACHE_STORAGE), перед движком - LRU в памяти
+
+Данные лежат один раз на telegram_uid: все client_id одного Telegram
+пользователя видят одну запись, и set/merge/delete по любому из них
+сразу меняют ее для всех. client_id только пополняет индекс для get_by_client_id
+
+Запись свежая до expires_at. После этого она еще CACHE_STALE_WHILE_REVALIDATE
+секунд отдается сразу, а обновление запускается в фоне (одно на запись).
+Записи старше этого окна удаляются фоновой очисткой
+
+Негативные записи (нет подписок, таймаут бота) помечены полем 'negative',
+живут CACHE_NEGATIVE_TTLS[вид] и после истечения не отдаются как устаревшие.
+Отдельные негативные поля (ошибка RemnaWave) хранят свой срок в <поле>_expires_at
+
+Размер хранилища ограничен CACHE_MAX_ENTRIES / CACHE_MAX_BYTES: фоновая
+очистка вытесняет записи по CACHE_EVICTION_POLICY (lru/lfu) небольшими
+пачками с паузами, запросы при этом не ждут. Обращения копятся в памяти
+и записываются в хранилище перед вытеснением
+
+Изменения записей рассылаются остальным воркерам через шину инвалидаций
+(invalidation_bus): их копии в памяти сбрасываются перед следующим чтением
 """
 
 import os
+import math
 import time
-import json
+import fcntl
+import hashlib
 import logging
-import glob
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from pathlib import Path
+
+from backend.config.settings import (
+    CACHE_STORAGE,
+    CACHE_SQLITE_PATH,
+    CACHE_REDIS_URL,
+    CACHE_REDIS_PREFIX,
+    CACHE_CODEC,
+    CACHE_COMPRESSION,
+    CACHE_COMPRESS_MIN_BYTES,
+    CACHE_MEMORY_MAX_ENTRIES,
+    CACHE_MEMORY_MAX_BYTES,
+    CACHE_MEMORY_TTL,
+    CACHE_SHARED_MEMORY_TTL,
+    CACHE_STALE_WHILE_REVALIDATE,
+    CACHE_NEGATIVE_TTLS,
+    CACHE_MAX_ENTRIES,
+    CACHE_MAX_BYTES,
+    CACHE_EVICTION_POLICY
+)
+from backend.config.constants import (
+    CACHE_DEFAULT_TTL,
+    CACHE_EVICTION_BATCH,
+    CACHE_EVICTION_PAUSE,
+    LOCK_FILE_STRIPES
+)
+from backend.core.cache_codecs import CacheCodec
+from backend.core.cache_storage import create_storage, record_created_at, record_expires_at, EVICTION_POLICIES
+from backend.core.invalidation_bus import invalidation_bus
+from backend.core.memory_cache import MemoryLRU
 
 logger = logging.getLogger(__name__)
 
+# Поле записи с видом негативного результата (CACHE_NEGATIVE_*)
+NEGATIVE_FIELD = 'negative'
+
 class BotResponseCache:
-    def __init__(self, cache_dir=None):
+    BUS_NAMESPACE = 'bot_cache'
+
+    def __init__(self, cache_dir=None, storage=None, default_ttl=CACHE_DEFAULT_TTL,
+                 stale_ttl=CACHE_STALE_WHILE_REVALIDATE, max_entries=CACHE_MAX_ENTRIES,
+                 max_bytes=CACHE_MAX_BYTES, eviction_policy=CACHE_EVICTION_POLICY, bus=None):
         if cache_dir is None:
             cache_dir = os.getenv('CACHE_DIR', '/app/cache')
-        
-        self.cache_dir = Path(cache_dir)
-        
-        self.cache_dir.mkdir(parents=True, exist_ok=True)
-        logger.info(f"💾 Инициализирован файловый кеш: {self.cache_dir}")
-        logger.info(f"🧹 Очистка кеша: каждый день в 00:00 (полное удаление всех файлов)")
-    
-    def _get_cache_file_path(self, client_id, telegram_uid):
-        """Генерирует путь к файлу кеша для клиента"""
-        # Безопасное имя файла (убираем потенциально опасные символы)
-        safe_client_id = str(client_id).replace('/', '_').replace('\\', '_')
-        safe_telegram_uid = str(telegram_uid).replace('/', '_').replace('\\', '_')
-        filename = f"client_{safe_client_id}_{safe_telegram_uid}.json"
-        return self.cache_dir / filename
-    
-    def _read_cache_file(self, cache_file_path):
-        """Читает данные из файла кеша"""
+
+        self.cache_dir = cache_dir
+        if storage is None:
+            codec = CacheCodec(CACHE_CODEC, CACHE_COMPRESSION, CACHE_COMPRESS_MIN_BYTES)
+            storage = create_storage(
+                CACHE_STORAGE, cache_dir, CACHE_SQLITE_PATH, codec=codec,
+                redis_url=CACHE_REDIS_URL, redis_prefix=CACHE_REDIS_PREFIX
+            )
+        self.storage = storage
+        self.memory = MemoryLRU(
+            max_entries=CACHE_MEMORY_MAX_ENTRIES,
+            max_bytes=CACHE_MEMORY_MAX_BYTES,
+            ttl=CACHE_SHARED_MEMORY_TTL if storage.shared else CACHE_MEMORY_TTL
+        )
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+
+        # Записи, измененные другими воркерами, сбрасываются из памяти
+        self.bus = bus if bus is not None else invalidation_bus
+        self.bus.subscribe(self.BUS_NAMESPACE, self._on_invalidation)
+
+        # Перевод данных старых версий формата (функцию регистрирует subscription_service)
+        self._migrator = None
+
+        # Обновление истекших записей (функцию регистрирует subscription_service)
+        self._revalidator = None
+        self._revalidating = set()
+        self._revalidate_lock = threading.Lock()
+        self._revalidate_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-revalidate")
+        self._stats = {
+            "fresh_hits": 0,
+            "stale_hits": 0,
+            "negative_hits": 0,
+            "negative_expired": 0,
+            "revalidations": 0,
+            "expired": 0
+        }
+
+        # Ограничение размера: 0 - без ограничения
+        if eviction_policy not in EVICTION_POLICIES:
+            logger.warning(f"⚠️ Неизвестная политика вытеснения '{eviction_policy}', используем lru")
+            eviction_policy = 'lru'
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.eviction_policy = eviction_policy
+        # telegram_uid -> (last_access, hits) с прошлой записи в хранилище
+        self._pending_access = {}
+        self._access_lock = threading.Lock()
+        self._eviction_lock = threading.Lock()
+        self._eviction_stats = {"evicted": 0, "evicted_bytes": 0, "runs": 0, "last_run_at": None}
+
+        # Блокировки записей для set/merge: полосы по хешу ключа - потоки через
+        # threading.Lock, воркеры через flock на lock файл той же полосы
+        self._lock_dir = os.path.join(cache_dir, '.locks')
+        os.makedirs(self._lock_dir, exist_ok=True)
+        self._key_locks = [threading.Lock() for _ in range(LOCK_FILE_STRIPES)]
+        self._remove_legacy_lock_files()
+
+        logger.info(f"💾 Инициализирован кеш ({self.storage.name}): {self.cache_dir}")
+        logger.info(f"⏰ TTL записей: {default_ttl} сек, stale-while-revalidate: {stale_ttl} сек")
+        logger.info(f"📦 Лимит кеша: {max_entries or '∞'} записей, {max_bytes or '∞'} байт, вытеснение {eviction_policy}")
+
+    @staticmethod
+    def _memory_key(telegram_uid):
+        return str(telegram_uid)
+
+    def _on_invalidation(self, key):
+        """Инвалидация от другого воркера: key=None - сбросить всю память"""
+        if key is None:
+            self.memory.clear()
+        else:
+            self.memory.delete(key)
+
+    def _invalidate(self, telegram_uid=None):
+        """Сбрасывает копии записи (или всех записей) в памяти остальных воркеров"""
         try:
-            if not cache_file_path.exists():
-                return None
-            
-            with open(cache_file_path, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-            
-            if not isinstance(cache_data, dict) or 'data' not in cache_data or 'timestamp' not in cache_data:
-                logger.warning(f"⚠️ Некорректная структура файла кеша: {cache_file_path}")
-                return None
-            
-            return cache_data
-            
-        except (json.JSONDecodeError, OSError, KeyError) as e:
-            logger.error(f"❌ Ошибка чтения файла кеша {cache_file_path}: {e}")
-            try:
-                cache_file_path.unlink(missing_ok=True)
-            except OSError:
-                pass
-            return None
-    
-    def _write_cache_file(self, cache_file_path, data):
-        """Записывает данные в файл кеша"""
+            self.bus.publish(self.BUS_NAMESPACE, None if telegram_uid is None else self._memory_key(telegram_uid))
+        except Exception as e:
+            logger.error(f"❌ Ошибка публикации инвалидации кеша: {e}")
+
+    @staticmethod
+    def _make_record(data, ttl=None, expires_at=None):
+        now = time.time()
+        if expires_at is None:
+            expires_at = now + ttl
+        return {
+            'data': data,
+            'created_at': datetime.fromtimestamp(now, timezone.utc).isoformat(),
+            'expires_at': datetime.fromtimestamp(expires_at, timezone.utc).isoformat()
+        }
+
+    @contextmanager
+    def _key_lock(self, telegram_uid):
+        """Эксклюзивная блокировка одной записи (между потоками, воркерами и, для Redis, репликами)"""
+        digest = hashlib.sha1(str(telegram_uid).encode('utf-8')).hexdigest()
+        stripe = int(digest[:8], 16) % len(self._key_locks)
+
+        with self._key_locks[stripe]:
+            with open(os.path.join(self._lock_dir, f"cache_{stripe:03d}.lock"), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    with self.storage.lock(telegram_uid):
+                        yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _remove_legacy_lock_files(self):
+        """Удаляет lock файлы старого формата (cache_<sha1>.lock - по файлу на ключ)"""
+        for name in os.listdir(self._lock_dir):
+            if name.startswith("cache_") and name.endswith(".lock") and len(name) == len("cache_.lock") + 40:
+                try:
+                    os.unlink(os.path.join(self._lock_dir, name))
+                except OSError:
+                    pass
+
+    def _write(self, client_id, telegram_uid, record):
+        """Записывает запись в хранилище и в память, связывает client_id с пользователем"""
         try:
-            cache_data = {
-                'data': data,
-                'timestamp': time.time(),
-                'created_at': datetime.now(timezone.utc).isoformat(),
-                'expires_at': datetime.fromtimestamp(time.time() + 86400, timezone.utc).isoformat()  # Завтра в это же время
-            }
-            
-            # Создаем временный файл для атомарной записи
-            temp_file = cache_file_path.with_suffix('.tmp')
-            
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
-            
-            # Атомарно перемещаем файл
-            temp_file.replace(cache_file_path)
-            
-            logger.info(f"💾 Сохранен кеш файл: {cache_file_path.name}")
-            
-        except (OSError, TypeError) as e:
-            logger.error(f"❌ Ошибка записи файла кеша {cache_file_path}: {e}")
-    
+            self.storage.write(telegram_uid, record)
+            self.storage.link(client_id, telegram_uid)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи кеша для client_id={client_id}: {e}")
+            return False
+
+        entry = {'data': record['data'], 'expires_at': record_expires_at(record)}
+        self.memory.set(self._memory_key(telegram_uid), entry)
+        self._invalidate(telegram_uid)
+        return True
+
+    def set_revalidator(self, revalidator):
+        """
+        Регистрирует функцию фонового обновления записи
+
+        Args:
+            revalidator: fn(client_id, telegram_uid, stale_data) - запрашивает
+                свежие данные и сохраняет их через set()
+        """
+        self._revalidator = revalidator
+
+    def set_migrator(self, migrator):
+        """
+        Регистрирует перевод данных записей в текущую версию формата
+
+        Args:
+            migrator: fn(data) -> новые данные или None, если запись уже в текущем формате
+        """
+        self._migrator = migrator
+
+    def _upgrade(self, client_id, telegram_uid, record):
+        """Переводит запись старого формата и сохраняет ее (срок и возраст не меняются)"""
+        if self._migrator is None or self._migrator(record['data']) is None:
+            return record
+
+        with self._key_lock(telegram_uid):
+            # Под блокировкой перечитываем - запись могли переписать
+            current = self.storage.read(telegram_uid)
+            if current is None:
+                return record
+            upgraded = self._migrator(current['data'])
+            if upgraded is None:
+                return current
+
+            record = {**current, 'data': upgraded}
+            self._write(client_id, telegram_uid, record)
+            logger.info(f"📦 Запись кеша переведена в новый формат: telegram_uid={telegram_uid}")
+            return record
+
+    def migrate_all(self, migrator=None):
+        """
+        Переводит все записи хранилища в текущий формат
+
+        Returns:
+            Количество переведенных записей
+        """
+        migrator = migrator or self._migrator
+        if migrator is None:
+            return 0
+
+        migrated = 0
+        for telegram_uid, record in list(self.storage.iter_entries()):
+            if migrator(record['data']) is None:
+                continue
+            with self._key_lock(telegram_uid):
+                current = self.storage.read(telegram_uid)
+                upgraded = migrator(current['data']) if current is not None else None
+                if upgraded is None:
+                    continue
+                self.storage.write(telegram_uid, {**current, 'data': upgraded})
+                self.memory.delete(self._memory_key(telegram_uid))
+                self._invalidate(telegram_uid)
+                migrated += 1
+
+        logger.info(f"📦 Переведено записей кеша в новый формат: {migrated}")
+        return migrated
+
+    def _read_entry(self, client_id, telegram_uid):
+        """
+        Запись из памяти или из хранилища
+
+        Returns:
+            {'data': ..., 'expires_at': timestamp} или None
+        """
+        self.bus.poll()
+        memory_key = self._memory_key(telegram_uid)
+        entry = self.memory.get(memory_key)
+        if entry is not None:
+            logger.debug(f"⚡ Кеш в памяти: client_id={client_id}, telegram_uid={telegram_uid}")
+            return entry
+
+        record = self.storage.read(telegram_uid)
+        if record is None:
+            return None
+        record = self._upgrade(client_id, telegram_uid, record)
+
+        age_minutes = (time.time() - record_created_at(record)) // 60
+        logger.info(f"⚡ Используем кешированные данные: client_id={client_id}, возраст {age_minutes:.0f} минут")
+
+        entry = {'data': record['data'], 'expires_at': record_expires_at(record)}
+        self.memory.set(memory_key, entry)
+        return entry
+
     def get(self, client_id, telegram_uid):
-        """Получает данные из кеша"""
-        
-        cache_file_path = self._get_cache_file_path(client_id, telegram_uid)
-        cache_data = self._read_cache_file(cache_file_path)
-        
-        if cache_data is None:
-            logger.info(f"🔍 Файл кеша не найден: {cache_file_path.name}")
+        """
+        Получает данные из кеша
+
+        Свежая запись отдается как есть, истекшая в пределах окна
+        stale-while-revalidate - тоже, но с фоновым обновлением
+        """
+        entry = self._read_entry(client_id, telegram_uid)
+        if entry is None:
+            logger.info(f"🔍 Кеш не найден: client_id={client_id}, telegram_uid={telegram_uid}")
             return None
-        
-        current_time = time.time()
-        cached_time = cache_data['timestamp']
-        
-        logger.info(f"⚡ Используем кешированные данные из файла: {cache_file_path.name}")
-        logger.info(f"⏰ Возраст кеша: {(current_time - cached_time) // 60:.0f} минут")
-        return cache_data['data']
-    
-    def set(self, client_id, telegram_uid, data):
-        """Сохраняет данные в кеш"""
-        cache_file_path = self._get_cache_file_path(client_id, telegram_uid)
-        self._write_cache_file(cache_file_path, data)
-        logger.info(f"💾 Сохранены данные в кеш для client_id={client_id}, telegram_uid={telegram_uid}")
-    
+
+        now = time.time()
+        self._note_access(telegram_uid, now)
+        negative_kind = self.negative_kind(entry['data'])
+        if now < entry['expires_at']:
+            self._stats["negative_hits" if negative_kind else "fresh_hits"] += 1
+            return entry['data']
+
+        # Истекший негативный результат - повод спросить заново, а не показывать его дальше
+        if negative_kind:
+            logger.info(f"🔁 Негативная запись '{negative_kind}' истекла: client_id={client_id}")
+            self._stats["negative_expired"] += 1
+            return None
+
+        if now < entry['expires_at'] + self.stale_ttl:
+            self._stats["stale_hits"] += 1
+            self._schedule_revalidation(client_id, telegram_uid, entry['data'])
+            return entry['data']
+
+        logger.info(f"🕰️ Запись кеша устарела: client_id={client_id}, telegram_uid={telegram_uid}")
+        self._stats["expired"] += 1
+        self.delete(client_id, telegram_uid)
+        return None
+
+    def get_entry_info(self, client_id, telegram_uid):
+        """
+        Данные, срок и вид записи без учета свежести (в отличие от get,
+        истекшая запись не запускает фоновое обновление)
+
+        Returns:
+            {'data': ..., 'expires_at': timestamp, 'negative': вид или None} или None, если записи нет
+        """
+        entry = self._read_entry(client_id, telegram_uid)
+        if entry is None:
+            return None
+        return {
+            'data': entry['data'],
+            'expires_at': entry['expires_at'],
+            'negative': self.negative_kind(entry['data'])
+        }
+
+    @staticmethod
+    def negative_kind(data):
+        """Вид негативной записи или None для обычных данных"""
+        return data.get(NEGATIVE_FIELD) if isinstance(data, dict) else None
+
+    @staticmethod
+    def negative_ttl(kind):
+        return CACHE_NEGATIVE_TTLS[kind]
+
+    def negative_field(self, field, value, kind):
+        """Поля для merge: негативное значение поля и срок, до которого ему верить"""
+        return self.timed_field(field, value, self.negative_ttl(kind))
+
+    @staticmethod
+    def timed_field(field, value, ttl):
+        """Поля для merge: значение поля, которому верить ttl секунд (см. is_field_fresh)"""
+        return {field: value, f"{field}_expires_at": time.time() + ttl}
+
+    @staticmethod
+    def is_field_fresh(data, field):
+        """Есть ли в записи поле, записанное через negative_field, и не истек ли его срок"""
+        if not isinstance(data, dict) or field not in data:
+            return False
+        expires_at = data.get(f"{field}_expires_at")
+        return expires_at is not None and time.time() < expires_at
+
+    def _schedule_revalidation(self, client_id, telegram_uid, stale_data):
+        """Запускает одно фоновое обновление на запись"""
+        if self._revalidator is None:
+            return
+
+        # Одно обновление на пользователя, с какого бы client_id его ни запросили
+        key = self._memory_key(telegram_uid)
+        with self._revalidate_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        logger.info(f"🔄 Фоновое обновление кеша: client_id={client_id}, telegram_uid={telegram_uid}")
+        self._revalidate_executor.submit(self._revalidate, key, client_id, telegram_uid, stale_data)
+
+    def _revalidate(self, key, client_id, telegram_uid, stale_data):
+        try:
+            # Другой воркер мог уже обновить запись, пока задача ждала в очереди
+            record = self.storage.read(telegram_uid)
+            if record is not None and time.time() < record_expires_at(record):
+                self.memory.delete(key)
+                return
+
+            self._stats["revalidations"] += 1
+            self._revalidator(client_id, telegram_uid, stale_data)
+        except Exception as e:
+            logger.error(f"❌ Ошибка фонового обновления кеша для client_id={client_id}: {e}")
+        finally:
+            with self._revalidate_lock:
+                self._revalidating.discard(key)
+
+    def set(self, client_id, telegram_uid, data, ttl=None):
+        """
+        Сохраняет данные в кеш (write-through: хранилище и память)
+
+        Args:
+            ttl: Сколько секунд запись свежая (по умолчанию CACHE_DEFAULT_TTL)
+        """
+        record = self._make_record(data, ttl if ttl is not None else self.default_ttl)
+        with self._key_lock(telegram_uid):
+            if self._write(client_id, telegram_uid, record):
+                logger.info(f"💾 Сохранены данные в кеш для client_id={client_id}, telegram_uid={telegram_uid}")
+
+    def merge(self, client_id, telegram_uid, fields, remove=(), ttl=None, create=True):
+        """
+        Атомарно меняет отдельные поля записи: чтение, изменение и одна запись
+        под блокировкой ключа, поэтому параллельные обновления разных полей
+        (ответ бота и данные RemnaWave) не затирают друг друга
+
+        Args:
+            fields: Поля для установки
+            remove: Поля для удаления
+            ttl: Новый TTL записи. По умолчанию срок существующей записи
+                сохраняется (новая запись получает CACHE_DEFAULT_TTL)
+            create: Создавать запись, если ее нет. False - для дополнительных полей
+                (RemnaWave, устройства): без подписок запись читалась бы как попадание
+
+        Returns:
+            Данные записи после изменения или None, если записи нет и create=False
+        """
+        with self._key_lock(telegram_uid):
+            # Читаем из хранилища, а не из памяти - там может быть запись другого воркера
+            record = self.storage.read(telegram_uid)
+            if record is None and not create:
+                return None
+            existing = record['data'] if record is not None else None
+            data = dict(existing) if isinstance(existing, dict) else {}
+
+            for key in remove:
+                data.pop(key, None)
+            data.update(fields)
+
+            if ttl is not None:
+                new_record = self._make_record(data, ttl=ttl)
+            elif record is not None:
+                new_record = self._make_record(data, expires_at=record_expires_at(record))
+            else:
+                new_record = self._make_record(data, ttl=self.default_ttl)
+
+            if self._write(client_id, telegram_uid, new_record):
+                logger.info(f"💾 Обновлены поля кеша {sorted(fields)} для client_id={client_id}, telegram_uid={telegram_uid}")
+            return data
+
+    def update(self, client_id, telegram_uid, **fields):
+        """Атомарно устанавливает поля записи (см. merge)"""
+        return self.merge(client_id, telegram_uid, fields)
+
+    def mark_stale(self, client_id, telegram_uid, patch=None, revalidate=False):
+        """
+        Помечает запись истекшей вместо удаления: до обновления она отдается
+        как устаревшая (stale-while-revalidate), а не превращается в промах
+
+        Args:
+            patch: fn(data) -> data - оптимистичная правка данных под блокировкой ключа
+            revalidate: Запустить фоновое обновление сразу, не дожидаясь чтения
+
+        Returns:
+            Данные записи после правки или None, если записи нет
+        """
+        with self._key_lock(telegram_uid):
+            record = self.storage.read(telegram_uid)
+            if record is None or not isinstance(record['data'], dict):
+                return None
+
+            data = dict(record['data'])
+            if patch is not None:
+                data = patch(data)
+
+            if not self._write(client_id, telegram_uid, self._make_record(data, expires_at=time.time())):
+                return None
+
+        logger.info(f"🕰️ Запись кеша помечена для обновления: client_id={client_id}, telegram_uid={telegram_uid}")
+        if revalidate:
+            self._schedule_revalidation(client_id, telegram_uid, data)
+        return data
+
+    def delete(self, client_id, telegram_uid):
+        """
+        Удаляет кеш пользователя из памяти и из хранилища - сразу для всех
+        его client_id (client_id нужен только для логов)
+
+        Returns:
+            True если запись существовала и удалена
+        """
+        logger.info(f"🗑️ Сброс кеша telegram_uid={telegram_uid} (запрошен для client_id={client_id})")
+        with self._key_lock(telegram_uid):
+            self.memory.delete(self._memory_key(telegram_uid))
+            self._invalidate(telegram_uid)
+            return self.storage.delete(telegram_uid)
+
     def clear_expired(self):
-        """Очищает кеш (теперь просто вызывает полную очистку)"""
-        logger.info("🧹 Вызван clear_expired() - выполняем полную очистку всех файлов")
-        self.clear_all()
-    
+        """Удаляет записи, вышедшие за окно stale-while-revalidate"""
+        try:
+            cutoff = time.time() - self.stale_ttl
+            deleted_count = self.storage.delete_expired(cutoff)
+            logger.info(f"🧹 Очистка устаревших записей кеша: удалено {deleted_count}")
+            return deleted_count
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки устаревших записей кеша: {e}")
+            return 0
+
+    def _note_access(self, telegram_uid, now):
+        """Запоминает обращение к записи (в хранилище попадет перед вытеснением)"""
+        key = self._memory_key(telegram_uid)
+        with self._access_lock:
+            _, hits = self._pending_access.get(key, (now, 0))
+            self._pending_access[key] = (now, hits + 1)
+
+    def flush_access(self):
+        """Записывает накопленные обращения в хранилище"""
+        with self._access_lock:
+            pending, self._pending_access = self._pending_access, {}
+        if not pending:
+            return
+        try:
+            self.storage.record_access(pending)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи статистики обращений к кешу: {e}")
+
+    def _over_limit(self, total_entries, size_bytes):
+        """Причина вытеснения ('max_entries' / 'max_bytes') или None, если кеш в пределах лимитов"""
+        if self.max_entries and total_entries > self.max_entries:
+            return 'max_entries'
+        if self.max_bytes and size_bytes > self.max_bytes:
+            return 'max_bytes'
+        return None
+
+    def _eviction_budget(self, total_entries, size_bytes, batch_size):
+        """Сколько кандидатов взять за один запрос: оценка по превышению лимитов плюс пачка запаса"""
+        budget = 0
+        if self.max_entries and total_entries > self.max_entries:
+            budget = total_entries - self.max_entries
+        if self.max_bytes and size_bytes > self.max_bytes and total_entries:
+            average_size = size_bytes / total_entries
+            budget = max(budget, math.ceil((size_bytes - self.max_bytes) / average_size))
+        return budget + batch_size
+
+    def evict(self, batch_size=CACHE_EVICTION_BATCH, pause=CACHE_EVICTION_PAUSE):
+        """
+        Вытесняет записи, пока кеш не уложится в max_entries / max_bytes.
+        Порядок вытеснения запрашивается у хранилища один раз на запуск (с запасом),
+        дальше список расходуется пачками по batch_size с паузой между ними; каждая
+        запись удаляется под своей блокировкой, поэтому запросы ждут не дольше
+        удаления одного файла. Записи, удаленные за это время другими, пропускаются
+
+        Returns:
+            {'evicted': количество, 'evicted_bytes': байт, 'reasons': {причина: количество}, 'batches': пачек}
+        """
+        report = {"evicted": 0, "evicted_bytes": 0, "reasons": {}, "batches": 0, "policy": self.eviction_policy}
+
+        # Вытеснение в одном потоке за раз - параллельный запуск просто пропускается
+        if not self._eviction_lock.acquire(blocking=False):
+            report["skipped"] = "already_running"
+            return report
+
+        try:
+            self.flush_access()
+            storage_stats = self.storage.stats()
+            total_entries, size_bytes = storage_stats['total_entries'], storage_stats['size_bytes']
+
+            candidates = []
+            evicted_since_fetch = None
+            while self._over_limit(total_entries, size_bytes):
+                if not candidates:
+                    # Повторный запрос - только если оценки не хватило (кеш рос во время
+                    # вытеснения) и прошлый список хоть что-то освободил
+                    if evicted_since_fetch == 0:
+                        break
+                    candidates = self.storage.eviction_candidates(
+                        self.eviction_policy, self._eviction_budget(total_entries, size_bytes, batch_size)
+                    )
+                    evicted_since_fetch = 0
+                    if not candidates:
+                        break
+
+                batch, candidates = candidates[:batch_size], candidates[batch_size:]
+                for telegram_uid, size in batch:
+                    reason = self._over_limit(total_entries, size_bytes)
+                    if reason is None:
+                        break
+
+                    with self._key_lock(telegram_uid):
+                        self.memory.delete(self._memory_key(telegram_uid))
+                        self._invalidate(telegram_uid)
+                        deleted = self.storage.delete(telegram_uid)
+                    if not deleted:
+                        continue
+
+                    total_entries -= 1
+                    size_bytes -= size or 0
+                    evicted_since_fetch += 1
+                    report["evicted"] += 1
+                    report["evicted_bytes"] += size or 0
+                    report["reasons"][reason] = report["reasons"].get(reason, 0) + 1
+
+                report["batches"] += 1
+                time.sleep(pause)
+
+            self._eviction_stats["evicted"] += report["evicted"]
+            self._eviction_stats["evicted_bytes"] += report["evicted_bytes"]
+            self._eviction_stats["runs"] += 1
+            self._eviction_stats["last_run_at"] = time.time()
+        finally:
+            self._eviction_lock.release()
+
+        if report["evicted"]:
+            logger.info(f"📦 Вытеснено записей кеша ({self.eviction_policy}): {report['evicted']}, причины: {report['reasons']}")
+        return report
+
+    def cleanup(self):
+        """
+        Плановая очистка: записи за окном stale-while-revalidate, затем вытеснение по лимитам
+
+        Returns:
+            Отчет evict() с добавленной причиной 'expired'
+        """
+        expired = self.clear_expired()
+        report = self.evict()
+        report["evicted"] += expired
+        if expired:
+            report["reasons"]["expired"] = expired
+        return report
+
     def clear_all(self):
-        """Полностью очищает весь кеш - удаляет ВСЕ файлы"""
+        """Полностью очищает весь кеш - удаляет ВСЕ записи"""
+        self.memory.clear()
+        self._invalidate()
         try:
-            deleted_count = 0
-            
-            # Ищем ВСЕ JSON файлы в директории кеша
-            for cache_file_path in self.cache_dir.glob("client_*.json"):
-                try:
-                    cache_file_path.unlink()
-                    logger.debug(f"🗑️ Удален файл: {cache_file_path.name}")
-                    deleted_count += 1
-                except OSError as e:
-                    logger.error(f"❌ Ошибка удаления файла {cache_file_path.name}: {e}")
-            
-            logger.info(f"🧹 ПОЛНАЯ очистка завершена! Удалено всех файлов: {deleted_count}")
-            
+            deleted_count = self.storage.clear()
+            logger.info(f"🧹 ПОЛНАЯ очистка завершена! Удалено всех записей: {deleted_count}")
+
         except Exception as e:
             logger.error(f"❌ Ошибка полной очистки кеша: {e}")
-    
+
     def get_by_client_id(self, client_id):
-        """Получает данные из кеша по client_id (первый найденный)"""
-        
+        """Получает данные из кеша по client_id (самая свежая запись его Telegram пользователей)"""
+
         try:
-            pattern = f"client_{client_id}_*.json"
-            cache_files = list(self.cache_dir.glob(pattern))
-            
-            for cache_file_path in cache_files:
-                cache_data = self._read_cache_file(cache_file_path)
-                
-                if cache_data is None:
-                    continue
-                
-                current_time = time.time()
-                cached_time = cache_data['timestamp']
-                
-                logger.info(f"🔍 Найдены кешированные данные для client_id {client_id}: {cache_file_path.name}")
-                return cache_data['data']
-            
+            records = [self.storage.read(telegram_uid) for telegram_uid in self.storage.telegram_uids(client_id)]
+            records = [record for record in records if record is not None]
+            if records:
+                cache_data = max(records, key=record_created_at)
+                if time.time() < record_expires_at(cache_data) + self.stale_ttl:
+                    logger.info(f"🔍 Найдены кешированные данные для client_id {client_id}")
+                    return cache_data['data']
+
             logger.info(f"🔍 Актуальные кешированные данные для client_id {client_id} не найдены")
             return None
-            
+
         except Exception as e:
             logger.error(f"❌ Ошибка поиска по client_id {client_id}: {e}")
             return None
-    
+
     def get_stats(self):
         """Возвращает статистику кеша"""
         try:
-            total_files = len(list(self.cache_dir.glob("client_*.json")))
-            cache_size_mb = sum(f.stat().st_size for f in self.cache_dir.glob("client_*.json")) / (1024 * 1024)
-            
+            storage_stats = self.storage.stats()
+            total_entries = storage_stats['total_entries']
+
             return {
-                "total_files": total_files,
-                "cached_items": total_files,
-                "cache_cleanup": "daily at midnight",
+                "total_files": total_entries,
+                "cached_items": total_entries,
+                "indexed_clients": storage_stats['indexed_clients'],
+                "cache_cleanup": f"per-entry TTL {self.default_ttl}s, stale-while-revalidate {self.stale_ttl}s",
                 "cache_dir": str(self.cache_dir),
-                "cache_size_mb": round(cache_size_mb, 2),
-                "cache_type": "JSON файлы"
+                "cache_storage": self.storage.name,
+                "cache_location": storage_stats['location'],
+                "cache_size_mb": round(storage_stats['size_bytes'] / (1024 * 1024), 2),
+                "cache_type": storage_stats['cache_type'],
+                "freshness": {**self._stats, "revalidating": len(self._revalidating)},
+                "eviction": {
+                    **self._eviction_stats,
+                    "policy": self.eviction_policy,
+                    "max_entries": self.max_entries,
+                    "max_bytes": self.max_bytes
+                },
+                "memory": self.memory.get_stats(),
+                "invalidation_bus": self.bus.get_stats()
             }
-            
+
         except Exception as e:
             logger.error(f"❌ Ошибка получения статистики кеша: {e}")
             return {
@@ -176,5 +705,5 @@ class BotResponseCache:
                 "cache_dir": str(self.cache_dir)
             }
 
-# Глобальный экземпляр кеша (очистка каждый день в полночь)
-bot_cache = BotResponseCache()  # Очистка каждый день в полночь
\ No newline at end of file
+# Глобальный экземпляр кеша
+bot_cache = BotResponseCache()
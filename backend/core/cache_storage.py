@@ -0,0 +1,975 @@
+#!/usr/bin/env python3
+"""
+Движки хранения для BotResponseCache (интерфейс CacheStorage)
+- FileCacheStorage: JSON файл на Telegram пользователя (user_{telegram_uid}.json)
+- SQLiteCacheStorage: одна SQLite база в режиме WAL с индексами по
+  telegram_uid, created_at и expires_at
+- RedisCacheStorage: Redis (или совместимый по протоколу сервер), общий
+  для нескольких реплик за балансировщиком. Нужен пакет redis; офлайн
+  работает с любым клиентом с API redis-py (например, fakeredis)
+
+Движок выбирается через CACHE_STORAGE (file / sqlite / redis)
+
+Данные хранятся один раз на telegram_uid: пользователь, написавший из разных
+каналов (разные client_id в UseDesk), делит одну запись. Легкий индекс
+client_id -> telegram_uid нужен для get_by_client_id
+
+Все движки хранят одну и ту же запись:
+    {'data': ..., 'created_at': iso, 'expires_at': iso}
+Старые записи с отдельным 'timestamp' (float) читаются как раньше
+Сериализация - через CacheCodec (cache_codecs): файловый и Redis движки
+кодируют запись целиком, SQLite - только data (остальное лежит в колонках)
+
+Для вытеснения (LRU/LFU) движки хранят время последнего чтения и число
+чтений записи: record_access() пишет накопленные обращения пачкой,
+eviction_candidates() отдает записи в порядке вытеснения
+
+Старые файлы client_{client_id}_{telegram_uid}.json и таблица bot_cache
+переносятся в новый формат при запуске. Разовый перенос файлового кеша в SQLite:
+    python -m backend.core.cache_storage import-json [cache_dir]
+"""
+
+import os
+import sys
+import time
+import json
+import fcntl
+import heapq
+import shutil
+import uuid
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from backend.core.cache_codecs import CacheCodec
+
+logger = logging.getLogger(__name__)
+
+
+def _iso_to_timestamp(value, default):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return default
+
+
+def _timestamp_to_iso(value):
+    return datetime.fromtimestamp(value, timezone.utc).isoformat()
+
+
+def record_created_at(record):
+    """Время создания записи (timestamp); у старых записей - поле 'timestamp'"""
+    if 'timestamp' in record:
+        return record['timestamp']
+    return _iso_to_timestamp(record.get('created_at'), 0.0)
+
+
+def record_expires_at(record):
+    """Время истечения записи (timestamp); старые записи без expires_at живут сутки"""
+    return _iso_to_timestamp(record.get('expires_at'), record_created_at(record) + 86400)
+
+
+def _is_valid_record(record):
+    return isinstance(record, dict) and 'data' in record and ('created_at' in record or 'timestamp' in record)
+
+
+EVICTION_POLICIES = ('lru', 'lfu')
+
+
+def _eviction_key(policy):
+    """Ключ сортировки (last_access, hits) - первыми идут записи, которые вытесняются раньше"""
+    if policy == 'lfu':
+        return lambda access: (access[1], access[0])
+    return lambda access: access[0]
+
+
+class CacheStorage(ABC):
+    """
+    Интерфейс движка хранения. Записи адресуются telegram_uid,
+    client_id используется только в индексе (link / telegram_uids)
+    """
+
+    name = None
+    # Хранилище общее для нескольких хостов: шина инвалидации (mmap) до других
+    # реплик не достает, копии в памяти воркеров там живут до CACHE_SHARED_MEMORY_TTL
+    shared = False
+
+    @abstractmethod
+    def read(self, telegram_uid):
+        """Запись {'data', 'created_at', 'expires_at'} или None"""
+
+    @abstractmethod
+    def write(self, telegram_uid, record):
+        """Сохраняет запись (статистика обращений для вытеснения сохраняется)"""
+
+    @abstractmethod
+    def delete(self, telegram_uid):
+        """Удаляет запись, True если она существовала"""
+
+    @abstractmethod
+    def link(self, client_id, telegram_uid):
+        """Добавляет связь client_id -> telegram_uid в индекс"""
+
+    @abstractmethod
+    def telegram_uids(self, client_id):
+        """Telegram UID, связанные с client_id"""
+
+    @abstractmethod
+    def iter_entries(self):
+        """(telegram_uid, запись) для всех записей"""
+
+    @abstractmethod
+    def record_access(self, accesses):
+        """Сохраняет накопленные обращения {telegram_uid: (last_access, hits)}"""
+
+    @abstractmethod
+    def eviction_candidates(self, policy, limit):
+        """[(telegram_uid, размер в байтах)] - первые limit записей в порядке вытеснения"""
+
+    @abstractmethod
+    def delete_expired(self, cutoff):
+        """Удаляет записи с expires_at раньше cutoff, возвращает количество удаленных"""
+
+    @abstractmethod
+    def clear(self):
+        """Удаляет все записи и индекс, возвращает количество удаленных записей"""
+
+    @abstractmethod
+    def stats(self):
+        """{'total_entries', 'size_bytes', 'indexed_clients', 'location', 'cache_type'}"""
+
+    def lock(self, telegram_uid):
+        """
+        Блокировка записи между хостами. Локальным движкам достаточно
+        блокировок BotResponseCache (потоки + flock), поэтому здесь ничего
+        """
+        return nullcontext()
+
+
+def _safe_name(value):
+    """Безопасное имя файла (убираем потенциально опасные символы)"""
+    return str(value).replace('/', '_').replace('\\', '_')
+
+
+def _remove_empty_dir(path):
+    """Удаляет каталог, если он пуст (непустой или уже удаленный - не ошибка)"""
+    try:
+        path.rmdir()
+    except OSError:
+        pass
+
+
+class FileCacheStorage(CacheStorage):
+    """
+    Каждый Telegram пользователь в отдельном JSON файле, индекс - файлы-метки
+    clients/{client_id}/{telegram_uid} и обратные links/{telegram_uid}/{client_id}
+    (по ним delete() убирает связи пользователя без обхода всех клиентов)
+    """
+
+    name = "file"
+
+    def __init__(self, cache_dir, codec=None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_dir = self.cache_dir / "clients"
+        self.index_dir.mkdir(exist_ok=True)
+        self.links_dir = self.cache_dir / "links"
+        # telegram_uid -> [last_access, hits]; без записи last_access = mtime файла
+        self.access_path = self.cache_dir / ".access.json"
+        self.codec = codec or CacheCodec()
+
+        # Сначала обратные метки: перенос старых файлов уже пишет связи через link()
+        self._build_links()
+        self.migrate_legacy_files()
+
+    def file_path(self, telegram_uid):
+        """Путь к файлу кеша пользователя"""
+        return self.cache_dir / f"user_{_safe_name(telegram_uid)}.json"
+
+    def _read_file(self, cache_file_path):
+        """Читает запись из файла кеша"""
+        try:
+            with open(cache_file_path, 'rb') as f:
+                record = self.codec.decode(f.read())
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            logger.error(f"❌ Ошибка чтения файла кеша {cache_file_path}: {e}")
+            try:
+                cache_file_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+            return None
+
+        if not _is_valid_record(record):
+            logger.warning(f"⚠️ Некорректная структура файла кеша: {cache_file_path}")
+            return None
+
+        return record
+
+    def _write_file(self, cache_file_path, record):
+        # Создаем временный файл для атомарной записи
+        temp_file = cache_file_path.with_suffix('.tmp')
+        with open(temp_file, 'wb') as f:
+            f.write(self.codec.encode(record))
+
+        # Атомарно перемещаем файл
+        temp_file.replace(cache_file_path)
+
+    def read(self, telegram_uid):
+        return self._read_file(self.file_path(telegram_uid))
+
+    def write(self, telegram_uid, record):
+        cache_file_path = self.file_path(telegram_uid)
+        self._write_file(cache_file_path, record)
+        logger.info(f"💾 Сохранен кеш файл: {cache_file_path.name}")
+
+    def delete(self, telegram_uid):
+        cache_file_path = self.file_path(telegram_uid)
+        self._unlink_index(telegram_uid)
+        try:
+            cache_file_path.unlink()
+            logger.info(f"🗑️ Удален файл кеша: {cache_file_path.name}")
+            return True
+        except FileNotFoundError:
+            logger.info(f"🔍 Файл кеша не найден для удаления: {cache_file_path.name}")
+            return False
+
+    @staticmethod
+    def _touch(marker):
+        # Пустой каталог метки может удалить параллельная чистка - тогда создаем заново
+        for _ in range(3):
+            try:
+                marker.parent.mkdir(parents=True, exist_ok=True)
+                marker.touch()
+                return
+            except FileNotFoundError:
+                continue
+        logger.warning(f"⚠️ Не удалось создать метку индекса: {marker}")
+
+    def link(self, client_id, telegram_uid):
+        """Добавляет связь client_id -> telegram_uid в индекс"""
+        marker = self.index_dir / _safe_name(client_id) / _safe_name(telegram_uid)
+        if marker.exists():
+            return
+        self._touch(self.links_dir / _safe_name(telegram_uid) / _safe_name(client_id))
+        self._touch(marker)
+
+    def _unlink_index(self, telegram_uid):
+        """Удаляет связи пользователя из индекса и опустевшие каталоги клиентов"""
+        telegram_uid = _safe_name(telegram_uid)
+        uid_links = self.links_dir / telegram_uid
+        try:
+            client_ids = [link.name for link in uid_links.iterdir()]
+        except FileNotFoundError:
+            return
+
+        for client_id in client_ids:
+            (self.index_dir / client_id / telegram_uid).unlink(missing_ok=True)
+            _remove_empty_dir(self.index_dir / client_id)
+            (uid_links / client_id).unlink(missing_ok=True)
+        _remove_empty_dir(uid_links)
+
+    def _build_links(self):
+        """Строит обратные метки links/ для индекса, созданного до их появления"""
+        if self.links_dir.exists():
+            return
+
+        with open(self.cache_dir / ".migrate.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.links_dir.exists():
+                    return
+                # Собираем во временном каталоге - недостроенный links/ не появится
+                temp_dir = self.cache_dir / f"links.tmp-{os.getpid()}"
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                temp_dir.mkdir()
+                for client_id, telegram_uid in self.iter_index():
+                    (temp_dir / telegram_uid).mkdir(exist_ok=True)
+                    (temp_dir / telegram_uid / client_id).touch()
+                temp_dir.rename(self.links_dir)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def telegram_uids(self, client_id):
+        """Telegram UID, связанные с client_id"""
+        try:
+            return [marker.name for marker in (self.index_dir / _safe_name(client_id)).iterdir()]
+        except FileNotFoundError:
+            return []
+
+    def _read_access(self):
+        try:
+            with open(self.access_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (ValueError, OSError) as e:
+            logger.warning(f"⚠️ Сброшена статистика обращений к кешу: {e}")
+            return {}
+
+    def record_access(self, accesses):
+        """
+        Сохраняет накопленные обращения
+
+        Args:
+            accesses: {telegram_uid: (last_access, hits)}
+        """
+        with open(self.cache_dir / ".access.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                stats = self._read_access()
+                for telegram_uid, (last_access, hits) in accesses.items():
+                    current = stats.get(str(telegram_uid), [0, 0])
+                    stats[str(telegram_uid)] = [max(current[0], last_access), current[1] + hits]
+
+                # Заодно забываем удаленные записи
+                stats = {uid: value for uid, value in stats.items() if self.file_path(uid).exists()}
+
+                temp_file = self.access_path.with_suffix('.tmp')
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump(stats, f)
+                temp_file.replace(self.access_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def eviction_candidates(self, policy, limit):
+        """[(telegram_uid, размер в байтах)] - первые limit записей в порядке вытеснения"""
+        access = self._read_access()
+
+        def scan():
+            for cache_file_path in self.cache_dir.glob("user_*.json"):
+                try:
+                    stat = cache_file_path.stat()
+                except OSError:
+                    continue
+                telegram_uid = cache_file_path.stem[len("user_"):]
+                last_access, hits = access.get(telegram_uid, (stat.st_mtime, 0))
+                yield (last_access, hits), telegram_uid, stat.st_size
+
+        # Один проход по каталогу, в памяти - только limit кандидатов
+        order = _eviction_key(policy)
+        candidates = heapq.nsmallest(limit, scan(), key=lambda candidate: order(candidate[0]))
+        return [(telegram_uid, size) for _, telegram_uid, size in candidates]
+
+    def iter_entries(self):
+        """(telegram_uid, запись) для всех записей"""
+        for cache_file_path in self.cache_dir.glob("user_*.json"):
+            record = self._read_file(cache_file_path)
+            if record is not None:
+                yield cache_file_path.stem[len("user_"):], record
+
+    def iter_index(self):
+        """(client_id, telegram_uid) для всех связей индекса"""
+        for client_dir in self.index_dir.iterdir():
+            try:
+                markers = list(client_dir.iterdir())
+            except FileNotFoundError:
+                continue
+            for marker in markers:
+                yield client_dir.name, marker.name
+
+    def _prune_index(self, keep):
+        """Удаляет метки (прямые и обратные) пользователей, для которых keep() ложно, и пустые каталоги"""
+        for client_dir in list(self.index_dir.iterdir()):
+            try:
+                markers = list(client_dir.iterdir())
+            except FileNotFoundError:
+                continue
+            for marker in markers:
+                if not keep(marker.name):
+                    marker.unlink(missing_ok=True)
+            _remove_empty_dir(client_dir)
+
+        if not self.links_dir.exists():
+            return
+        for uid_links in list(self.links_dir.iterdir()):
+            if keep(uid_links.name):
+                continue
+            shutil.rmtree(uid_links, ignore_errors=True)
+
+    def delete_expired(self, cutoff):
+        """Удаляет записи с expires_at раньше cutoff, возвращает количество удаленных"""
+        deleted_count = 0
+        for cache_file_path in self.cache_dir.glob("user_*.json"):
+            record = self._read_file(cache_file_path)
+            if record is not None and record_expires_at(record) >= cutoff:
+                continue
+            try:
+                cache_file_path.unlink(missing_ok=True)
+                deleted_count += 1
+            except OSError as e:
+                logger.error(f"❌ Ошибка удаления файла {cache_file_path.name}: {e}")
+
+        # Метки индекса без записи больше не нужны
+        self._prune_index(lambda telegram_uid: self.file_path(telegram_uid).exists())
+
+        return deleted_count
+
+    def clear(self):
+        """Удаляет все записи и индекс, возвращает количество удаленных записей"""
+        deleted_count = 0
+        for cache_file_path in self.cache_dir.glob("user_*.json"):
+            try:
+                cache_file_path.unlink()
+                logger.debug(f"🗑️ Удален файл: {cache_file_path.name}")
+                deleted_count += 1
+            except OSError as e:
+                logger.error(f"❌ Ошибка удаления файла {cache_file_path.name}: {e}")
+
+        self._prune_index(lambda telegram_uid: False)
+
+        return deleted_count
+
+    def stats(self):
+        total_entries = 0
+        size_bytes = 0
+        for cache_file_path in self.cache_dir.glob("user_*.json"):
+            try:
+                size_bytes += cache_file_path.stat().st_size
+                total_entries += 1
+            except OSError:
+                pass
+
+        return {
+            "total_entries": total_entries,
+            "size_bytes": size_bytes,
+            "indexed_clients": sum(1 for _ in self.index_dir.iterdir()),
+            "location": str(self.cache_dir),
+            "cache_type": "JSON файлы",
+        }
+
+    def migrate_legacy_files(self):
+        """
+        Переносит старые client_{client_id}_{telegram_uid}.json в user_{telegram_uid}.json
+        и индекс. Если у пользователя несколько старых файлов, остается самый свежий
+
+        Returns:
+            Количество перенесенных файлов
+        """
+        if not any(self.cache_dir.glob("client_*.json")):
+            return 0
+
+        migrated = 0
+        # Воркеры стартуют одновременно - переносит один, остальные ждут
+        with open(self.cache_dir / ".migrate.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                for cache_file_path in self.cache_dir.glob("client_*.json"):
+                    record = self._read_file(cache_file_path)
+
+                    # client_{client_id}_{telegram_uid}.json; telegram_uid без "_"
+                    client_id, _, telegram_uid = cache_file_path.stem[len("client_"):].rpartition('_')
+                    if record is not None and client_id and telegram_uid:
+                        current = self.read(telegram_uid)
+                        if current is None or record_created_at(current) < record_created_at(record):
+                            self._write_file(self.file_path(telegram_uid), record)
+                        self.link(client_id, telegram_uid)
+                        migrated += 1
+
+                    cache_file_path.unlink(missing_ok=True)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        logger.info(f"📦 Перенесено старых файлов кеша в формат user_<telegram_uid>: {migrated}")
+        return migrated
+
+
+class SQLiteCacheStorage(CacheStorage):
+    """Все пользователи в одной SQLite базе (WAL - читатели не блокируют писателя)"""
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS user_cache (
+            telegram_uid TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            timestamp REAL NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL DEFAULT 0,
+            hits INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_cache_created_at ON user_cache (created_at);
+        CREATE INDEX IF NOT EXISTS idx_user_cache_expires_at ON user_cache (expires_at);
+        -- Поиск по client_id обслуживает первичный ключ (client_id - его префикс)
+        CREATE TABLE IF NOT EXISTS client_index (
+            client_id TEXT NOT NULL,
+            telegram_uid TEXT NOT NULL,
+            PRIMARY KEY (client_id, telegram_uid)
+        );
+        CREATE INDEX IF NOT EXISTS idx_client_index_telegram_uid ON client_index (telegram_uid);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, db_path, import_from=None, codec=None):
+        """
+        Args:
+            db_path: Путь к файлу базы
+            codec: CacheCodec для колонки data
+            import_from: Каталог файлового кеша - переносится один раз
+                при первом запуске (отметка хранится в таблице meta)
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self.codec = codec or CacheCodec()
+
+        with self._connection() as conn:
+            conn.executescript(self.SCHEMA)
+            self._migrate_access_columns(conn)
+            self._migrate_client_table(conn)
+
+        if import_from is not None and not self._get_meta('json_imported_at'):
+            self.import_json_files(import_from)
+
+    def _connection(self):
+        """Соединение на поток (sqlite3 соединения нельзя делить между потоками)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate_access_columns(conn):
+        """Добавляет колонки last_access/hits в таблицу, созданную до вытеснения"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(user_cache)")}
+        if 'last_access' not in columns:
+            conn.execute("ALTER TABLE user_cache ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+            conn.execute("UPDATE user_cache SET last_access = timestamp")
+        if 'hits' not in columns:
+            conn.execute("ALTER TABLE user_cache ADD COLUMN hits INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_cache_last_access ON user_cache (last_access)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_cache_hits ON user_cache (hits, last_access)")
+
+    @staticmethod
+    def _migrate_client_table(conn):
+        """Переносит старую таблицу bot_cache (ключ client_id + telegram_uid) в user_cache"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bot_cache'"
+        ).fetchone()
+        if not exists:
+            return
+
+        # По порядку timestamp: для каждого telegram_uid остается самая свежая запись
+        conn.execute(
+            "INSERT OR REPLACE INTO user_cache (telegram_uid, data, timestamp, created_at, expires_at, last_access) "
+            "SELECT telegram_uid, data, timestamp, created_at, expires_at, timestamp FROM bot_cache ORDER BY timestamp"
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO client_index (client_id, telegram_uid) "
+            "SELECT client_id, telegram_uid FROM bot_cache"
+        )
+        conn.execute("DROP TABLE bot_cache")
+        logger.info("📦 Таблица bot_cache перенесена в user_cache и client_index")
+
+    def _get_meta(self, key):
+        row = self._connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _row_to_record(self, row):
+        data, timestamp, created_at, expires_at = row
+        return {
+            'data': self.codec.decode(data),
+            'created_at': _timestamp_to_iso(created_at),
+            'expires_at': _timestamp_to_iso(expires_at),
+        }
+
+    def _record_params(self, telegram_uid, record):
+        # Колонка timestamp осталась от старой схемы таблицы - дублирует created_at
+        created_at = record_created_at(record)
+        return (
+            str(telegram_uid),
+            sqlite3.Binary(self.codec.encode(record['data'])),
+            created_at,
+            created_at,
+            record_expires_at(record),
+            created_at,
+        )
+
+    def read(self, telegram_uid):
+        try:
+            row = self._connection().execute(
+                "SELECT data, timestamp, created_at, expires_at FROM user_cache WHERE telegram_uid = ?",
+                (str(telegram_uid),)
+            ).fetchone()
+            return self._row_to_record(row) if row else None
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"❌ Ошибка чтения SQLite кеша для telegram_uid={telegram_uid}: {e}")
+            return None
+
+    def write(self, telegram_uid, record):
+        with self._connection() as conn:
+            # Перезапись сохраняет статистику обращений (last_access, hits)
+            conn.execute(
+                "INSERT INTO user_cache (telegram_uid, data, timestamp, created_at, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (telegram_uid) DO UPDATE SET data = excluded.data, timestamp = excluded.timestamp, "
+                "created_at = excluded.created_at, expires_at = excluded.expires_at",
+                self._record_params(telegram_uid, record)
+            )
+        logger.info(f"💾 Сохранен кеш в SQLite: telegram_uid={telegram_uid}")
+
+    def delete(self, telegram_uid):
+        with self._connection() as conn:
+            cursor = conn.execute("DELETE FROM user_cache WHERE telegram_uid = ?", (str(telegram_uid),))
+            conn.execute("DELETE FROM client_index WHERE telegram_uid = ?", (str(telegram_uid),))
+        return cursor.rowcount > 0
+
+    def link(self, client_id, telegram_uid):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO client_index (client_id, telegram_uid) VALUES (?, ?)",
+                (str(client_id), str(telegram_uid))
+            )
+
+    def record_access(self, accesses):
+        with self._connection() as conn:
+            conn.executemany(
+                "UPDATE user_cache SET last_access = MAX(last_access, ?), hits = hits + ? WHERE telegram_uid = ?",
+                [(last_access, hits, str(telegram_uid)) for telegram_uid, (last_access, hits) in accesses.items()]
+            )
+
+    def eviction_candidates(self, policy, limit):
+        order = "hits, last_access" if policy == 'lfu' else "last_access"
+        rows = self._connection().execute(
+            f"SELECT telegram_uid, LENGTH(data) FROM user_cache ORDER BY {order} LIMIT ?", (limit,)
+        ).fetchall()
+        return [(telegram_uid, size) for telegram_uid, size in rows]
+
+    def iter_entries(self):
+        rows = self._connection().execute(
+            "SELECT telegram_uid, data, timestamp, created_at, expires_at FROM user_cache"
+        ).fetchall()
+        for row in rows:
+            try:
+                yield row[0], self._row_to_record(row[1:])
+            except ValueError as e:
+                logger.error(f"❌ Ошибка чтения SQLite кеша для telegram_uid={row[0]}: {e}")
+
+    def telegram_uids(self, client_id):
+        rows = self._connection().execute(
+            "SELECT telegram_uid FROM client_index WHERE client_id = ?", (str(client_id),)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def delete_expired(self, cutoff):
+        with self._connection() as conn:
+            cursor = conn.execute("DELETE FROM user_cache WHERE expires_at < ?", (cutoff,))
+            conn.execute(
+                "DELETE FROM client_index WHERE telegram_uid NOT IN (SELECT telegram_uid FROM user_cache)"
+            )
+        return cursor.rowcount
+
+    def clear(self):
+        with self._connection() as conn:
+            cursor = conn.execute("DELETE FROM user_cache")
+            conn.execute("DELETE FROM client_index")
+        return cursor.rowcount
+
+    def stats(self):
+        conn = self._connection()
+        total_entries, size_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM user_cache"
+        ).fetchone()
+        indexed_clients = conn.execute("SELECT COUNT(DISTINCT client_id) FROM client_index").fetchone()[0]
+        return {
+            "total_entries": total_entries,
+            "size_bytes": size_bytes,
+            "indexed_clients": indexed_clients,
+            "location": str(self.db_path),
+            "cache_type": "SQLite (WAL)",
+        }
+
+    def import_json_files(self, json_dir):
+        """
+        Переносит записи и индекс файлового кеша в базу (файлы не удаляются,
+        старые client_*.json сначала переводятся в формат user_*.json)
+
+        Returns:
+            Количество перенесенных записей
+        """
+        file_storage = FileCacheStorage(json_dir, codec=self.codec)
+        imported = 0
+
+        with self._connection() as conn:
+            for telegram_uid, record in file_storage.iter_entries():
+                conn.execute(
+                    "INSERT OR IGNORE INTO user_cache (telegram_uid, data, timestamp, created_at, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    self._record_params(telegram_uid, record)
+                )
+                imported += 1
+
+            conn.executemany(
+                "INSERT OR IGNORE INTO client_index (client_id, telegram_uid) VALUES (?, ?)",
+                list(file_storage.iter_index())
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported_at', ?)",
+                (str(time.time()),)
+            )
+
+        logger.info(f"📦 Перенесено записей из JSON файлов в SQLite: {imported}")
+        return imported
+
+
+class RedisCacheStorage(CacheStorage):
+    """
+    Записи в Redis, общие для всех реплик:
+        {prefix}user:{telegram_uid}  - закодированная запись
+        {prefix}client:{client_id}   - set telegram_uid (индекс)
+        {prefix}links:{telegram_uid} - set client_id (для чистки индекса)
+        {prefix}expires / lru / lfu  - zset: expires_at, last_access, hits
+        {prefix}sizes                - hash telegram_uid -> размер записи
+    """
+
+    name = "redis"
+    shared = True
+
+    def __init__(self, url=None, prefix="usedesk:cache:", client=None, codec=None, lock_timeout=30):
+        """
+        Args:
+            url: redis://host:port/db (если client не передан)
+            prefix: Префикс ключей - несколько окружений на одном сервере
+            client: Готовый клиент с API redis-py (fakeredis для офлайн проверок)
+            lock_timeout: Через сколько секунд блокировка записи снимается сама
+        """
+        if client is None:
+            if redis is None:
+                raise RuntimeError("Пакет redis не установлен (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.url = url
+        self.prefix = prefix
+        self.codec = codec or CacheCodec()
+        self.lock_timeout = lock_timeout
+
+    def _key(self, *parts):
+        return self.prefix + ":".join(str(part) for part in parts)
+
+    @staticmethod
+    def _text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+    def read(self, telegram_uid):
+        raw = self.client.get(self._key("user", telegram_uid))
+        if raw is None:
+            return None
+        try:
+            record = self.codec.decode(raw)
+        except ValueError as e:
+            logger.error(f"❌ Ошибка чтения Redis кеша для telegram_uid={telegram_uid}: {e}")
+            self.delete(telegram_uid)
+            return None
+        return record if _is_valid_record(record) else None
+
+    def write(self, telegram_uid, record):
+        telegram_uid = str(telegram_uid)
+        payload = self.codec.encode(record)
+        pipe = self.client.pipeline()
+        pipe.set(self._key("user", telegram_uid), payload)
+        pipe.zadd(self._key("expires"), {telegram_uid: record_expires_at(record)})
+        pipe.hset(self._key("sizes"), telegram_uid, len(payload))
+        # Перезапись сохраняет статистику обращений (last_access, hits)
+        pipe.zadd(self._key("lru"), {telegram_uid: record_created_at(record)}, nx=True)
+        pipe.zadd(self._key("lfu"), {telegram_uid: 0}, nx=True)
+        pipe.execute()
+        logger.info(f"💾 Сохранен кеш в Redis: telegram_uid={telegram_uid}")
+
+    def _delete_many(self, telegram_uids):
+        """Удаляет записи и их связи в индексе, возвращает количество удаленных записей"""
+        telegram_uids = [str(telegram_uid) for telegram_uid in telegram_uids]
+        if not telegram_uids:
+            return 0
+
+        links = self.client.pipeline()
+        for telegram_uid in telegram_uids:
+            links.smembers(self._key("links", telegram_uid))
+        client_ids = links.execute()
+
+        pipe = self.client.pipeline()
+        for telegram_uid, linked in zip(telegram_uids, client_ids):
+            pipe.delete(self._key("user", telegram_uid))
+            for client_id in linked:
+                pipe.srem(self._key("client", self._text(client_id)), telegram_uid)
+            pipe.delete(self._key("links", telegram_uid))
+        pipe.zrem(self._key("expires"), *telegram_uids)
+        pipe.zrem(self._key("lru"), *telegram_uids)
+        pipe.zrem(self._key("lfu"), *telegram_uids)
+        pipe.hdel(self._key("sizes"), *telegram_uids)
+        results = pipe.execute()
+
+        # Результаты DEL user:* идут первыми в блоке каждого пользователя
+        deleted_count = 0
+        position = 0
+        for linked in client_ids:
+            deleted_count += results[position]
+            position += len(linked) + 2
+        return deleted_count
+
+    def delete(self, telegram_uid):
+        return self._delete_many([telegram_uid]) > 0
+
+    def link(self, client_id, telegram_uid):
+        pipe = self.client.pipeline()
+        pipe.sadd(self._key("client", client_id), str(telegram_uid))
+        pipe.sadd(self._key("links", telegram_uid), str(client_id))
+        pipe.execute()
+
+    def telegram_uids(self, client_id):
+        return [self._text(telegram_uid) for telegram_uid in self.client.smembers(self._key("client", client_id))]
+
+    def iter_entries(self):
+        for telegram_uid in self.client.hkeys(self._key("sizes")):
+            telegram_uid = self._text(telegram_uid)
+            record = self.read(telegram_uid)
+            if record is not None:
+                yield telegram_uid, record
+
+    def record_access(self, accesses):
+        pipe = self.client.pipeline()
+        for telegram_uid, (last_access, hits) in accesses.items():
+            # xx: статистика только для существующих записей
+            pipe.zadd(self._key("lru"), {str(telegram_uid): last_access}, xx=True, gt=True)
+            pipe.zadd(self._key("lfu"), {str(telegram_uid): hits}, xx=True, incr=True)
+        pipe.execute()
+
+    def eviction_candidates(self, policy, limit):
+        order_key = self._key("lfu" if policy == 'lfu' else "lru")
+        telegram_uids = [self._text(telegram_uid) for telegram_uid in self.client.zrange(order_key, 0, limit - 1)]
+        if not telegram_uids:
+            return []
+        sizes = self.client.hmget(self._key("sizes"), telegram_uids)
+        return [(telegram_uid, int(size or 0)) for telegram_uid, size in zip(telegram_uids, sizes)]
+
+    def delete_expired(self, cutoff):
+        deleted_count = 0
+        while True:
+            # Пачками, чтобы не держать сервер одной большой командой
+            expired = self.client.zrangebyscore(self._key("expires"), "-inf", f"({cutoff}", start=0, num=500)
+            if not expired:
+                return deleted_count
+            deleted_count += self._delete_many([self._text(telegram_uid) for telegram_uid in expired])
+
+    def clear(self):
+        total_entries = self.client.hlen(self._key("sizes"))
+        batch = []
+        for key in self.client.scan_iter(match=f"{self.prefix}*", count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                self.client.delete(*batch)
+                batch = []
+        if batch:
+            self.client.delete(*batch)
+        return total_entries
+
+    def stats(self):
+        sizes = self.client.hvals(self._key("sizes"))
+        indexed_clients = sum(1 for _ in self.client.scan_iter(match=self._key("client", "*"), count=500))
+        return {
+            "total_entries": len(sizes),
+            "size_bytes": sum(int(size) for size in sizes),
+            "indexed_clients": indexed_clients,
+            "location": f"{self.url or 'redis'} ({self.prefix}*)",
+            "cache_type": "Redis",
+        }
+
+    @contextmanager
+    def lock(self, telegram_uid):
+        """
+        Блокировка записи между репликами: SET NX с истечением, снятие -
+        через WATCH/MULTI (без Lua, чтобы работать и с простыми стендами)
+        """
+        key = self._key("lock", telegram_uid)
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.lock_timeout
+        while not self.client.set(key, token, nx=True, px=int(self.lock_timeout * 1000)):
+            if time.time() >= deadline:
+                logger.warning(f"⚠️ Не дождались блокировки Redis для telegram_uid={telegram_uid}, продолжаем без нее")
+                token = None
+                break
+            time.sleep(0.01)
+
+        try:
+            yield
+        finally:
+            if token is not None:
+                self._release_lock(key, token)
+
+    def _release_lock(self, key, token):
+        """Снимает блокировку, только если она все еще наша (могла истечь и достаться другому)"""
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if self._text(pipe.get(key) or b"") == token:
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.execute()
+                else:
+                    pipe.unwatch()
+            except Exception as e:
+                # WatchError - ключ изменился между WATCH и EXEC (блокировка истекла и
+                # досталась другому). Класс исключения не берем из модуля redis: с
+                # офлайн стендом пакета может не быть, а ошибка не должна выйти из lock()
+                logger.warning(f"⚠️ Блокировка Redis {key} не снята: {type(e).__name__}: {e}")
+
+
+def create_storage(kind, cache_dir, sqlite_path=None, codec=None, redis_url=None, redis_prefix=None):
+    """
+    Создает движок хранения по имени ('file', 'sqlite' или 'redis')
+
+    Raises:
+        ValueError: Выбран redis, но нет пакета redis или CACHE_REDIS_URL -
+            молча уйти на локальные файлы значит разойтись с остальными репликами
+    """
+    if kind == RedisCacheStorage.name:
+        if redis is None:
+            raise ValueError("❌ CACHE_STORAGE=redis, но пакет redis не установлен (pip install redis)")
+        if not redis_url:
+            raise ValueError("❌ CACHE_STORAGE=redis, но не задан CACHE_REDIS_URL")
+        return RedisCacheStorage(redis_url, prefix=redis_prefix or "usedesk:cache:", codec=codec)
+
+    if kind == SQLiteCacheStorage.name:
+        if sqlite_path is None:
+            sqlite_path = os.path.join(cache_dir, 'bot_cache.sqlite3')
+        return SQLiteCacheStorage(sqlite_path, import_from=cache_dir, codec=codec)
+
+    if kind != FileCacheStorage.name:
+        logger.warning(f"⚠️ Неизвестный движок кеша '{kind}', используем файловый")
+
+    return FileCacheStorage(cache_dir, codec=codec)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'import-json':
+        print("Использование: python -m backend.core.cache_storage import-json [cache_dir] [sqlite_path]")
+        sys.exit(1)
+
+    from backend.config.settings import CACHE_DIR, CACHE_SQLITE_PATH
+
+    cache_dir = sys.argv[2] if len(sys.argv) > 2 else CACHE_DIR
+    sqlite_path = sys.argv[3] if len(sys.argv) > 3 else CACHE_SQLITE_PATH
+
+    storage = SQLiteCacheStorage(sqlite_path)
+    imported = storage.import_json_files(cache_dir)
+    print(f"✅ Перенесено записей: {imported} → {sqlite_path}")
+
+
+if __name__ == "__main__":
+    main()
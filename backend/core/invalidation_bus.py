@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Шина инвалидаций между воркерами gunicorn без внешних сервисов
+Общий файл в каталоге кеша отображается в память (mmap, MAP_SHARED):
+счетчик поколений + кольцевой буфер последних инвалидаций.
+
+Публикация: под flock записывается слот (поколение, namespace, ключ)
+и увеличивается счетчик. Чтение: перед обращением к кешу в памяти воркер
+сравнивает счетчик со своим (чтение 8 байт без блокировки) и, если он
+изменился, применяет новые инвалидации. Поэтому чужая инвалидация видна
+уже на следующем чтении, без фонового потока и задержки опроса.
+Если воркер отстал больше, чем на размер буфера, он сбрасывает все свои кеши.
+Файл открывается заново в каждом процессе (после fork, например gunicorn
+--preload): flock на унаследованном общем описании файла не исключает воркеров
+"""
+
+import os
+import json
+import mmap
+import fcntl
+import struct
+import logging
+import threading
+from pathlib import Path
+
+from backend.config.constants import CACHE_INVALIDATION_SLOTS, CACHE_INVALIDATION_SLOT_SIZE
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('<Q')
+# Поколение слота и длина сообщения
+_SLOT_HEADER = struct.Struct('<QH')
+
+
+class InvalidationBus:
+    def __init__(self, bus_file=None, slots=CACHE_INVALIDATION_SLOTS, slot_size=CACHE_INVALIDATION_SLOT_SIZE):
+        if bus_file is None:
+            bus_file = os.path.join(os.getenv('CACHE_DIR', '/app/cache'), '.invalidation.bus')
+
+        self.bus_file = Path(bus_file)
+        self.slots = slots
+        self.slot_size = slot_size
+        self.size = _HEADER.size + slots * slot_size
+
+        self._handlers = {}
+        self._map = None
+        self._fd = None
+        self._pid = None
+        self._seen = 0
+        self._lock = threading.Lock()
+        self._stats = {"published": 0, "received": 0, "overflows": 0}
+
+    def _open(self):
+        """Открывает (и при необходимости создает) файл шины. None - шина недоступна"""
+        if self._map is not None and self._pid == os.getpid():
+            return self._map
+
+        with self._lock:
+            if self._map is not None and self._pid == os.getpid():
+                return self._map
+            # Процесс унаследовал шину от родителя вместе с его кешем в памяти -
+            # открываем свои fd и mmap, но продолжаем с его поколения
+            inherited = self._map is not None
+            if inherited:
+                self._close_inherited()
+            try:
+                self.bus_file.parent.mkdir(parents=True, exist_ok=True)
+                fd = os.open(self.bus_file, os.O_RDWR | os.O_CREAT, 0o660)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size < self.size:
+                        os.ftruncate(fd, self.size)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+                bus_map = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+                # Старые инвалидации (до запуска процесса) не нужны - кеш в памяти пуст
+                if not inherited:
+                    self._seen = _HEADER.unpack_from(bus_map, 0)[0]
+                self._fd, self._map, self._pid = fd, bus_map, os.getpid()
+                logger.info(f"📡 Шина инвалидаций кеша: {self.bus_file}")
+            except OSError as e:
+                logger.error(f"❌ Шина инвалидаций недоступна ({self.bus_file}): {e}")
+                return None
+        return self._map
+
+    def _close_inherited(self):
+        """Закрывает унаследованные от родителя fd и mmap (у родителя они остаются)"""
+        try:
+            self._map.close()
+            os.close(self._fd)
+        except (OSError, ValueError):
+            pass
+        self._fd, self._map, self._pid = None, None, None
+
+    def subscribe(self, namespace, handler):
+        """
+        Регистрирует обработчик инвалидаций
+
+        Args:
+            namespace: Имя кеша ('bot_cache', 'outline', ...)
+            handler: fn(key) - сбросить ключ, key=None - сбросить весь кеш
+        """
+        self._handlers.setdefault(namespace, []).append(handler)
+        self._open()
+
+    def publish(self, namespace, key=None):
+        """Сообщает остальным воркерам, что ключ (или весь кеш при key=None) устарел"""
+        bus_map = self._open()
+        if bus_map is None:
+            return
+
+        payload = json.dumps([os.getpid(), namespace, key], ensure_ascii=False).encode('utf-8')
+        if len(payload) > self.slot_size - _SLOT_HEADER.size:
+            # Ключ не помещается в слот - сбрасываем весь namespace
+            payload = json.dumps([os.getpid(), namespace, None]).encode('utf-8')
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            generation = _HEADER.unpack_from(bus_map, 0)[0] + 1
+            offset = _HEADER.size + (generation % self.slots) * self.slot_size
+            _SLOT_HEADER.pack_into(bus_map, offset, generation, len(payload))
+            bus_map[offset + _SLOT_HEADER.size:offset + _SLOT_HEADER.size + len(payload)] = payload
+            _HEADER.pack_into(bus_map, 0, generation)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._stats["published"] += 1
+
+    def poll(self):
+        """Применяет инвалидации, опубликованные с прошлого вызова. Вызывается перед чтением кеша"""
+        bus_map = self._map if self._map is not None and self._pid == os.getpid() else self._open()
+        if bus_map is None or _HEADER.unpack_from(bus_map, 0)[0] == self._seen:
+            return
+
+        with self._lock:
+            messages, overflow = self._read_new(bus_map)
+
+        if overflow:
+            self._stats["overflows"] += 1
+            logger.warning("⚠️ Шина инвалидаций переполнена - сбрасываем все кеши воркера")
+            for namespace in self._handlers:
+                self._dispatch(namespace, None)
+            return
+
+        pid = os.getpid()
+        for sender, namespace, key in messages:
+            if sender != pid:
+                self._stats["received"] += 1
+                self._dispatch(namespace, key)
+
+    def _read_new(self, bus_map):
+        """Новые сообщения [(pid, namespace, key)] и признак переполнения"""
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        try:
+            generation = _HEADER.unpack_from(bus_map, 0)[0]
+            first = self._seen + 1
+            self._seen = generation
+            if generation - first >= self.slots:
+                return [], True
+
+            messages = []
+            for expected in range(first, generation + 1):
+                offset = _HEADER.size + (expected % self.slots) * self.slot_size
+                slot_generation, length = _SLOT_HEADER.unpack_from(bus_map, offset)
+                if slot_generation != expected:
+                    return [], True
+                start = offset + _SLOT_HEADER.size
+                try:
+                    messages.append(json.loads(bytes(bus_map[start:start + length])))
+                except ValueError:
+                    return [], True
+            return messages, False
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _dispatch(self, namespace, key):
+        for handler in self._handlers.get(namespace, ()):
+            try:
+                handler(key)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки инвалидации {namespace}:{key}: {e}")
+
+    def get_stats(self):
+        return {
+            **self._stats,
+            "generation": self._seen,
+            "namespaces": sorted(self._handlers),
+            "bus_file": str(self.bus_file),
+        }
+
+
+# Общая шина процесса
+invalidation_bus = InvalidationBus()
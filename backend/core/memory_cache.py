@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+In-memory LRU уровень перед файловым кешем
+Ограничен по числу записей и по суммарному размеру (байты сериализованного JSON).
+Горячие записи отдаются без чтения файла и json.load
+"""
+
+import copy
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryLRU:
+    def __init__(self, max_entries=500, max_bytes=16 * 1024 * 1024, ttl=60):
+        """
+        Args:
+            max_entries: Максимум записей в памяти
+            max_bytes: Максимальный суммарный размер записей
+            ttl: Сколько секунд запись живет в памяти. Ограничивает время, в течение
+                которого воркер может отдавать запись, измененную другим воркером.
+                0 - уровень отключен
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # key -> (data, size, stored_at)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def estimate_size(data):
+        """Размер записи - длина компактного JSON (так же, как она лежит на диске)"""
+        try:
+            return len(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        except (TypeError, ValueError):
+            return 0
+
+    def get(self, key):
+        """Возвращает копию записи или None (промах)"""
+        with self._lock:
+            if self.ttl <= 0:
+                self._stats["misses"] += 1
+                return None
+
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            data, size, stored_at = entry
+            if time.time() - stored_at > self.ttl:
+                self._remove(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+
+        # Вызывающие дополняют полученный словарь (RemnaWave данные) -
+        # копия не дает им изменить запись в памяти
+        return copy.deepcopy(data)
+
+    def set(self, key, data, size=None):
+        """Сохраняет копию записи и вытесняет самые старые при превышении лимитов"""
+        if self.ttl <= 0:
+            return
+
+        if size is None:
+            size = self.estimate_size(data)
+
+        # Запись больше всего лимита не кешируем - она вытеснила бы все остальные
+        if size > self.max_bytes:
+            self.delete(key)
+            return
+
+        data = copy.deepcopy(data)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (data, size, time.time())
+            self._bytes += size
+
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+            }
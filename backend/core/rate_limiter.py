@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Token bucket ограничитель запросов к Telegram, общий для всех процессов
+Состояние корзин хранится в маленьком JSON файле под fcntl блокировкой,
+поэтому лимит действует между демоном, subprocess fallback и всеми воркерами.
+Запросы без изменения состояния (paused_for, available, get_stats) читают файл
+под разделяемой блокировкой и ничего не пишут
+"""
+
+import os
+import json
+import time
+import fcntl
+import asyncio
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+from backend.config.telegram import TELEGRAM_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucketLimiter:
+    def __init__(self, state_file, buckets):
+        """
+        Args:
+            state_file: Путь к файлу общего состояния
+            buckets: {имя: {'rate': токенов в секунду, 'burst': емкость корзины}}
+        """
+        self.state_file = Path(state_file)
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        self.buckets = buckets
+
+    def _parse_state(self, raw):
+        try:
+            return json.loads(raw) if raw else {}
+        except json.JSONDecodeError:
+            logger.warning(f"⚠️ Поврежден файл состояния лимитера, сбрасываем: {self.state_file}")
+            return {}
+
+    @contextmanager
+    def _locked_state(self):
+        """Открывает файл состояния под эксклюзивной блокировкой и сохраняет изменения"""
+        fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o660)
+        with os.fdopen(fd, 'r+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                raw = f.read()
+                state = self._parse_state(raw)
+
+                yield state
+
+                updated = json.dumps(state)
+                if updated != raw:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(updated)
+                    f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        """Снимок состояния под разделяемой блокировкой (без записи)"""
+        fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o660)
+        with os.fdopen(fd, 'r', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                return self._parse_state(f.read())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _bucket_state(self, state, name):
+        config = self.buckets[name]
+        bucket = state.setdefault(name, {})
+        bucket.setdefault('tokens', float(config['burst']))
+        bucket.setdefault('updated_at', time.time())
+        bucket.setdefault('requests', 0)
+        bucket.setdefault('throttled', 0)
+        bucket.setdefault('waited_seconds', 0.0)
+        return bucket
+
+    def _refill(self, bucket, config):
+        """Пополняет корзину за время, прошедшее с последнего обращения"""
+        now = time.time()
+        elapsed = max(0.0, now - bucket['updated_at'])
+        bucket['tokens'] = min(float(config['burst']), bucket['tokens'] + elapsed * config['rate'])
+        bucket['updated_at'] = now
+
+    def reserve(self, name):
+        """
+        Резервирует один токен из корзины
+
+        Если токенов нет - токен берется "в долг" (баланс уходит в минус),
+        а вызывающий должен подождать возвращенное время. Так ожидающие
+        из разных процессов выстраиваются в очередь, не опрашивая файл
+
+        Returns:
+            Сколько секунд нужно подождать перед запросом (0 - можно сразу)
+        """
+        config = self.buckets[name]
+
+        with self._locked_state() as state:
+            bucket = self._bucket_state(state, name)
+            self._refill(bucket, config)
+
+            bucket['tokens'] -= 1
+            bucket['requests'] += 1
+
+            wait = 0.0
+            if bucket['tokens'] < 0:
+                wait = -bucket['tokens'] / config['rate']
+                bucket['throttled'] += 1
+                bucket['waited_seconds'] += wait
+
+            return wait
+
+    def pause(self, seconds, reason="FloodWait"):
+        """
+        Приостанавливает все запросы к Telegram во всех процессах
+        (Telegram вернул FloodWait - ждем ровно указанное время)
+        """
+        with self._locked_state() as state:
+            pause = state.setdefault('_pause', {'until': 0.0, 'count': 0})
+            pause['until'] = max(pause['until'], time.time() + seconds)
+            pause['count'] += 1
+            pause['reason'] = reason
+
+        logger.warning(f"🛑 Запросы к Telegram приостановлены на {seconds} сек ({reason})")
+
+    def paused_for(self):
+        """Сколько секунд еще действует пауза (0 - запросы разрешены)"""
+        pause = self._read_state().get('_pause')
+        if not pause:
+            return 0.0
+        return max(0.0, pause['until'] - time.time())
+
+    def available(self, name):
+        """Сколько токенов в корзине сейчас (без резервирования)"""
+        config = self.buckets[name]
+        # Пополнение считается на копии - сохранять его не нужно, следующий
+        # reserve пополнит корзину от того же updated_at
+        bucket = self._bucket_state(self._read_state(), name)
+        self._refill(bucket, config)
+        return bucket['tokens']
+
+    def acquire(self, name):
+        """Блокирующее ожидание токена (для синхронного кода)"""
+        wait = self.reserve(name)
+        if wait > 0:
+            logger.info(f"⏱️ Лимит '{name}': ожидание {wait:.2f} сек")
+            time.sleep(wait)
+
+    async def acquire_async(self, name):
+        """Ожидание токена без блокировки event loop"""
+        wait = self.reserve(name)
+        if wait > 0:
+            logger.info(f"⏱️ Лимит '{name}': ожидание {wait:.2f} сек")
+            await asyncio.sleep(wait)
+
+    def get_stats(self):
+        """Счетчики по корзинам: запросы, сколько раз ждали и суммарное ожидание"""
+        try:
+            state = self._read_state()
+            stats = {}
+            for name, config in self.buckets.items():
+                bucket = self._bucket_state(state, name)
+                self._refill(bucket, config)
+                stats[name] = {
+                    "rate_per_sec": config['rate'],
+                    "burst": config['burst'],
+                    "tokens": round(bucket['tokens'], 2),
+                    "requests": bucket['requests'],
+                    "throttled": bucket['throttled'],
+                    "waited_seconds": round(bucket['waited_seconds'], 2),
+                }
+
+            pause = state.get('_pause', {'until': 0.0, 'count': 0})
+            stats['flood_wait'] = {
+                "paused_for_seconds": round(max(0.0, pause['until'] - time.time()), 1),
+                "total_pauses": pause['count'],
+                "last_reason": pause.get('reason'),
+            }
+            return stats
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения статистики лимитера: {e}")
+            return {"error": str(e)}
+
+
+# Глобальный лимитер запросов к Telegram (общий для всех процессов)
+telegram_limiter = TokenBucketLimiter(
+    TELEGRAM_CONFIG['rate_limit_state_file'],
+    TELEGRAM_CONFIG['rate_limits']
+)
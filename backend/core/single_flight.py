@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Single-flight: одновременные одинаковые запросы выполняются один раз
+Внутри процесса последователи ждут результат лидера, между процессами
+(воркеры gunicorn) - lock файл по хешу ключа (LOCK_FILE_STRIPES файлов на
+все ключи) + повторная проверка кеша после получения блокировки. Если результат кешируется только в памяти воркера,
+межпроцессная блокировка не нужна (cross_process=False)
+"""
+
+import os
+import time
+import fcntl
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+from backend.config.constants import LOCK_FILE_STRIPES
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """Выполняющийся запрос, результат которого ждут последователи"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, lock_dir=None, lock_timeout=30, cross_process=True, stripes=LOCK_FILE_STRIPES):
+        if lock_dir is None:
+            lock_dir = os.path.join(os.getenv('CACHE_DIR', '/app/cache'), '.locks')
+
+        self.lock_dir = Path(lock_dir)
+        self.cross_process = cross_process
+        self.stripes = stripes
+        if cross_process:
+            self.lock_dir.mkdir(parents=True, exist_ok=True)
+            self._remove_legacy_lock_files()
+        self.lock_timeout = lock_timeout
+
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"executed": 0, "shared_in_process": 0, "shared_cross_process": 0}
+
+    def _lock_file_path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return self.lock_dir / f"flight_{int(digest[:8], 16) % self.stripes:03d}.lock"
+
+    def _remove_legacy_lock_files(self):
+        """Удаляет lock файлы старого формата (<sha1>.lock - по файлу на ключ)"""
+        for path in self.lock_dir.glob("*.lock"):
+            if len(path.stem) == 40:
+                path.unlink(missing_ok=True)
+
+    def _acquire_file_lock(self, key):
+        """
+        Берет межпроцессную блокировку на ключ
+
+        Returns:
+            (file, waited): открытый файл с блокировкой (или None если не дождались)
+            и признак того что блокировку держал другой процесс (возможно, для другого
+            ключа той же полосы - тогда recheck просто не найдет результат)
+        """
+        lock_file = open(self._lock_file_path(key), 'w')
+        deadline = time.time() + self.lock_timeout
+        waited = False
+
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file, waited
+            except OSError:
+                waited = True
+                if time.time() >= deadline:
+                    lock_file.close()
+                    logger.warning(f"⚠️ Не дождались межпроцессной блокировки для {key}, выполняем сами")
+                    return None, waited
+                time.sleep(0.05)
+
+    def _execute(self, key, fn, recheck):
+        if not self.cross_process:
+            self._stats["executed"] += 1
+            return fn()
+
+        lock_file, waited = self._acquire_file_lock(key)
+        try:
+            # Другой воркер выполнял тот же запрос - берем его результат из кеша
+            if waited and recheck is not None:
+                result = recheck()
+                if result is not None:
+                    logger.info(f"🔗 Результат получен от другого воркера: {key}")
+                    self._stats["shared_cross_process"] += 1
+                    return result
+
+            self._stats["executed"] += 1
+            return fn()
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    def do(self, key, fn, recheck=None):
+        """
+        Выполняет fn() один раз для всех одновременных вызовов с тем же key
+
+        Args:
+            key: Ключ запроса
+            fn: Функция, выполняющая запрос
+            recheck: Функция, которая после ожидания чужой блокировки достает
+                готовый результат (например из кеша) или возвращает None
+
+        Returns:
+            Результат fn() (или recheck()) - общий для всех ожидавших
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            logger.info(f"🔗 Ожидаем уже выполняющийся запрос: {key}")
+            call.done.wait()
+            self._stats["shared_in_process"] += 1
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._execute(key, fn, recheck)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def get_stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {**self._stats, "in_flight": in_flight}
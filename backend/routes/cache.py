@@ -13,26 +13,38 @@ cache_bp = Blueprint('cache', __name__)
 
 @cache_bp.route('/api/cache/cleanup', methods=['POST'])
 def manual_cache_cleanup():
-    """Ручная ПОЛНАЯ очистка кеша (для тестирования)"""
+    """
+    Ручная очистка кеша: истекшие записи и вытеснение по лимитам размера.
+    С {"full": true} - ПОЛНАЯ очистка (для тестирования)
+    """
     try:
-        logger.info("🧹 Запущена ручная ПОЛНАЯ очистка кеша")
-        
         from backend.core.cache_manager import bot_cache
         
+        data = request.get_json(silent=True) or {}
+        full = bool(data.get('full'))
+        logger.info(f"🧹 Запущена ручная {'ПОЛНАЯ ' if full else ''}очистка кеша")
+        
         # Получаем статистику до очистки
         stats_before = bot_cache.get_stats()
         
-        # Выполняем ПОЛНУЮ очистку (удаляем все файлы)
-        bot_cache.clear_all()
+        if full:
+            # Выполняем ПОЛНУЮ очистку (удаляем все файлы)
+            bot_cache.clear_all()
+            deleted_files = stats_before.get('total_files', 0)
+            report = {"evicted": deleted_files, "reasons": {"full": deleted_files}}
+            message = "ПОЛНАЯ очистка кеша выполнена - удалены ВСЕ файлы"
+        else:
+            report = bot_cache.cleanup()
+            deleted_files = report['evicted']
+            message = "Очистка кеша выполнена - удалены истекшие и вытесненные записи"
         
         # Получаем статистику после очистки
         stats_after = bot_cache.get_stats()
         
-        deleted_files = stats_before.get('total_files', 0)
-        
         result = {
             "success": True,
-            "message": "ПОЛНАЯ очистка кеша выполнена - удалены ВСЕ файлы",
+            "message": message,
+            "eviction": report,
             "stats": {
                 "before": stats_before,
                 "after": stats_after,
@@ -41,7 +53,7 @@ def manual_cache_cleanup():
             "timestamp": time.time()
         }
         
-        logger.info(f"✅ Ручная ПОЛНАЯ очистка завершена! Удалено всех файлов: {deleted_files}")
+        logger.info(f"✅ Ручная очистка завершена! Удалено записей: {deleted_files}, причины: {report['reasons']}")
         return jsonify(result)
         
     except Exception as e:
@@ -73,34 +85,28 @@ def delete_client_cache():
         
         from backend.core.cache_manager import bot_cache
         
-        cache_file_path = bot_cache._get_cache_file_path(client_id, telegram_uid)
+        try:
+            deleted = bot_cache.delete(client_id, telegram_uid)
+        except OSError as e:
+            logger.error(f"❌ Ошибка удаления файла кеша: {e}")
+            return jsonify({
+                "success": False,
+                "error": f"Ошибка удаления файла: {str(e)}",
+                "timestamp": time.time()
+            }), 500
         
-        if cache_file_path.exists():
-            try:
-                cache_file_path.unlink()
-                logger.info(f"✅ Удален файл кеша: {cache_file_path.name}")
-                
-                return jsonify({
-                    "success": True,
-                    "message": f"Кеш клиента успешно удален",
-                    "deleted_file": cache_file_path.name,
-                    "timestamp": time.time()
-                })
-                
-            except OSError as e:
-                logger.error(f"❌ Ошибка удаления файла кеша: {e}")
-                return jsonify({
-                    "success": False,
-                    "error": f"Ошибка удаления файла: {str(e)}",
-                    "timestamp": time.time()
-                }), 500
-        else:
-            logger.info(f"📭 Файл кеша не найден: {cache_file_path.name}")
+        if deleted:
             return jsonify({
                 "success": True,
-                "message": "Файл кеша не найден (возможно, уже удален)",
+                "message": f"Кеш клиента успешно удален",
                 "timestamp": time.time()
             })
+        
+        return jsonify({
+            "success": True,
+            "message": "Файл кеша не найден (возможно, уже удален)",
+            "timestamp": time.time()
+        })
             
     except Exception as e:
         logger.error(f"❌ Ошибка в delete_client_cache: {e}")
@@ -1,8 +1,11 @@
+import json
+import time
 import logging
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 
 from backend.config.settings import SECURITY_HASH
 from backend.services.remnawave_service import remnawave_service
+from backend.services.bulk_lookup import parse_telegram_ids, lookup_many
 
 logger = logging.getLogger(__name__)
 
@@ -99,3 +102,42 @@ def debug_remna():
         logger.error(f"❌ Ошибка в debug_remna: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+
+@debug_bp.route(f'/{SECURITY_HASH}_bulk_remna', methods=['POST'])
+def bulk_remna():
+    """
+    Массовая проверка пользователей RemnaWave
+
+    JSON: {"telegram_ids": [...], "devices": true, "refresh": false}
+    Ответ - NDJSON: строка на пользователя по мере готовности, последняя строка - итог
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        telegram_ids, invalid = parse_telegram_ids(data.get('telegram_ids', []))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    include_devices = bool(data.get('devices', True))
+    use_cache = not data.get('refresh', False)
+    logger.info(f"🔍 Массовая проверка RemnaWave: {len(telegram_ids)} пользователей, устройства={include_devices}")
+    
+    def generate():
+        started_at = time.time()
+        summary = {"done": True, "total": len(telegram_ids), "found": 0, "not_found": 0, "errors": 0,
+                   "invalid": invalid}
+        
+        for result in lookup_many(telegram_ids, include_devices=include_devices, use_cache=use_cache):
+            if result.get('error'):
+                summary["errors"] += 1
+            elif result.get('user_found'):
+                summary["found"] += 1
+            else:
+                summary["not_found"] += 1
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        
+        summary["elapsed_ms"] = round((time.time() - started_at) * 1000, 1)
+        logger.info(f"✅ Массовая проверка RemnaWave завершена за {summary['elapsed_ms']} мс")
+        yield json.dumps(summary, ensure_ascii=False) + "\n"
+    
+    # X-Accel-Buffering: строки уходят клиенту сразу, а не после буферизации прокси
+    return Response(generate(), mimetype='application/x-ndjson', headers={"X-Accel-Buffering": "no"})
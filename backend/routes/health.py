@@ -13,12 +13,24 @@ health_bp = Blueprint('health', __name__)
 def health_check():
     """Эндпоинт для проверки здоровья приложения"""
     from backend.core.cache_manager import bot_cache
+    from backend.services.subscription_service import subscriptions_flight
+    from backend.core.rate_limiter import telegram_limiter
+    from backend.services.cache_refresher import cache_refresher
+    from backend.services.remnawave_service import remnawave_service
+    from backend.services import user_lookup
+    from backend.services.remnawave_cache import remnawave_cache
     cache_stats = bot_cache.get_stats()
     
     return jsonify({
         "status": "ok", 
         "message": "UseDesk Backend работает",
         "cache": cache_stats,
+        "single_flight": subscriptions_flight.get_stats(),
+        "telegram_rate_limits": telegram_limiter.get_stats(),
+        "cache_refresh_ahead": cache_refresher.get_stats(),
+        "remnawave_http": remnawave_service.get_stats(),
+        "remnawave_cache": remnawave_cache.get_stats(),
+        "user_lookup": user_lookup.get_stats(),
         "performance": "optimized"
     })
 
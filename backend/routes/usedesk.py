@@ -8,12 +8,20 @@ from flask import Blueprint, request, jsonify, render_template, make_response
 from urllib.parse import quote
 
 from backend.config.settings import SECURITY_HASH
-from backend.services.telegram_service import send_message_to_bot, send_replace_key_command
+from backend.core.rate_limiter import telegram_limiter
+from backend.services.replace_key_jobs import replace_key_jobs
+from backend.services.cache_refresher import cache_refresher
+from backend.services.user_lookup import (
+    fetch_user_data,
+    fetch_remnawave_user,
+    store_remnawave_result,
+    prefetch_devices,
+    prefetched_devices,
+    forget_prefetched_devices
+)
 from backend.utils import (
-    process_subscriptions_list,
+    cached_subscriptions,
     sort_subscriptions,
-    parse_replace_response,
-    parse_telegram_bot_response,
     is_router_subscription,
     extract_telegram_uid_from_webhook,
     extract_telegram_username_from_webhook,
@@ -21,15 +29,28 @@ from backend.utils import (
     extract_client_id_from_webhook,
     validate_webhook_data
 )
-from backend.config.constants import (
-    SUBSCRIPTION_CRITICAL_THRESHOLD_DAYS
-)
+from backend.config.constants import SUBSCRIPTION_CRITICAL_THRESHOLD_DAYS
 
 logger = logging.getLogger(__name__)
 
 usedesk_bp = Blueprint('usedesk', __name__)
 
 
+def _unpack_cached_data(cached_data, client_name):
+    """
+    Разбирает запись кеша подписок (кеш отдает записи только текущей версии формата)
+    
+    Returns:
+        (обработанные подписки, no_subscriptions_message, client_name)
+    """
+    no_subscriptions_message = None
+    if cached_data.get('no_subscriptions'):
+        no_subscriptions_message = cached_data.get('message', 'Подписок нет')
+        logger.info(f"📭 Из кеша: {no_subscriptions_message}")
+    
+    return cached_subscriptions(cached_data), no_subscriptions_message, cached_data.get('client_name', client_name)
+
+
 @usedesk_bp.route(f'/{SECURITY_HASH}_useDeskGetUserConfigs', methods=['GET', 'POST'])
 def get_user_configs():
     """Эндпоинт для получения конфигураций пользователя через UseDesk API и Telegram"""
@@ -125,162 +146,68 @@ def get_user_configs():
         
         logger.info(f"✅ Найден Telegram UID: {telegram_uid} для пользователя {telegram_username}")
         
-        # Шаг 3: Отправляем запрос в Telegram бота с UID (на двух строках)
-        telegram_message = f"Узнать подписки\n{telegram_uid}"
-        logger.info(f"Отправка запроса в Telegram: {repr(telegram_message)}")
+        # Клиент активен - его запись кеша будет обновляться заранее (refresh-ahead)
+        cache_refresher.touch(client_id, telegram_uid)
         
         # Проверяем кеш сначала
         from backend.core.cache_manager import bot_cache
         cached_data = bot_cache.get(client_id, telegram_uid) if not refresh_requested else None
         from_cache = False
         no_subscriptions_message = None
+        remnawave = None
         
         if cached_data:
             logger.info("⚡ Используем кешированные данные")
             from_cache = True
-            # Проверяем, это обычные данные или специальный случай отсутствия подписок
-            if isinstance(cached_data, dict) and cached_data.get('no_subscriptions'):
-                subscriptions_data = []
-                no_subscriptions_message = cached_data.get('message', 'Подписок нет')
-                logger.info(f"📭 Из кеша: {no_subscriptions_message}")
-                # Извлекаем сохраненное имя клиента
-                if 'client_name' in cached_data:
-                    client_name = cached_data['client_name']
-            elif isinstance(cached_data, dict) and 'subscriptions' in cached_data:
-                subscriptions_data = cached_data['subscriptions']
-                # Извлекаем сохраненное имя клиента
-                if 'client_name' in cached_data:
-                    client_name = cached_data['client_name']
-            else:
-                # Старый формат кеша - просто массив подписок
-                subscriptions_data = cached_data if isinstance(cached_data, list) else []
+            subscriptions_data, no_subscriptions_message, client_name = _unpack_cached_data(cached_data, client_name)
         else:
-            # БЫСТРЫЙ СИНХРОННЫЙ ЗАПРОС
-            logger.info("🚀 Быстрый запрос к боту...")
-            bot_response = send_message_to_bot(telegram_message)
-            
-            # ДЕТАЛЬНОЕ ЛОГИРОВАНИЕ ОТВЕТА ОТ БОТА
-            logger.info(f"🤖 ОТВЕТ ОТ TELEGRAM БОТА:")
-            logger.info(f"   Тип ответа: {type(bot_response)}")
-            logger.info(f"   Длина ответа: {len(str(bot_response)) if bot_response else 0}")
-            logger.info(f"   Ответ (первые 200 символов): {str(bot_response)[:200] if bot_response else 'ПУСТОЙ'}")
+            # Шаг 3: Бот и RemnaWave параллельно (одновременные запросы к боту для клиента объединяются)
+            fetched, remnawave = fetch_user_data(
+                client_id, telegram_uid, client_name, started_at=start_time, use_cache=not refresh_requested
+            )
             
-            # Проверяем, что получены корректные данные
-            if not bot_response or bot_response.startswith("❌"):
-                logger.error(f"❌ Некорректный ответ от бота: {bot_response}")
-                
-                # Специальная обработка для таймаута
-                if "таймаута" in bot_response.lower():
-                    logger.warning("⏰ Бот не ответил в течение таймаута - возможно, у клиента нет подписок")
-                    # Возвращаем пустой результат вместо ошибки
-                    subscriptions_data = []
-                    no_subscriptions_message = "Бот не ответил (возможно, подписок нет)"
+            if fetched is None:
+                # Бот недоступен (FloodWait, ошибка) - лучше показать устаревшие данные, чем ошибку
+                stale_data = bot_cache.get(client_id, telegram_uid)
+                if stale_data:
+                    logger.warning("⚠️ Бот недоступен, показываем данные из кеша")
+                    cached_data = stale_data
+                    from_cache = True
+                    subscriptions_data, no_subscriptions_message, client_name = _unpack_cached_data(cached_data, client_name)
+                elif telegram_limiter.paused_for() > 0:
+                    return jsonify({"error": "Telegram временно ограничил запросы, повторите позже"}), 503
                 else:
                     return jsonify({"error": "Не удалось получить данные о подписках"}), 500
             else:
-                # Парсим ответ используя универсальный парсер (обрабатывает двойной JSON автоматически!)
-                subscriptions_data = []
-                no_subscriptions_message = None
-                try:
-                    logger.info(f"📋 Парсим ответ от бота...")
-                    response_json = parse_telegram_bot_response(bot_response)
-                    logger.info(f"✅ Ответ распарсен: {type(response_json)}")
-                    
-                    # Если парсер вернул dict - обрабатываем как JSON
-                    if isinstance(response_json, dict) and response_json.get('success'):
-                        if response_json.get('no_subscriptions'):
-                            # Случай отсутствия подписок
-                            logger.info("📭 Обнаружен случай отсутствия подписок")
-                            subscriptions_data = []
-                            no_subscriptions_message = response_json.get('message', 'Подписок нет')
-                            # Сохраняем в кеш пустой массив с флагом
-                            try:
-                                cache_data = {
-                                    'subscriptions': [],
-                                    'no_subscriptions': True,
-                                    'message': no_subscriptions_message,
-                                    'client_name': client_name,
-                                    'timestamp': time.time()
-                                }
-                                bot_cache.set(client_id, telegram_uid, cache_data)
-                                logger.info("💾 Данные 'no_subscriptions' с именем клиента сохранены в кеш")
-                            except Exception as cache_error:
-                                logger.error(f"❌ Ошибка сохранения 'no_subscriptions' в кеш: {cache_error}")
-                        elif 'subscriptions' in response_json:
-                            subscriptions_data = response_json['subscriptions']
-                            logger.info(f"✅ Найдено подписок: {len(subscriptions_data)}")
-                            logger.info(f"📋 Подписки: {subscriptions_data}")
-                            # Сохраняем в кеш
-                            try:
-                                cache_data = {
-                                    'subscriptions': subscriptions_data,
-                                    'client_name': client_name,
-                                    'timestamp': time.time()
-                                }
-                                bot_cache.set(client_id, telegram_uid, cache_data)
-                                logger.info("💾 Данные с именем клиента сохранены в кеш")
-                            except Exception as cache_error:
-                                logger.error(f"❌ Ошибка сохранения в кеш: {cache_error}")
-                        else:
-                            logger.warning(f"⚠️ JSON не содержит подписок или флага no_subscriptions")
-                    else:
-                        logger.warning(f"⚠️ JSON success=False")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка парсинга JSON: {e}")
-                    logger.error(f"❌ Сырой ответ: {bot_response}")
-                    subscriptions_data = []
+                subscriptions_data = cached_subscriptions(fetched)
+                if fetched.get('no_subscriptions'):
+                    no_subscriptions_message = fetched.get('message', 'Подписок нет')
         
         remnawave_user_data = None
         remnawave_error = None
         
-        if cached_data and isinstance(cached_data, dict):
-            remnawave_user_data = cached_data.get('remnawave_user')
-            remnawave_error = cached_data.get('remnawave_error')
-            if remnawave_user_data:
+        if remnawave is None and cached_data:
+            if cached_data.get('remnawave_user'):
+                remnawave_user_data = cached_data['remnawave_user']
                 logger.info(f"⚡ RemnaWave данные из кеша: {remnawave_user_data.get('username')}")
-            elif remnawave_error:
+            elif bot_cache.is_field_fresh(cached_data, 'remnawave_error'):
+                # not_found / неверный токен кешируются со своим TTL, потом спрашиваем снова
+                remnawave_error = cached_data['remnawave_error']
                 logger.info(f"⚡ RemnaWave ошибка из кеша: {remnawave_error}")
-        else:
-            logger.info(f"🌊 Запрос данных RemnaWave для telegram_uid: {telegram_uid}")
-            from backend.services.remnawave_service import remnawave_service
-            
-            try:
-                remnawave_response = remnawave_service.get_user_by_telegram_id(telegram_uid)
-                
-                if remnawave_response:
-                    if remnawave_response.get('error') == 'not_found':
-                        logger.info(f"ℹ️ У юзера нет подписки RemnaWave")
-                        remnawave_error = "no_remnawave_subscription"
-                    elif remnawave_response.get('error') == 'unauthorized':
-                        logger.error(f"❌ RemnaWave API: неверный токен")
-                        remnawave_error = "api_unauthorized"
-                    else:
-                        remnawave_user_data = remnawave_response
-                        logger.info(f"✅ RemnaWave данные получены: {remnawave_user_data.get('username')} (shortUuid: {remnawave_user_data.get('shortUuid')})")
-                else:
-                    logger.warning(f"⚠️ RemnaWave API не вернул данных")
-                    remnawave_error = "api_no_response"
-                    
-            except Exception as remna_error:
-                logger.error(f"❌ Ошибка запроса RemnaWave API: {remna_error}")
-                remnawave_error = f"api_error: {str(remna_error)}"
-            
-            if not from_cache:
-                try:
-                    existing_cache = bot_cache.get(client_id, telegram_uid) or {}
-                    if isinstance(existing_cache, dict):
-                        if remnawave_user_data:
-                            existing_cache['remnawave_user'] = remnawave_user_data
-                        if remnawave_error:
-                            existing_cache['remnawave_error'] = remnawave_error
-                        bot_cache.set(client_id, telegram_uid, existing_cache)
-                        logger.info("💾 RemnaWave данные сохранены в кеш")
-                except Exception as cache_error:
-                    logger.error(f"❌ Ошибка сохранения RemnaWave в кеш: {cache_error}")
-        
-        # Обрабатываем подписки через utils
-        processed_subscriptions = process_subscriptions_list(subscriptions_data)
-        processed_subscriptions = sort_subscriptions(processed_subscriptions, 'status')
+            else:
+                remnawave = fetch_remnawave_user(telegram_uid)
+        
+        if remnawave is not None:
+            remnawave_user_data, remnawave_error, negative_kind = remnawave
+            # Дописывается только к существующей записи с подписками
+            store_remnawave_result(client_id, telegram_uid, remnawave_user_data, remnawave_error, negative_kind)
+        
+        # Следующий клик агента - manage_keys: устройства загружаем заранее, в фоне
+        if remnawave_user_data and remnawave_user_data.get('uuid'):
+            prefetch_devices(client_id, telegram_uid, remnawave_user_data['uuid'], cached_data)
+        
+        # Подписки уже обработаны при записи в кеш - только сортируем
+        processed_subscriptions = sort_subscriptions(subscriptions_data, 'status')
         
         # Подсчет метрик
         active_count = sum(1 for s in processed_subscriptions if s['status'] == 'active')
@@ -410,29 +337,14 @@ def manage_keys():
         if not cached_data:
             return jsonify({"error": "Данные не найдены в кеше"}), 404
         
-        # Извлекаем данные из нового формата кеша
-        subscriptions_list = []
-        cached_client_name = "Клиент"
+        if cached_data.get('no_subscriptions'):
+            logger.info("📭 У клиента нет подписок - возвращаем соответствующее сообщение")
+            return jsonify({"error": "У клиента нет активных подписок"}), 404
         
-        if isinstance(cached_data, dict):
-            # Новый формат кеша с дополнительными данными
-            if cached_data.get('no_subscriptions'):
-                logger.info("📭 У клиента нет подписок - возвращаем соответствующее сообщение")
-                return jsonify({"error": "У клиента нет активных подписок"}), 404
-                
-            subscriptions_list = cached_data.get('subscriptions', [])
-            cached_client_name = cached_data.get('client_name', 'Клиент')
-            
-        elif isinstance(cached_data, list):
-            # Старый формат кеша - только список подписок
-            subscriptions_list = cached_data
-            
-        else:
-            logger.error(f"❌ Неожиданный тип данных кеша: {type(cached_data)} - {cached_data}")
-            return jsonify({"error": "Некорректный формат данных в кеше"}), 500
+        cached_client_name = cached_data.get('client_name', 'Клиент')
         
-        # Обрабатываем подписки
-        processed_subscriptions = process_subscriptions_list(subscriptions_list)
+        # Подписки уже обработаны при записи в кеш
+        processed_subscriptions = cached_subscriptions(cached_data)
         
         # Абсолютный префикс домена нашего бекенда (принудительно HTTPS)
         original_copy_base = request.host_url.rstrip('/')
@@ -464,46 +376,48 @@ def manage_keys():
         logger.info(f"   client_name: {client_name}")
         logger.info(f"   Полный URL: {copy_base}{replace_key_path}")
         
-        remnawave_user_data = None
         remnawave_devices = []
         remnawave_error = None
         
-        if isinstance(cached_data, dict):
-            remnawave_user_data = cached_data.get('remnawave_user')
-            logger.info(f"🔍 DEBUG manage_keys: cached_data type = {type(cached_data)}")
-            logger.info(f"🔍 DEBUG manage_keys: remnawave_user_data = {remnawave_user_data}")
+        remnawave_user_data = cached_data.get('remnawave_user')
+        logger.info(f"🔍 DEBUG manage_keys: cached_data type = {type(cached_data)}")
+        logger.info(f"🔍 DEBUG manage_keys: remnawave_user_data = {remnawave_user_data}")
+        
+        if remnawave_user_data and remnawave_user_data.get('uuid'):
+            user_uuid = remnawave_user_data.get('uuid')
+            logger.info(f"🌊 Запрос HWID устройств для uuid: {user_uuid}")
+            logger.info(f"🔍 DEBUG: uuid = {user_uuid}, type = {type(user_uuid)}")
             
-            if remnawave_user_data and remnawave_user_data.get('uuid'):
-                user_uuid = remnawave_user_data.get('uuid')
-                logger.info(f"🌊 Запрос HWID устройств для uuid: {user_uuid}")
-                logger.info(f"🔍 DEBUG: uuid = {user_uuid}, type = {type(user_uuid)}")
-                
-                from backend.services.remnawave_service import remnawave_service
-                
-                try:
+            from backend.services.remnawave_service import remnawave_service
+            
+            try:
+                devices_response = prefetched_devices(cached_data, user_uuid)
+                if devices_response is not None:
+                    logger.info(f"⚡ HWID устройства загружены заранее (виджет)")
+                else:
                     logger.info(f"🔍 DEBUG: Вызываем get_hwid_devices с uuid={user_uuid}")
                     devices_response = remnawave_service.get_hwid_devices(user_uuid)
-                    logger.info(f"🔍 DEBUG: devices_response = {devices_response}")
-                    logger.info(f"🔍 DEBUG: devices_response type = {type(devices_response)}")
-                    
-                    if devices_response:
-                        if devices_response.get('error') == 'unauthorized':
-                            logger.error(f"❌ RemnaWave API: неверный токен")
-                            remnawave_error = "api_unauthorized"
-                        else:
-                            remnawave_devices = devices_response.get('devices', [])
-                            logger.info(f"✅ Получено {len(remnawave_devices)} HWID устройств")
-                            logger.info(f"🔍 DEBUG: remnawave_devices = {remnawave_devices}")
+                logger.info(f"🔍 DEBUG: devices_response = {devices_response}")
+                logger.info(f"🔍 DEBUG: devices_response type = {type(devices_response)}")
+                
+                if devices_response:
+                    if devices_response.get('error') == 'unauthorized':
+                        logger.error(f"❌ RemnaWave API: неверный токен")
+                        remnawave_error = "api_unauthorized"
                     else:
-                        logger.warning(f"⚠️ RemnaWave API не вернул данных об устройствах")
-                        remnawave_error = "api_no_response"
-                        
-                except Exception as remna_error:
-                    logger.error(f"❌ Ошибка запроса HWID устройств: {remna_error}")
-                    remnawave_error = f"api_error: {str(remna_error)}"
-            else:
-                remnawave_error = cached_data.get('remnawave_error', 'no_remnawave_user')
-                logger.info(f"ℹ️ RemnaWave пользователь не найден в кеше")
+                        remnawave_devices = devices_response.get('devices', [])
+                        logger.info(f"✅ Получено {len(remnawave_devices)} HWID устройств")
+                        logger.info(f"🔍 DEBUG: remnawave_devices = {remnawave_devices}")
+                else:
+                    logger.warning(f"⚠️ RemnaWave API не вернул данных об устройствах")
+                    remnawave_error = "api_no_response"
+                    
+            except Exception as remna_error:
+                logger.error(f"❌ Ошибка запроса HWID устройств: {remna_error}")
+                remnawave_error = f"api_error: {str(remna_error)}"
+        else:
+            remnawave_error = cached_data.get('remnawave_error', 'no_remnawave_user')
+            logger.info(f"ℹ️ RemnaWave пользователь не найден в кеше")
         
         response = render_template(
             'manage_keys.html',
@@ -532,7 +446,7 @@ def manage_keys():
 
 @usedesk_bp.route(f'/{SECURITY_HASH}_replace_key', methods=['GET', 'POST'])
 def replace_key():
-    """Эндпоинт для замены ключа подписки"""
+    """Эндпоинт для замены ключа подписки (ставит фоновую задачу, см. replace_key_status)"""
     try:
         logger.info(f"🎯 ВЫЗВАН ЭНДПОИНТ: /{SECURITY_HASH}_replace_key")
         logger.info(f"🎯 Метод запроса: {request.method}")
@@ -559,17 +473,15 @@ def replace_key():
         cached_data = bot_cache.get(client_id, telegram_uid)
         
         if cached_data:
-            subscriptions_list = cached_data.get('subscriptions', []) if isinstance(cached_data, dict) else (cached_data if isinstance(cached_data, list) else [])
-            
             target_subscription = None
-            for sub in subscriptions_list:
+            for sub in cached_data.get('subscriptions', []):
                 if sub.get('uuid') == uuid:
                     target_subscription = sub
                     break
             
             if target_subscription:
                 subscription_name = target_subscription.get('name', '')
-                if is_router_subscription(subscription_name):
+                if target_subscription.get('is_router', is_router_subscription(subscription_name)):
                     logger.warning(f"❌ Попытка замены ключа роутерной подписки: {subscription_name}")
                     return jsonify({
                         "success": False, 
@@ -580,52 +492,39 @@ def replace_key():
             else:
                 logger.warning(f"⚠️ Подписка с UUID {uuid} не найдена в кеше")
         
-        logger.info(f"🔄 Замена ключа для client_id: {client_id}, telegram_uid: {telegram_uid}, uuid: {uuid}")
-        
-        bot_response = send_replace_key_command(telegram_uid, uuid)
-        
-        if not bot_response or bot_response.startswith("❌"):
-            logger.error(f"❌ Ошибка замены ключа: {bot_response}")
-            return jsonify({"success": False, "error": "Не удалось заменить ключ"}), 500
-        
-        new_quickinstall = parse_replace_response(bot_response)
-        
-        if not new_quickinstall:
-            logger.error(f"❌ Не удалось извлечь новый quickinstall из ответа: {bot_response[:200]}")
-            return jsonify({"success": False, "error": "Не удалось получить новый ключ"}), 500
-        
-        try:
-            cache_file_path = bot_cache._get_cache_file_path(client_id, telegram_uid)
-            if cache_file_path.exists():
-                cache_file_path.unlink()
-                logger.info(f"🗑️ Удален файл кеша: {cache_file_path.name}")
-            else:
-                logger.info(f"🔍 Файл кеша не найден для удаления: {cache_file_path.name}")
-        except Exception as e:
-            logger.warning(f"⚠️ Не удалось очистить кеш: {e}")
-        
-        if new_quickinstall == "SUCCESS_BUT_NO_URL":
-            logger.info(f"✅ Ключ успешно заменен (без прямого URL, требуется обновить подписки)")
-            return jsonify({
-                "success": True,
-                "new_quickinstall": None,
-                "message": "Ключ успешно заменен! Обновите страницу чтобы увидеть новый ключ.",
-                "should_refresh": True
-            })
-        
-        logger.info(f"✅ Ключ успешно заменен, новый quickinstall: {new_quickinstall}")
+        # Ответа бота ждем в фоне - воркер сразу свободен, статус опрашивает страница
+        job_id = replace_key_jobs.submit(client_id, telegram_uid, uuid)
         
         return jsonify({
             "success": True,
-            "new_quickinstall": new_quickinstall,
-            "message": "Ключ успешно заменен"
-        })
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/{SECURITY_HASH}_replace_key_status/{job_id}"
+        }), 202
         
     except Exception as e:
         logger.error(f"Ошибка в replace_key: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@usedesk_bp.route(f'/{SECURITY_HASH}_replace_key_status/<job_id>', methods=['GET'])
+def replace_key_status(job_id):
+    """Статус фоновой замены ключа: stage - command_sent / subscription_added / key_received"""
+    job = replace_key_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Задача не найдена"}), 404
+    
+    return jsonify({
+        "success": True,
+        "job_id": job['id'],
+        "status": job['status'],
+        "stage": job['stage'],
+        "stages": job['stages'],
+        "result": job['result'],
+        "error": job['error']
+    })
+
+
 @usedesk_bp.route(f'/{SECURITY_HASH}_delete_device', methods=['POST'])
 def delete_device():
     try:
@@ -648,6 +547,15 @@ def delete_device():
         
         success = remnawave_service.delete_hwid_device(user_uuid, hwid)
         
+        # Заранее загруженный список устройств в записи клиента больше не верен
+        client_id = data.get('client_id')
+        telegram_uid = data.get('telegram_uid')
+        if client_id and telegram_uid:
+            try:
+                forget_prefetched_devices(client_id, telegram_uid)
+            except Exception as cache_error:
+                logger.warning(f"⚠️ Не удалось сбросить устройства в кеше: {cache_error}")
+        
         if success:
             logger.info(f"✅ Устройство {hwid} успешно удалено")
             return jsonify({
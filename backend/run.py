@@ -77,7 +77,7 @@ def startup():
     print("   - /aljsdhfaljsdhflahsjdflaksjhdflasjlkfjaslkdfjalsdjflaksjdflkasjflkajsdklfjal_useDeskGetUserConfigs?client_id=<number>")
     print("   - /api/subscriptions/<client_id> (JSON API)")
     print("   - /health")
-    print("📱 Telegram операции выполняются через subprocess")
+    print("📱 Telegram операции выполняются через постоянный Telegram демон (fallback: subprocess)")
     print("🔒 Используется 64-битный HASH для безопасности")
     print("🖥️  Сервер запущен на http://0.0.0.0:5000")
     print("🔄 Для остановки нажмите Ctrl+C")
@@ -4,12 +4,14 @@
 from .telegram_service import (
     send_message_to_bot,
     send_get_subscriptions_command,
-    send_replace_key_command
+    send_replace_key_command,
+    ensure_telegram_daemon
 )
 
 __all__ = [
     'send_message_to_bot',
     'send_get_subscriptions_command',
     'send_replace_key_command',
+    'ensure_telegram_daemon',
 ]
 
@@ -0,0 +1,116 @@
+"""
+Массовая проверка пользователей RemnaWave по списку Telegram ID
+(например, после инцидента). Запросы идут параллельно в пуле BULK_LOOKUP_WORKERS
+через общую keep-alive сессию RemnaWaveService и кеш remnawave_cache,
+результаты отдаются по мере готовности, а не в порядке списка
+"""
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from backend.config.constants import BULK_LOOKUP_MAX_IDS
+from backend.config.settings import BULK_LOOKUP_WORKERS
+from backend.services.remnawave_service import remnawave_service
+from backend.services.user_lookup import lookup_stats
+from backend.utils.parsers import parse_telegram_uid
+
+logger = logging.getLogger(__name__)
+
+SOURCE_BULK = 'remnawave_bulk'
+
+# Общий на воркер пул: параллельных запросов не больше, чем соединений в пуле сессии,
+# сколько бы массовых проверок ни шло одновременно
+_executor = ThreadPoolExecutor(max_workers=BULK_LOOKUP_WORKERS, thread_name_prefix="bulk-lookup")
+
+
+def parse_telegram_ids(raw_ids):
+    """
+    Проверяет список Telegram ID: убирает повторы (порядок сохраняется)
+
+    Returns:
+        (telegram_ids, invalid) - корректные ID и отброшенные значения
+
+    Raises:
+        ValueError: Не список или больше BULK_LOOKUP_MAX_IDS ID
+    """
+    if isinstance(raw_ids, str):
+        raw_ids = raw_ids.replace(',', ' ').split()
+    if not isinstance(raw_ids, (list, tuple)):
+        raise ValueError("telegram_ids должен быть списком")
+
+    telegram_ids = []
+    invalid = []
+    seen = set()
+    for raw_id in raw_ids:
+        telegram_id = parse_telegram_uid(raw_id)
+        if telegram_id is None:
+            invalid.append(raw_id)
+        elif telegram_id not in seen:
+            seen.add(telegram_id)
+            telegram_ids.append(telegram_id)
+
+    if len(telegram_ids) > BULK_LOOKUP_MAX_IDS:
+        raise ValueError(f"Не больше {BULK_LOOKUP_MAX_IDS} telegram_ids за запрос")
+    return telegram_ids, invalid
+
+
+def lookup_user(telegram_id, include_devices=True, use_cache=True):
+    """Статус одного пользователя: данные RemnaWave и (опционально) HWID устройства"""
+    started_at = time.time()
+    result = {"telegram_id": telegram_id}
+
+    user_response = remnawave_service.get_user_by_telegram_id(telegram_id, use_cache=use_cache)
+    if not user_response:
+        result["error"] = "api_no_response"
+    elif user_response.get('error') == 'not_found':
+        result["user_found"] = False
+    elif user_response.get('error'):
+        result["error"] = user_response['error']
+    else:
+        result["user_found"] = True
+        result["uuid"] = user_response.get('uuid')
+        result["shortUuid"] = user_response.get('shortUuid')
+        result["username"] = user_response.get('username')
+        result["status"] = user_response.get('status')
+        result["expireAt"] = user_response.get('expireAt')
+        result["hwidDeviceLimit"] = user_response.get('hwidDeviceLimit')
+        result["subLastUserAgent"] = user_response.get('subLastUserAgent')
+
+        if include_devices and result["uuid"]:
+            devices_response = remnawave_service.get_hwid_devices(result["uuid"], use_cache=use_cache)
+            if devices_response and not devices_response.get('error'):
+                result["devices_count"] = devices_response.get('total', 0)
+                result["devices"] = devices_response.get('devices', [])
+            else:
+                result["devices_error"] = devices_response.get('error') if devices_response else "api_no_response"
+
+    outcome = result.get("error") or ('ok' if result.get("user_found") else 'not_found')
+    lookup_stats.record(SOURCE_BULK, outcome, time.time() - started_at)
+    result["elapsed_ms"] = round((time.time() - started_at) * 1000, 1)
+    return result
+
+
+def lookup_many(telegram_ids, include_devices=True, use_cache=True):
+    """
+    Генератор результатов lookup_user в порядке готовности
+
+    Если потребитель перестал читать (клиент отключился), еще не начатые
+    запросы отменяются
+    """
+    pending = {
+        _executor.submit(lookup_user, telegram_id, include_devices, use_cache): telegram_id
+        for telegram_id in telegram_ids
+    }
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                telegram_id = pending.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка массовой проверки telegram_id={telegram_id}: {e}")
+                    yield {"telegram_id": telegram_id, "error": f"api_error: {str(e)}"}
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,149 @@
+"""
+Refresh-ahead для активных клиентов
+Клиент считается активным, если его виджет (get_user_configs) открывали
+за последние CACHE_ACTIVE_CLIENT_WINDOW секунд. Записи кеша таких клиентов
+обновляются в фоне незадолго до истечения, чтобы следующее открытие тикета
+не ждало Telegram. Сначала обновляются клиенты, открытые последними
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.config.constants import (
+    CACHE_REFRESH_AHEAD,
+    CACHE_ACTIVE_CLIENT_WINDOW,
+    CACHE_REFRESH_CHECK_INTERVAL,
+    CACHE_REFRESH_WORKERS,
+    CACHE_REFRESH_BATCH
+)
+from backend.core.cache_manager import bot_cache
+from backend.core.rate_limiter import telegram_limiter
+from backend.services.subscription_service import revalidate_subscriptions
+
+logger = logging.getLogger(__name__)
+
+
+class CacheRefresher:
+    def __init__(self, refresh_ahead=CACHE_REFRESH_AHEAD, active_window=CACHE_ACTIVE_CLIENT_WINDOW,
+                 check_interval=CACHE_REFRESH_CHECK_INTERVAL, max_workers=CACHE_REFRESH_WORKERS,
+                 batch_size=CACHE_REFRESH_BATCH):
+        self.refresh_ahead = refresh_ahead
+        self.active_window = active_window
+        self.check_interval = check_interval
+        self.batch_size = batch_size
+
+        # (client_id, telegram_uid) -> время последнего открытия; в конце - самые свежие
+        self._active = OrderedDict()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cache-refresh")
+
+        self.running = False
+        self.thread = None
+        self._stats = {"refreshed": 0, "failed": 0, "skipped_rate_limit": 0}
+
+    def touch(self, client_id, telegram_uid):
+        """Отмечает, что виджет клиента только что открывали"""
+        key = (str(client_id), str(telegram_uid))
+        with self._lock:
+            self._active[key] = time.time()
+            self._active.move_to_end(key)
+
+    def start(self):
+        """Запускает фоновый поток проверки"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+            logger.info(f"🔮 Запущен refresh-ahead кеша (за {self.refresh_ahead} сек до истечения)")
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def _loop(self):
+        while self.running:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Ошибка refresh-ahead: {e}")
+            time.sleep(self.check_interval)
+
+    def _active_clients(self):
+        """Активные клиенты, начиная с открытых последними (неактивные забываются)"""
+        cutoff = time.time() - self.active_window
+        with self._lock:
+            for key, last_seen in list(self._active.items()):
+                if last_seen >= cutoff:
+                    break
+                del self._active[key]
+            return [key for key in reversed(self._active) if key not in self._in_flight]
+
+    def run_once(self):
+        """
+        Один проход: ставит в очередь обновление записей, истекающих в ближайшие
+        refresh_ahead секунд. Возвращает количество поставленных обновлений
+        """
+        # Фоновые обновления не должны отнимать лимит у запросов агентов:
+        # во время FloodWait и при пустой корзине пропускаем проход
+        if telegram_limiter.paused_for() > 0:
+            self._stats["skipped_rate_limit"] += 1
+            return 0
+
+        budget = min(self.batch_size, int(telegram_limiter.available('send_message')))
+        if budget <= 0:
+            self._stats["skipped_rate_limit"] += 1
+            return 0
+
+        deadline = time.time() + self.refresh_ahead
+        scheduled = 0
+        for client_id, telegram_uid in self._active_clients():
+            if scheduled >= budget:
+                break
+
+            info = bot_cache.get_entry_info(client_id, telegram_uid)
+            # Нет записи - клиент получит ее обычным запросом, здесь не угадываем.
+            # Негативные записи не обновляем заранее - они и так повторяются по своему TTL
+            if info is None or info['negative'] or info['expires_at'] > deadline:
+                continue
+
+            with self._lock:
+                self._in_flight.add((client_id, telegram_uid))
+            self._executor.submit(self._refresh, client_id, telegram_uid)
+            scheduled += 1
+
+        if scheduled:
+            logger.info(f"🔮 Refresh-ahead: обновляем {scheduled} записей кеша")
+        return scheduled
+
+    def _refresh(self, client_id, telegram_uid):
+        try:
+            # Не bot_cache.get: для истекшей записи он сам запустил бы второе обновление
+            info = bot_cache.get_entry_info(client_id, telegram_uid)
+            result = revalidate_subscriptions(client_id, telegram_uid, info['data'] if info else None)
+            if result is None:
+                self._stats["failed"] += 1
+            else:
+                self._stats["refreshed"] += 1
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.error(f"❌ Ошибка refresh-ahead для client_id={client_id}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard((client_id, telegram_uid))
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "active_clients": len(self._active),
+                "in_flight": len(self._in_flight),
+                "refresh_ahead_seconds": self.refresh_ahead,
+            }
+
+
+# Глобальный refresh-ahead планировщик
+cache_refresher = CacheRefresher()
@@ -13,6 +13,7 @@ from backend.config.outline import (
     is_outline_enabled,
     DEFAULT_CHECKLIST
 )
+from backend.core.invalidation_bus import invalidation_bus
 
 logger = logging.getLogger(__name__)
 
@@ -114,6 +115,8 @@ def _normalize_icon(icon: Optional[str]) -> str:
 class OutlineService:
     """Сервис для взаимодействия с Outline API"""
     
+    BUS_NAMESPACE = 'outline'
+    
     def __init__(self):
         self.config = get_outline_config()
         self.base_url = self.config['base_url'].rstrip('/')
@@ -121,9 +124,10 @@ class OutlineService:
         self.timeout = self.config['request_timeout']
         self.max_retries = self.config['max_retries']
         
-        # Кеш для документов
+        # Кеш для документов (сброс в одном воркере рассылается остальным)
         self._cache = {}
         self._cache_timestamps = {}
+        invalidation_bus.subscribe(self.BUS_NAMESPACE, self._drop_cache)
         
         if is_outline_enabled():
             logger.info("✅ Outline сервис инициализирован")
@@ -141,6 +145,7 @@ class OutlineService:
     
     def _is_cache_valid(self, document_id: str) -> bool:
         """Проверяет валидность кеша для документа"""
+        invalidation_bus.poll()
         if document_id not in self._cache:
             return False
         
@@ -160,8 +165,8 @@ class OutlineService:
         self._cache_timestamps[document_id] = time.time()
         logger.info(f"💾 Документ сохранен в кеш: {document_id}")
     
-    def _clear_cache(self, document_id: Optional[str] = None):
-        """Очищает кеш для документа или весь кеш"""
+    def _drop_cache(self, document_id: Optional[str] = None):
+        """Очищает кеш этого воркера для документа или весь"""
         if document_id:
             self._cache.pop(document_id, None)
             self._cache_timestamps.pop(document_id, None)
@@ -171,6 +176,11 @@ class OutlineService:
             self._cache_timestamps.clear()
             logger.info("🗑️ Весь кеш Outline очищен")
     
+    def _clear_cache(self, document_id: Optional[str] = None):
+        """Очищает кеш для документа или весь кеш - во всех воркерах"""
+        self._drop_cache(document_id)
+        invalidation_bus.publish(self.BUS_NAMESPACE, document_id)
+    
     def get_document(self, document_id: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
         """
         Получает документ из Outline
@@ -360,7 +370,7 @@ class OutlineService:
             # Принудительное обновление - очищаем кеш
             if force_refresh:
                 logger.info("🔄 Принудительное обновление коллекции")
-                self.clear_cache(f"collection_{collection_id}")
+                self._clear_cache(f"collection_{collection_id}")
             
             # Проверяем кеш
             cache_key = f"collection_{collection_id}"
@@ -0,0 +1,90 @@
+"""
+Кеш ответов RemnaWave в памяти воркера
+Пользователи (по telegram_id) и списки HWID устройств (по uuid пользователя)
+живут свои короткие TTL. Одновременные одинаковые запросы объединяются
+(single-flight внутри воркера). Удаление устройства сбрасывает список
+устройств этого пользователя - во всех воркерах, через шину инвалидаций
+"""
+import logging
+
+from backend.config.settings import (
+    REMNA_USER_CACHE_TTL,
+    REMNA_DEVICES_CACHE_TTL,
+    REMNA_CACHE_MAX_ENTRIES
+)
+from backend.core.memory_cache import MemoryLRU
+from backend.core.single_flight import SingleFlight
+from backend.core.invalidation_bus import invalidation_bus
+
+logger = logging.getLogger(__name__)
+
+KIND_USER = 'user'
+KIND_DEVICES = 'devices'
+
+
+class RemnaWaveCache:
+    BUS_NAMESPACE = 'remnawave'
+
+    def __init__(self, user_ttl=REMNA_USER_CACHE_TTL, devices_ttl=REMNA_DEVICES_CACHE_TTL,
+                 max_entries=REMNA_CACHE_MAX_ENTRIES, bus=None):
+        self._caches = {
+            KIND_USER: MemoryLRU(max_entries=max_entries, ttl=user_ttl),
+            KIND_DEVICES: MemoryLRU(max_entries=max_entries, ttl=devices_ttl),
+        }
+        self._flight = SingleFlight(cross_process=False)
+        self.bus = bus if bus is not None else invalidation_bus
+        self.bus.subscribe(self.BUS_NAMESPACE, self._on_invalidation)
+
+    @staticmethod
+    def _bus_key(kind, key):
+        return f"{kind}:{key}"
+
+    def _on_invalidation(self, bus_key):
+        """Инвалидация от другого воркера: bus_key=None - сбросить все"""
+        if bus_key is None:
+            for cache in self._caches.values():
+                cache.clear()
+            return
+        kind, _, key = bus_key.partition(':')
+        if kind in self._caches:
+            self._caches[kind].delete(key)
+
+    def get(self, kind, key, fetch, cacheable):
+        """
+        Ответ из кеша или fetch() (одновременные вызовы с тем же ключом делят один запрос)
+
+        Args:
+            fetch: fn() - запрос к RemnaWave
+            cacheable: fn(response) - можно ли кешировать ответ (сбои не кешируем)
+        """
+        key = str(key)
+        cache = self._caches[kind]
+        self.bus.poll()
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"⚡ RemnaWave {kind} из кеша: {key}")
+            return cached
+
+        def fetch_and_store():
+            response = fetch()
+            if response is not None and cacheable(response):
+                cache.set(key, response)
+            return response
+
+        return self._flight.do(self._bus_key(kind, key), fetch_and_store)
+
+    def invalidate(self, kind, key):
+        """Сбрасывает ответ в этом и остальных воркерах"""
+        key = str(key)
+        self._caches[kind].delete(key)
+        self.bus.publish(self.BUS_NAMESPACE, self._bus_key(kind, key))
+        logger.info(f"🗑️ Сброшен кеш RemnaWave {kind}: {key}")
+
+    def get_stats(self):
+        return {
+            **{kind: cache.get_stats() for kind, cache in self._caches.items()},
+            "single_flight": self._flight.get_stats()
+        }
+
+
+remnawave_cache = RemnaWaveCache()
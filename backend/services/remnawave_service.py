@@ -1,78 +1,145 @@
-import http.client
+"""
+Клиент RemnaWave API
+Все запросы идут через одну requests.Session с ограниченным keep-alive пулом:
+TCP и TLS рукопожатия выполняются один раз на соединение, а не на каждый запрос.
+Статистика переиспользования соединений - в get_stats() (/health).
+Пользователи и списки устройств кешируются ненадолго (remnawave_cache)
+"""
 import json
+import time
 import logging
+import threading
 import requests
-from typing import Optional, Dict, Any, List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Optional, Dict, Any, List, Tuple
 from urllib.parse import quote
 
-from backend.config.settings import REMNA_API_DOMAIN, REMNA_API_TOKEN
+from backend.config.settings import (
+    REMNA_API_DOMAIN,
+    REMNA_API_TOKEN,
+    REMNA_POOL_SIZE,
+    REMNA_CONNECT_TIMEOUT,
+    REMNA_READ_TIMEOUT
+)
+
+from backend.services.remnawave_cache import remnawave_cache, KIND_USER, KIND_DEVICES
 
 logger = logging.getLogger(__name__)
 
 
 class RemnaWaveService:
     
-    def __init__(self):
+    def __init__(self, pool_size=REMNA_POOL_SIZE, connect_timeout=REMNA_CONNECT_TIMEOUT,
+                 read_timeout=REMNA_READ_TIMEOUT):
         self.domain = REMNA_API_DOMAIN
         self.token = REMNA_API_TOKEN
+        self.base_url = f"https://{self.domain}"
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        
+        # pool_block: при занятом пуле запрос ждет соединение, а не открывает лишнее.
+        # Повтор только при ошибке подключения (запрос до сервера не дошел)
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=Retry(total=1, connect=1, read=0, status=0, redirect=0)
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.headers.update({'Authorization': f"Bearer {self.token}"})
+        
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "errors": 0, "total_seconds": 0.0}
         
         if not self.token:
             logger.warning("⚠️ REMNA_API_TOKEN не установлен")
     
-    def _make_request(self, method: str, endpoint: str, payload: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    def _send(self, method: str, endpoint: str, payload: Optional[Any] = None) -> Tuple[Optional[int], str]:
+        """
+        Выполняет запрос через общий пул соединений
+        
+        Returns:
+            (HTTP статус, текст ответа) или (None, '') при сетевой ошибке
+        """
+        logger.info(f"📤 RemnaWave API: {method} {endpoint}")
+        logger.debug(f"🔑 Токен (первые 20 символов): {self.token[:20] if self.token else 'НЕТ'}")
+        logger.debug(f"🌐 Домен: {self.domain}")
+        
+        started_at = time.time()
         try:
-            conn = http.client.HTTPSConnection(self.domain)
-            
-            headers = {
-                'Authorization': f"Bearer {self.token}"
-            }
-            
-            if payload:
-                headers['Content-Type'] = "application/json"
-            
-            logger.info(f"📤 RemnaWave API: {method} {endpoint}")
-            logger.debug(f"🔑 Токен (первые 20 символов): {self.token[:20] if self.token else 'НЕТ'}")
-            logger.debug(f"🌐 Домен: {self.domain}")
-            
-            conn.request(method, endpoint, payload, headers)
-            res = conn.getresponse()
-            data = res.read()
-            
-            response_text = data.decode("utf-8")
-            logger.info(f"📥 RemnaWave HTTP статус: {res.status}")
-            logger.debug(f"📥 RemnaWave ответ: {response_text[:500]}")
-            
-            try:
-                response_data = json.loads(response_text)
-                logger.debug(f"📋 Распарсенный JSON: {response_data}")
-            except json.JSONDecodeError:
-                logger.error(f"❌ Не удалось распарсить JSON: {response_text}")
-                return None
-            
-            if res.status == 401:
-                logger.error(f"❌ RemnaWave API: неверный токен (401)")
-                return {"error": "unauthorized", "message": "Unauthorized", "statusCode": 401}
-            
-            if res.status == 404:
-                logger.warning(f"⚠️ RemnaWave API: не найдено (404)")
-                return response_data
-            
-            if res.status != 200:
-                logger.warning(f"⚠️ RemnaWave API вернул статус {res.status}")
-                logger.warning(f"⚠️ Ответ: {response_text[:200]}")
-            
-            return response_data
-            
-        except Exception as e:
+            response = self.session.request(
+                method, f"{self.base_url}{endpoint}", json=payload, timeout=self.timeout
+            )
+            return response.status_code, response.text
+        except requests.exceptions.RequestException as e:
             logger.error(f"❌ Ошибка запроса к RemnaWave API: {e}")
-            return None
+            with self._stats_lock:
+                self._stats["errors"] += 1
+            return None, ''
         finally:
-            try:
-                conn.close()
-            except:
-                pass
+            with self._stats_lock:
+                self._stats["requests"] += 1
+                self._stats["total_seconds"] += time.time() - started_at
     
-    def get_user_by_telegram_id(self, telegram_id: str) -> Optional[Dict[str, Any]]:
+    def _make_request(self, method: str, endpoint: str, payload: Optional[Any] = None) -> Optional[Dict[str, Any]]:
+        status, response_text = self._send(method, endpoint, payload)
+        if status is None:
+            return None
+        
+        logger.info(f"📥 RemnaWave HTTP статус: {status}")
+        logger.debug(f"📥 RemnaWave ответ: {response_text[:500]}")
+        
+        try:
+            response_data = json.loads(response_text)
+            logger.debug(f"📋 Распарсенный JSON: {response_data}")
+        except json.JSONDecodeError:
+            logger.error(f"❌ Не удалось распарсить JSON: {response_text}")
+            return None
+        
+        if status == 401:
+            logger.error(f"❌ RemnaWave API: неверный токен (401)")
+            return {"error": "unauthorized", "message": "Unauthorized", "statusCode": 401}
+        
+        if status == 404:
+            logger.warning(f"⚠️ RemnaWave API: не найдено (404)")
+            return response_data
+        
+        if status != 200:
+            logger.warning(f"⚠️ RemnaWave API вернул статус {status}")
+            logger.warning(f"⚠️ Ответ: {response_text[:200]}")
+        
+        return response_data
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Запросы, новые и переиспользованные соединения пула"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        
+        pool = self._adapter.poolmanager.connection_from_url(self.base_url)
+        new_connections = pool.num_connections
+        http_requests = pool.num_requests
+        
+        stats["total_seconds"] = round(stats["total_seconds"], 3)
+        stats["avg_ms"] = round(stats["total_seconds"] * 1000 / stats["requests"], 1) if stats["requests"] else 0.0
+        stats["new_connections"] = new_connections
+        stats["reused_connections"] = max(0, http_requests - new_connections)
+        stats["pool_size"] = self.pool_size
+        stats["timeout"] = {"connect": self.timeout[0], "read": self.timeout[1]}
+        return stats
+    
+    def get_user_by_telegram_id(self, telegram_id: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        if not use_cache:
+            return self._fetch_user_by_telegram_id(telegram_id)
+        # not_found тоже кешируем (свой TTL), неверный токен - нет
+        return remnawave_cache.get(
+            KIND_USER, telegram_id,
+            lambda: self._fetch_user_by_telegram_id(telegram_id),
+            cacheable=lambda response: response.get('error') != 'unauthorized'
+        )
+    
+    def _fetch_user_by_telegram_id(self, telegram_id: str) -> Optional[Dict[str, Any]]:
         if not self.token:
             logger.warning("⚠️ RemnaWave API токен не установлен, пропускаем запрос")
             return None
@@ -101,7 +168,16 @@ class RemnaWaveService:
         logger.warning(f"⚠️ Неожиданный формат ответа от RemnaWave API")
         return None
     
-    def get_hwid_devices(self, user_uuid: str) -> Optional[Dict[str, Any]]:
+    def get_hwid_devices(self, user_uuid: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        if not use_cache:
+            return self._fetch_hwid_devices(user_uuid)
+        return remnawave_cache.get(
+            KIND_DEVICES, user_uuid,
+            lambda: self._fetch_hwid_devices(user_uuid),
+            cacheable=lambda response: 'error' not in response
+        )
+    
+    def _fetch_hwid_devices(self, user_uuid: str) -> Optional[Dict[str, Any]]:
         if not self.token:
             logger.warning("⚠️ RemnaWave API токен не установлен, пропускаем запрос")
             return None
@@ -132,42 +208,34 @@ class RemnaWaveService:
             logger.warning("⚠️ RemnaWave API токен не установлен, пропускаем запрос")
             return False
         
-        url = f"https://{self.domain}/api/hwid/devices/delete"
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.token}"
-        }
-        
         payload = {
             "userUuid": user_uuid,
             "hwid": hwid
         }
         
         logger.info(f"🗑️ Удаление HWID устройства: {hwid} для пользователя {user_uuid}")
-        logger.debug(f"📤 POST {url}")
         logger.debug(f"📋 Payload: {payload}")
         
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=10)
-            
-            logger.info(f"📥 Статус ответа: {response.status_code}")
-            logger.debug(f"📥 Ответ: {response.text[:500]}")
-            
-            if response.status_code == 401:
-                logger.error("❌ RemnaWave API: Unauthorized")
-                return False
-            
-            if response.status_code == 200:
-                logger.info(f"✅ HWID устройство {hwid} успешно удалено")
-                return True
-            else:
-                logger.warning(f"⚠️ Неожиданный статус: {response.status_code}")
-                return False
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Ошибка при удалении HWID устройства: {e}")
+        status, response_text = self._send("POST", "/api/hwid/devices/delete", payload)
+        # Список устройств мог измениться даже при ошибке (например, таймаут ответа)
+        remnawave_cache.invalidate(KIND_DEVICES, user_uuid)
+        if status is None:
+            logger.error(f"❌ Ошибка при удалении HWID устройства {hwid}")
+            return False
+        
+        logger.info(f"📥 Статус ответа: {status}")
+        logger.debug(f"📥 Ответ: {response_text[:500]}")
+        
+        if status == 401:
+            logger.error("❌ RemnaWave API: Unauthorized")
             return False
+        
+        if status == 200:
+            logger.info(f"✅ HWID устройство {hwid} успешно удалено")
+            return True
+        
+        logger.warning(f"⚠️ Неожиданный статус: {status}")
+        return False
     
     def get_platform_emoji(self, platform: str) -> str:
         platform_lower = platform.lower() if platform else ""
@@ -0,0 +1,212 @@
+"""
+Фоновые задачи замены ключа
+Замена ключа ждет два сообщения бота (до TELEGRAM_REPLACE_KEY_TIMEOUT),
+поэтому эндпоинт только ставит задачу и сразу возвращает job_id, а страница
+manage_keys опрашивает статус. Состояние задачи хранится в JSON файле, чтобы
+статус мог отдать любой воркер, а не только тот, что принял задачу
+"""
+import json
+import time
+import uuid as uuid_lib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from backend.config.settings import CACHE_DIR
+from backend.config.constants import REPLACE_KEY_STAGE_QUEUED
+from backend.core.cache_manager import bot_cache
+from backend.services.telegram_service import send_replace_key_command
+from backend.utils import parse_replace_response, process_subscription
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUS_QUEUED = 'queued'
+JOB_STATUS_RUNNING = 'running'
+JOB_STATUS_DONE = 'done'
+JOB_STATUS_FAILED = 'failed'
+
+
+def _patch_quickinstall(data, uuid, new_quickinstall):
+    """
+    Подставляет новый quickinstall в подписку с этим uuid (остальные не трогает).
+    Подписка обрабатывается заново - у нее меняется quickinstall_encoded
+    """
+    subscriptions = data.get('subscriptions')
+    if not isinstance(subscriptions, list):
+        return data
+
+    data['subscriptions'] = [
+        process_subscription({**subscription, 'quickinstall': new_quickinstall})
+        if isinstance(subscription, dict) and subscription.get('uuid') == uuid else subscription
+        for subscription in subscriptions
+    ]
+    return data
+
+
+def perform_replace_key(client_id, telegram_uid, uuid, progress_callback=None):
+    """
+    Заменяет ключ через бота и обновляет кеш клиента
+
+    Новый quickinstall сразу подставляется в кешированную подписку, а запись
+    помечается истекшей: следующая загрузка виджета получит ее без ожидания
+    бота и запустит фоновое обновление. Если бот не прислал URL, обновление
+    запускается сразу
+
+    Returns:
+        Словарь результата в формате прежнего ответа эндпоинта replace_key
+        (success, new_quickinstall, message, should_refresh) или
+        {"success": False, "error": ...}
+    """
+    logger.info(f"🔄 Замена ключа для client_id: {client_id}, telegram_uid: {telegram_uid}, uuid: {uuid}")
+
+    bot_response = send_replace_key_command(telegram_uid, uuid, progress_callback=progress_callback)
+
+    if not bot_response or bot_response.startswith("❌"):
+        logger.error(f"❌ Ошибка замены ключа: {bot_response}")
+        return {"success": False, "error": "Не удалось заменить ключ"}
+
+    new_quickinstall = parse_replace_response(bot_response)
+
+    if not new_quickinstall:
+        logger.error(f"❌ Не удалось извлечь новый quickinstall из ответа: {bot_response[:200]}")
+        return {"success": False, "error": "Не удалось получить новый ключ"}
+
+    if new_quickinstall == "SUCCESS_BUT_NO_URL":
+        try:
+            bot_cache.mark_stale(client_id, telegram_uid, revalidate=True)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось запустить обновление кеша: {e}")
+
+        logger.info(f"✅ Ключ успешно заменен (без прямого URL, подписки обновляются в фоне)")
+        return {
+            "success": True,
+            "new_quickinstall": None,
+            "message": "Ключ успешно заменен! Обновите страницу чтобы увидеть новый ключ.",
+            "should_refresh": True
+        }
+
+    try:
+        bot_cache.mark_stale(
+            client_id, telegram_uid,
+            patch=lambda data: _patch_quickinstall(data, uuid, new_quickinstall)
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось обновить кеш: {e}")
+
+    logger.info(f"✅ Ключ успешно заменен, новый quickinstall: {new_quickinstall}")
+    return {
+        "success": True,
+        "new_quickinstall": new_quickinstall,
+        "message": "Ключ успешно заменен"
+    }
+
+
+class ReplaceKeyJobManager:
+    def __init__(self, jobs_dir=None, max_workers=4, retention_seconds=3600):
+        """
+        Args:
+            jobs_dir: Каталог файлов состояния задач
+            max_workers: Сколько замен ключа выполняется одновременно в воркере
+            retention_seconds: Через сколько завершенные задачи удаляются
+        """
+        if jobs_dir is None:
+            jobs_dir = f"{CACHE_DIR}/.replace_key_jobs"
+
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="replace-key")
+        self._lock = threading.Lock()
+
+    def _job_file_path(self, job_id):
+        return self.jobs_dir / f"job_{job_id}.json"
+
+    def _save(self, job):
+        """Атомарно записывает состояние задачи"""
+        job_file = self._job_file_path(job['id'])
+        temp_file = job_file.with_suffix('.tmp')
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        temp_file.replace(job_file)
+
+    def _update(self, job, **fields):
+        with self._lock:
+            job.update(fields)
+            job['updated_at'] = time.time()
+            try:
+                self._save(job)
+            except OSError as e:
+                logger.error(f"❌ Не удалось сохранить состояние задачи {job['id']}: {e}")
+
+    def _set_stage(self, job, stage):
+        logger.info(f"📍 Задача {job['id']}: {stage}")
+        stages = job['stages'] + [{"stage": stage, "at": time.time()}]
+        self._update(job, stage=stage, stages=stages)
+
+    def _run(self, job, client_id, telegram_uid, uuid):
+        self._update(job, status=JOB_STATUS_RUNNING)
+        try:
+            result = perform_replace_key(
+                client_id, telegram_uid, uuid,
+                progress_callback=lambda stage: self._set_stage(job, stage)
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка задачи замены ключа {job['id']}: {e}")
+            result = {"success": False, "error": str(e)}
+
+        status = JOB_STATUS_DONE if result.get('success') else JOB_STATUS_FAILED
+        self._update(job, status=status, result=result, error=result.get('error'))
+
+    def submit(self, client_id, telegram_uid, uuid):
+        """Ставит замену ключа в очередь и возвращает job_id"""
+        self.cleanup()
+
+        now = time.time()
+        job = {
+            "id": uuid_lib.uuid4().hex,
+            "client_id": str(client_id),
+            "telegram_uid": str(telegram_uid),
+            "uuid": uuid,
+            "status": JOB_STATUS_QUEUED,
+            "stage": REPLACE_KEY_STAGE_QUEUED,
+            "stages": [{"stage": REPLACE_KEY_STAGE_QUEUED, "at": now}],
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._save(job)
+        self._executor.submit(self._run, job, client_id, telegram_uid, uuid)
+
+        logger.info(f"📥 Задача замены ключа {job['id']} поставлена в очередь")
+        return job['id']
+
+    def get(self, job_id):
+        """Возвращает состояние задачи или None, если задача не найдена"""
+        # job_id - hex uuid, остальное не может быть именем нашего файла
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+
+        try:
+            with open(self._job_file_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"❌ Ошибка чтения задачи {job_id}: {e}")
+            return None
+
+    def cleanup(self):
+        """Удаляет файлы задач старше retention_seconds"""
+        cutoff = time.time() - self.retention_seconds
+        for job_file in self.jobs_dir.glob("job_*.json"):
+            try:
+                if job_file.stat().st_mtime < cutoff:
+                    job_file.unlink()
+            except OSError:
+                pass
+
+
+# Глобальный менеджер задач замены ключа
+replace_key_jobs = ReplaceKeyJobManager()
@@ -0,0 +1,203 @@
+"""
+Сервис получения подписок клиента через Telegram бота
+Запрос к боту + парсинг ответа + сохранение в кеш (подписки сохраняются уже
+обработанными, см. cache_schema). Одновременные запросы
+для одного клиента объединяются (single-flight): один запрос к боту
+и одна запись в кеш на всех
+"""
+import time
+import logging
+
+from backend.config.settings import CACHE_DIR, TELEGRAM_SUBPROCESS_TIMEOUT
+from backend.config.constants import (
+    CACHE_DEFAULT_TTL,
+    CACHE_NEGATIVE_NO_SUBSCRIPTIONS,
+    CACHE_NEGATIVE_BOT_TIMEOUT,
+    TELEGRAM_FLOOD_WAIT_PREFIX
+)
+from backend.core.cache_manager import bot_cache, NEGATIVE_FIELD
+from backend.core.single_flight import SingleFlight
+from backend.services.telegram_service import send_message_to_bot
+from backend.utils import parse_telegram_bot_response, prepare_subscriptions_data, upgrade_cache_data
+from backend.utils.cache_schema import SCHEMA_VERSION_FIELD, PROCESSED_ON_FIELD
+
+logger = logging.getLogger(__name__)
+
+BOT_TIMEOUT_MESSAGE = "Бот не ответил (возможно, подписок нет)"
+
+# Ждем чужой запрос чуть дольше, чем он может длиться сам
+subscriptions_flight = SingleFlight(
+    lock_dir=f"{CACHE_DIR}/.locks",
+    lock_timeout=TELEGRAM_SUBPROCESS_TIMEOUT + 5
+)
+
+
+# Поля записи кеша, которые заполняет ответ бота (остальные - RemnaWave)
+BOT_CACHE_FIELDS = (
+    'subscriptions', 'no_subscriptions', 'message', 'client_name', 'timestamp', NEGATIVE_FIELD,
+    SCHEMA_VERSION_FIELD, PROCESSED_ON_FIELD
+)
+
+
+def subscriptions_ttl(result):
+    """TTL записи кеша: у негативных результатов свой короткий TTL"""
+    kind = bot_cache.negative_kind(result)
+    if kind:
+        return bot_cache.negative_ttl(kind)
+    return CACHE_DEFAULT_TTL
+
+
+def _store_result(client_id, telegram_uid, result):
+    """
+    Сохраняет ответ бота в кеш (один раз на все объединенные запросы).
+    Поля бота заменяются целиком, данные RemnaWave в записи остаются как были
+    """
+    try:
+        stale_fields = [field for field in BOT_CACHE_FIELDS if field not in result]
+        bot_cache.merge(client_id, telegram_uid, result, remove=stale_fields, ttl=subscriptions_ttl(result))
+        logger.info("💾 Данные с именем клиента сохранены в кеш")
+    except Exception as cache_error:
+        logger.error(f"❌ Ошибка сохранения в кеш: {cache_error}")
+
+
+def _bot_reply_text(bot_response):
+    """
+    Текст ответа бота. Демон и telegram_sender оборачивают его в
+    {"success": true, "response": "..."} - ошибки ("❌ ...") лежат внутри
+    """
+    parsed = parse_telegram_bot_response(bot_response)
+    if isinstance(parsed, dict) and isinstance(parsed.get('response'), str):
+        return parsed['response']
+    return bot_response
+
+
+def fetch_subscriptions(client_id, telegram_uid, client_name):
+    """
+    Запрашивает подписки у бота и сохраняет результат в кеш
+
+    Args:
+        client_id: ID клиента в UseDesk
+        telegram_uid: Telegram UID клиента
+        client_name: Имя клиента (сохраняется в кеш вместе с подписками)
+
+    Returns:
+        Словарь в формате записи кеша (подписки обработаны, если результат сохранен):
+        {'subscriptions': [...], 'client_name': str, 'no_subscriptions': bool, 'message': str}
+        или None, если бот вернул ошибку
+    """
+    telegram_message = f"Узнать подписки\n{telegram_uid}"
+    logger.info(f"Отправка запроса в Telegram: {repr(telegram_message)}")
+
+    # БЫСТРЫЙ СИНХРОННЫЙ ЗАПРОС
+    logger.info("🚀 Быстрый запрос к боту...")
+    bot_response = send_message_to_bot(telegram_message)
+
+    # ДЕТАЛЬНОЕ ЛОГИРОВАНИЕ ОТВЕТА ОТ БОТА
+    logger.info(f"🤖 ОТВЕТ ОТ TELEGRAM БОТА:")
+    logger.info(f"   Тип ответа: {type(bot_response)}")
+    logger.info(f"   Длина ответа: {len(str(bot_response)) if bot_response else 0}")
+    logger.info(f"   Ответ (первые 200 символов): {str(bot_response)[:200] if bot_response else 'ПУСТОЙ'}")
+
+    # Проверяем, что получены корректные данные
+    reply_text = _bot_reply_text(bot_response)
+    if reply_text and reply_text.startswith(TELEGRAM_FLOOD_WAIT_PREFIX):
+        # Пауза Telegram (до отправки или во время запроса) - это ошибка, а не
+        # пустой список: вызывающий покажет устаревшие данные или 503
+        logger.warning(f"🛑 {reply_text}")
+        return None
+
+    if not reply_text or reply_text.startswith("❌"):
+        logger.error(f"❌ Некорректный ответ от бота: {reply_text}")
+
+        # Специальная обработка для таймаута
+        if reply_text and "таймаута" in reply_text.lower():
+            logger.warning("⏰ Бот не ответил в течение таймаута - возможно, у клиента нет подписок")
+            # Возвращаем пустой результат вместо ошибки и кешируем его ненадолго,
+            # чтобы перезагрузки виджета не спрашивали бота каждый раз
+            result = prepare_subscriptions_data({
+                'subscriptions': [],
+                'no_subscriptions': True,
+                'message': BOT_TIMEOUT_MESSAGE,
+                'client_name': client_name,
+                NEGATIVE_FIELD: CACHE_NEGATIVE_BOT_TIMEOUT
+            })
+            # Настоящие (пусть и устаревшие) подписки таймаутом не затираем
+            existing = bot_cache.get_entry_info(client_id, telegram_uid)
+            if existing is None or existing['negative']:
+                _store_result(client_id, telegram_uid, result)
+            return result
+
+        return None
+
+    # Парсим ответ используя универсальный парсер (обрабатывает двойной JSON автоматически!)
+    result = {'subscriptions': [], 'client_name': client_name}
+    try:
+        logger.info(f"📋 Парсим ответ от бота...")
+        response_json = parse_telegram_bot_response(bot_response)
+        logger.info(f"✅ Ответ распарсен: {type(response_json)}")
+
+        # Если парсер вернул dict - обрабатываем как JSON
+        if isinstance(response_json, dict) and response_json.get('success'):
+            if response_json.get('no_subscriptions'):
+                # Случай отсутствия подписок
+                logger.info("📭 Обнаружен случай отсутствия подписок")
+                result = {
+                    'subscriptions': [],
+                    'no_subscriptions': True,
+                    'message': response_json.get('message', 'Подписок нет'),
+                    'client_name': client_name,
+                    'timestamp': time.time(),
+                    NEGATIVE_FIELD: CACHE_NEGATIVE_NO_SUBSCRIPTIONS
+                }
+            elif 'subscriptions' in response_json:
+                subscriptions_data = response_json['subscriptions']
+                logger.info(f"✅ Найдено подписок: {len(subscriptions_data)}")
+                logger.info(f"📋 Подписки: {subscriptions_data}")
+                result = {
+                    'subscriptions': subscriptions_data,
+                    'client_name': client_name,
+                    'timestamp': time.time()
+                }
+            else:
+                logger.warning(f"⚠️ JSON не содержит подписок или флага no_subscriptions")
+                return result
+        else:
+            logger.warning(f"⚠️ JSON success=False")
+            return result
+    except Exception as e:
+        logger.error(f"❌ Ошибка парсинга JSON: {e}")
+        logger.error(f"❌ Сырой ответ: {bot_response}")
+        return result
+
+    result = prepare_subscriptions_data(result)
+    _store_result(client_id, telegram_uid, result)
+
+    return result
+
+
+def get_subscriptions_coalesced(client_id, telegram_uid, client_name):
+    """
+    Как fetch_subscriptions, но одновременные вызовы для одного Telegram пользователя
+    (перезагрузки виджета, автозагрузка, второй агент, другой client_id того же
+    пользователя) делят один запрос к боту. Воркеры, ждавшие чужой запрос, берут
+    результат из кеша
+    """
+    key = f"subscriptions:{telegram_uid}"
+    return subscriptions_flight.do(
+        key,
+        lambda: fetch_subscriptions(client_id, telegram_uid, client_name),
+        recheck=lambda: bot_cache.get(client_id, telegram_uid)
+    )
+
+
+def revalidate_subscriptions(client_id, telegram_uid, stale_data):
+    """
+    Фоновое обновление истекшей записи кеша (stale-while-revalidate).
+    Данные RemnaWave в записи сохраняются (fetch_subscriptions обновляет только поля бота)
+    """
+    stale_data = stale_data if isinstance(stale_data, dict) else {}
+    return get_subscriptions_coalesced(client_id, telegram_uid, stale_data.get('client_name', 'Клиент'))
+
+
+bot_cache.set_revalidator(revalidate_subscriptions)
+bot_cache.set_migrator(upgrade_cache_data)
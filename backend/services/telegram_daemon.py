@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Долгоживущий Telegram демон
+Держит одно подключенное TelegramClient соединение и принимает команды
+от Flask воркеров через Unix сокет (JSON lines)
+
+Протокол (одна строка JSON на запрос, последняя строка ответа - результат):
+    -> {"message": "Узнать подписки\\n123456"}
+    <- {"success": true, "response": "..."}
+    -> {"message": "Заменить ключ\\n123456\\n<uuid>", "progress": true}
+    <- {"event": "progress", "stage": "command_sent"}   (ноль или больше строк)
+    <- {"success": true, "response": "..."}
+    -> {"command": "ping"}
+    <- {"success": true, "pong": true, "connected": true, "scheduler": {...}}
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import sys
+
+from backend.config.settings import TELEGRAM_DAEMON_SOCKET, LOG_LEVEL
+from backend.services.telegram_replies import get_reply_listener
+from backend.services.telegram_scheduler import AdaptiveCommandScheduler
+from backend.services.telegram_sender import (
+    create_telegram_client,
+    send_message_and_get_response,
+    requires_extended_timeout,
+    REQUEST_CONFIG,
+    TELEGRAM_BOT_USERNAME
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramDaemon:
+    """Unix сокет сервер поверх одного постоянного TelegramClient"""
+
+    def __init__(self, socket_path=TELEGRAM_DAEMON_SOCKET):
+        self.socket_path = socket_path
+        self.lock_path = f"{socket_path}.lock"
+        self.client = None
+        self._lock_file = None
+        # С подпиской на обновления ответы сопоставляются с командами (telegram_replies),
+        # и несколько команд могут быть в работе одновременно (лимит адаптивный,
+        # см. telegram_scheduler). В режиме опроса ответы сопоставляются только
+        # по времени - команды идут строго по очереди
+        self.scheduler = AdaptiveCommandScheduler(
+            REQUEST_CONFIG['max_concurrent_commands'],
+            increase_after=REQUEST_CONFIG['concurrency_increase_after']
+        )
+        self._command_lock = asyncio.Lock()
+
+    def _acquire_instance_lock(self):
+        """Гарантирует что запущен только один демон на сокет"""
+        self._lock_file = open(self.lock_path, 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+
+        self._lock_file.write(str(os.getpid()))
+        self._lock_file.flush()
+        return True
+
+    async def _ensure_connected(self):
+        """Подключает клиента (один раз) и переподключает при обрыве"""
+        if self.client is None:
+            self.client = create_telegram_client()
+
+        if not self.client.is_connected():
+            logger.info("🔌 Подключение к Telegram...")
+            await self.client.connect()
+
+            # Демон не может запросить код подтверждения - авторизация делается через run.py
+            if not await self.client.is_user_authorized():
+                raise RuntimeError("Telegram сессия не авторизована, запустите авторизацию через backend.run")
+
+            logger.info("✅ Telegram клиент подключен")
+
+    async def _send(self, message, progress_callback=None):
+        return await send_message_and_get_response(
+            message,
+            use_extended_timeout=requires_extended_timeout(message),
+            client=self.client,
+            progress_callback=progress_callback
+        )
+
+    async def _execute(self, request, progress_callback=None):
+        """Выполняет одну команду и возвращает словарь ответа"""
+        if request.get('command') == 'ping':
+            connected = bool(self.client and self.client.is_connected())
+            return {
+                "success": True,
+                "pong": True,
+                "connected": connected,
+                "scheduler": self.scheduler.get_stats()
+            }
+
+        message = request.get('message')
+        if not message:
+            return {"success": False, "error": "Требуется поле 'message'"}
+
+        # Во время FloodWait не ставим команду в очередь - отвечаем сразу
+        paused = self.scheduler.paused_response()
+        if paused:
+            return {"success": True, "response": paused}
+
+        await self._ensure_connected()
+        listener = None
+        if REQUEST_CONFIG['use_update_events']:
+            listener = await get_reply_listener(self.client, TELEGRAM_BOT_USERNAME)
+
+        if listener and listener.available:
+            async with self.scheduler.slot():
+                # Пауза могла начаться, пока команда ждала в очереди
+                paused = self.scheduler.paused_response()
+                if paused:
+                    return {"success": True, "response": paused}
+                response = await self._send(message, progress_callback)
+            await self.scheduler.record_result(response)
+        else:
+            async with self._command_lock:
+                response = await self._send(message, progress_callback)
+
+        return {"success": True, "response": response}
+
+    async def _handle_connection(self, reader, writer):
+        """Обрабатывает одно подключение Flask воркера"""
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+
+            def send_progress(stage):
+                event = {"event": "progress", "stage": stage}
+                writer.write(json.dumps(event).encode('utf-8') + b'\n')
+
+            try:
+                request = json.loads(line.decode('utf-8'))
+                progress_callback = send_progress if request.get('progress') else None
+                result = await self._execute(request, progress_callback)
+            except json.JSONDecodeError as e:
+                result = {"success": False, "error": f"Некорректный JSON: {e}"}
+            except Exception as e:
+                logger.error(f"❌ Ошибка выполнения команды: {e}")
+                result = {"success": False, "error": str(e)}
+
+            writer.write(json.dumps(result, ensure_ascii=False).encode('utf-8') + b'\n')
+            await writer.drain()
+
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"⚠️ Клиент отключился до ответа: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Запускает сервер и держит соединение с Telegram"""
+        if not self._acquire_instance_lock():
+            logger.info(f"ℹ️ Демон уже запущен для сокета {self.socket_path}")
+            return
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        # Подключаемся заранее - это и есть выигрыш по сравнению с subprocess на каждый запрос
+        await self._ensure_connected()
+
+        server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        logger.info(f"🚀 Telegram демон слушает {self.socket_path}")
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.client and self.client.is_connected():
+                await self.client.disconnect()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+
+def main():
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        force=True
+    )
+    socket_path = sys.argv[1] if len(sys.argv) == 2 else TELEGRAM_DAEMON_SOCKET
+
+    daemon = TelegramDaemon(socket_path)
+    try:
+        asyncio.run(daemon.serve())
+    except KeyboardInterrupt:
+        logger.info("🛑 Telegram демон остановлен")
+    except Exception as e:
+        logger.error(f"❌ Критическая ошибка Telegram демона: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Событийное ожидание ответов бота
+Вместо опроса get_messages каждые 0.5с подписываемся на NewMessage из чата бота
+и будим ожидающий запрос сразу, как только приходит подходящий ответ.
+
+Все команды идут в один чат, поэтому каждый входящий ответ отдается ровно
+одному ожидающему (см. BotReplyListener._route):
+1. reply_to на id нашей команды
+2. Telegram UID из команды встречается в тексте ответа - только владельцу
+   UID (если его команда еще не отправлена, ответ ждет mark_sent)
+3. Тип ответа совпадает с типом команды - самому старому ожидающему,
+   чья команда отправлена раньше ответа (бот отвечает по очереди)
+"""
+import asyncio
+import logging
+from collections import deque
+
+from telethon import events
+
+from backend.config.constants import (
+    REPLACE_KEY_STAGE_SUBSCRIPTION_ADDED,
+    REPLACE_KEY_STAGE_KEY_RECEIVED
+)
+
+logger = logging.getLogger(__name__)
+
+REPLY_KIND_LOOKUP = 'lookup'
+REPLY_KIND_REPLACE = 'replace'
+
+# Сколько id уже розданных сообщений и неразобранных ответов помнит слушатель
+CLAIMED_IDS_LIMIT = 1000
+UNROUTED_LIMIT = 100
+
+
+def is_bot_reply_text(text):
+    """Проверяет что текст похож на ответ бота на нашу команду
+    (подписки, "нет подписок" или сообщения замены ключа)
+    """
+    return classify_reply_text(text) is not None
+
+
+def classify_reply_text(text):
+    """Определяет к какому типу команды относится ответ бота
+
+    Returns:
+        REPLY_KIND_REPLACE, REPLY_KIND_LOOKUP или None для посторонних сообщений
+    """
+    if not text:
+        return None
+
+    text_lower = text.lower()
+    if "новая подписка успешно добавлена" in text_lower or "вот ваш ключ" in text_lower:
+        return REPLY_KIND_REPLACE
+
+    if (("**Название:**" in text or "Название:" in text) or
+            ("подписок нет" in text_lower or "подписки нет" in text_lower or "нет подписок" in text_lower)):
+        return REPLY_KIND_LOOKUP
+
+    return None
+
+
+def replace_stage(text):
+    """Стадия замены ключа по сообщению бота (REPLACE_KEY_STAGE_*) или None"""
+    text_lower = (text or '').lower()
+    if "вот ваш ключ" in text_lower:
+        return REPLACE_KEY_STAGE_KEY_RECEIVED
+    if "новая подписка успешно добавлена" in text_lower:
+        return REPLACE_KEY_STAGE_SUBSCRIPTION_ADDED
+    return None
+
+
+def parse_command(message):
+    """Извлекает (тип ответа, Telegram UID) из текста команды боту"""
+    lines = message.strip().split('\n')
+    kind = REPLY_KIND_REPLACE if lines[0].startswith("Заменить ключ") else REPLY_KIND_LOOKUP
+    telegram_uid = lines[1].strip() if len(lines) > 1 else None
+    return kind, telegram_uid
+
+
+class ReplyWaiter:
+    """Ожидание ответа на одну отправленную команду
+
+    Замена ключа - два сообщения бота: "Новая подписка успешно добавлена!"
+    и "Вот ваш ключ: ...". Ждем второе, но после первого не дольше
+    second_message_timeout секунд
+    """
+
+    def __init__(self, kind, telegram_uid, progress_callback=None, second_message_timeout=10):
+        self.kind = kind
+        self.telegram_uid = telegram_uid
+        self.progress_callback = progress_callback
+        self.second_message_timeout = second_message_timeout
+        self.sent_message_id = None
+        self._messages = []
+        self._event = asyncio.Event()
+
+    def push(self, message):
+        self._messages.append(message)
+        self._event.set()
+
+        if self.progress_callback and self.kind == REPLY_KIND_REPLACE:
+            stage = replace_stage(message.text)
+            if stage:
+                self.progress_callback(stage)
+
+    def _replies(self):
+        return [m for m in self._messages if classify_reply_text(m.text) == self.kind]
+
+    @property
+    def done(self):
+        """Уже получен полный ответ своего типа"""
+        replies = self._replies()
+        if self.kind == REPLY_KIND_REPLACE:
+            return any(replace_stage(m.text) == REPLACE_KEY_STAGE_KEY_RECEIVED for m in replies)
+        return bool(replies)
+
+    def accepts(self, message):
+        """Может ли сообщение быть ответом на эту команду"""
+        if self.sent_message_id is None or message.id <= self.sent_message_id or self.done:
+            return False
+        kind = classify_reply_text(message.text)
+        return kind is None or kind == self.kind
+
+    def _reply_text(self):
+        replies = self._replies()
+        if self.kind == REPLY_KIND_REPLACE:
+            # Оба сообщения замены нужны parse_replace_response: подтверждение и ссылка
+            return "\n\n".join(m.text for m in replies) if replies else None
+        return replies[0].text if replies else None
+
+    async def wait_for_reply(self, timeout):
+        """
+        Ждет подходящий ответ бота не дольше timeout секунд
+
+        Returns:
+            Текст ответа. Если за время ожидания пришли только сообщения без
+            ключевых слов - последнее из них. None если ничего не пришло
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        first_reply_at = None
+
+        while not self.done:
+            if self._replies() and first_reply_at is None:
+                first_reply_at = loop.time()
+                deadline = min(deadline, first_reply_at + self.second_message_timeout)
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+
+        reply_text = self._reply_text()
+        if reply_text:
+            return reply_text
+
+        pending = [m for m in self._messages if m.text]
+        return pending[-1].text if pending else None
+
+
+class BotReplyListener:
+    """Подписка на входящие сообщения бота и маршрутизация ответов. Одна на клиента"""
+
+    def __init__(self, client, bot_username):
+        self.client = client
+        self.bot_username = bot_username
+        self.available = False
+        # Запуск (start) - общий для одновременных первых вызовов get_reply_listener
+        self.start_task = None
+        self._waiters = []
+        # Ответы, которые пришли раньше, чем ожидающий узнал id своей команды
+        self._unrouted = deque(maxlen=UNROUTED_LIMIT)
+        # Розданные сообщения: множество для проверки, очередь - чтобы забывать самые старые
+        self._claimed_ids = set()
+        self._claimed_order = deque()
+
+    async def start(self):
+        """Регистрирует обработчик NewMessage. При ошибке остается режим опроса"""
+        try:
+            bot_entity = await self.client.get_input_entity(self.bot_username)
+            self.client.add_event_handler(
+                self._on_new_message,
+                events.NewMessage(chats=bot_entity, incoming=True)
+            )
+            self.available = True
+            logger.info(f"📡 Подписка на ответы бота {self.bot_username} включена")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось подписаться на обновления, используем опрос: {e}")
+            self.available = False
+
+    def subscribe(self, message, progress_callback=None, second_message_timeout=10):
+        """Регистрирует ожидание ДО отправки команды, чтобы не пропустить быстрый ответ"""
+        kind, telegram_uid = parse_command(message)
+        waiter = ReplyWaiter(
+            kind,
+            telegram_uid,
+            progress_callback=progress_callback,
+            second_message_timeout=second_message_timeout
+        )
+        self._waiters.append(waiter)
+        return waiter
+
+    def mark_sent(self, waiter, sent_message_id):
+        """Запоминает id отправленной команды и раздает ответы, пришедшие раньше"""
+        waiter.sent_message_id = sent_message_id
+        unrouted = list(self._unrouted)
+        self._unrouted.clear()
+        for message in unrouted:
+            self._route(message)
+
+    def unsubscribe(self, waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+        # Неразобранные ответы некому отдать
+        if not self._waiters:
+            self._unrouted.clear()
+
+    def _remember_claimed(self, message_id):
+        """Запоминает розданное сообщение; держим только последние CLAIMED_IDS_LIMIT id"""
+        self._claimed_ids.add(message_id)
+        self._claimed_order.append(message_id)
+        while len(self._claimed_order) > CLAIMED_IDS_LIMIT:
+            self._claimed_ids.discard(self._claimed_order.popleft())
+
+    def claim(self, message):
+        """Забирает сообщение из истории (поздний ответ), если его не получил другой запрос"""
+        if message.id in self._claimed_ids:
+            return False
+        self._remember_claimed(message.id)
+        return True
+
+    def _route(self, message):
+        """Отдает сообщение ровно одному ожидающему"""
+        candidates = [w for w in self._waiters if w.accepts(message)]
+
+        target = None
+        reply_to = getattr(message, 'reply_to_msg_id', None)
+        if reply_to:
+            target = next((w for w in self._waiters if w.sent_message_id == reply_to), None)
+
+        if target is None and message.text:
+            # Ответ с чужим UID не должен достаться другому запросу - ищем среди всех ожидающих
+            owners = [w for w in self._waiters if w.telegram_uid and not w.done and w.telegram_uid in message.text]
+            if owners:
+                ready = [w for w in owners if w.accepts(message)]
+                if ready:
+                    target = min(ready, key=lambda w: w.sent_message_id)
+                elif any(w.sent_message_id is None for w in owners):
+                    self._unrouted.append(message)
+                    return
+                else:
+                    logger.debug(f"📭 Сообщение бота id={message.id} с UID не новее команды владельца")
+                    return
+
+        if target is None and candidates:
+            target = min(candidates, key=lambda w: w.sent_message_id)
+
+        if target is None:
+            if any(w.sent_message_id is None for w in self._waiters):
+                self._unrouted.append(message)
+            else:
+                logger.debug(f"📭 Сообщение бота id={message.id} не относится ни к одному запросу")
+            return
+
+        self._remember_claimed(message.id)
+        logger.debug(f"🔗 Ответ id={message.id} → команда id={target.sent_message_id} (uid={target.telegram_uid})")
+        target.push(message)
+
+    async def _on_new_message(self, event):
+        message = event.message
+        logger.debug(f"📨 Новое сообщение от бота: id={message.id}")
+        self._route(message)
+
+
+async def get_reply_listener(client, bot_username):
+    """
+    Возвращает (и при первом вызове запускает) слушатель ответов для клиента.
+    Слушатель привязывается к клиенту до первого await, поэтому одновременные
+    первые вызовы ждут один запуск, а не регистрируют два обработчика
+    """
+    listener = getattr(client, '_bot_reply_listener', None)
+    if listener is None:
+        listener = BotReplyListener(client, bot_username)
+        client._bot_reply_listener = listener
+        listener.start_task = asyncio.ensure_future(listener.start())
+    await asyncio.shield(listener.start_task)
+    return listener
@@ -0,0 +1,82 @@
+"""
+Планировщик очереди команд Telegram демона с учетом FloodWait
+- Пока действует FloodWait (общая пауза в rate_limiter) команды сразу
+  получают ответ TELEGRAM_FLOOD_WAIT_PREFIX, а не висят до таймаута
+- Число одновременно выполняемых команд адаптивное: после FloodWait
+  уменьшается вдвое, после серии успешных команд растет на 1 до максимума
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from backend.config.constants import TELEGRAM_FLOOD_WAIT_PREFIX
+from backend.core.rate_limiter import telegram_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveCommandScheduler:
+    def __init__(self, max_concurrency, increase_after=20):
+        """
+        Args:
+            max_concurrency: Верхняя граница одновременных команд
+            increase_after: Сколько успешных команд подряд нужно для +1 к лимиту
+        """
+        self.max_concurrency = max_concurrency
+        self.increase_after = increase_after
+        self.limit = max_concurrency
+        self.active = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+        self._stats = {"completed": 0, "flood_waits": 0, "rejected_paused": 0}
+
+    def paused_response(self):
+        """Ответ для команды, пришедшей во время паузы, или None если паузы нет"""
+        paused_for = telegram_limiter.paused_for()
+        if paused_for <= 0:
+            return None
+
+        self._stats["rejected_paused"] += 1
+        return f"{TELEGRAM_FLOOD_WAIT_PREFIX}: Telegram ограничил запросы, повторите через {paused_for:.0f}с"
+
+    @asynccontextmanager
+    async def slot(self):
+        """Занимает место в очереди с учетом текущего адаптивного лимита"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.active -= 1
+                self._condition.notify_all()
+
+    async def record_result(self, response):
+        """Подстраивает лимит по результату команды"""
+        async with self._condition:
+            self._stats["completed"] += 1
+
+            if isinstance(response, str) and response.startswith(TELEGRAM_FLOOD_WAIT_PREFIX):
+                self._stats["flood_waits"] += 1
+                self._successes = 0
+                new_limit = max(1, self.limit // 2)
+                if new_limit != self.limit:
+                    logger.warning(f"📉 FloodWait: параллельность команд {self.limit} → {new_limit}")
+                self.limit = new_limit
+                return
+
+            self._successes += 1
+            if self._successes >= self.increase_after and self.limit < self.max_concurrency:
+                self.limit += 1
+                self._successes = 0
+                logger.info(f"📈 Параллельность команд увеличена до {self.limit}")
+                self._condition.notify_all()
+
+    def get_stats(self):
+        return {
+            **self._stats,
+            "limit": self.limit,
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+        }
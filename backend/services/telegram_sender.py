@@ -13,8 +13,12 @@ import time
 import re
 from datetime import timedelta
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 from dotenv import load_dotenv
 from backend.config.telegram import get_client_config, get_request_config
+from backend.config.constants import TELEGRAM_FLOOD_WAIT_PREFIX, REPLACE_KEY_STAGE_COMMAND_SENT
+from backend.core.rate_limiter import telegram_limiter
+from backend.services.telegram_replies import get_reply_listener, is_bot_reply_text
 from urllib.parse import quote
 
 load_dotenv()
@@ -26,9 +30,7 @@ API_ID = os.getenv('TELEGRAM_API_ID')
 API_HASH = os.getenv('TELEGRAM_API_HASH')
 PHONE_NUMBER = os.getenv('TELEGRAM_PHONE')
 
-last_request_time = 0
 REQUEST_CONFIG = get_request_config()
-MIN_REQUEST_INTERVAL = REQUEST_CONFIG['min_interval']
 
 if getattr(sys, 'frozen', False):
     bundle_dir = os.path.dirname(os.path.abspath(sys.executable))
@@ -40,108 +42,143 @@ SESSION_NAME = session_name
 
 TELEGRAM_BOT_USERNAME = "@official_vpnbot"
 
-async def ensure_request_interval():
-    """Обеспечивает минимальный интервал между запросами"""
-    global last_request_time
-    current_time = time.time()
-    time_since_last = current_time - last_request_time
+async def poll_for_reply(client, our_message_time, max_attempts, check_interval):
+    """Опрашивает историю чата с ботом (fallback когда обновления недоступны)
     
-    if time_since_last < MIN_REQUEST_INTERVAL:
-        sleep_time = MIN_REQUEST_INTERVAL - time_since_last
-        logger.info(f"⏱️ Ожидание {sleep_time:.2f} сек для соблюдения интервала запросов")
-        await asyncio.sleep(sleep_time)
+    Returns:
+        Текст ответа бота или None
+    """
+    # БЫСТРЫЙ опрос с минимальным ожиданием
+    logger.info("Быстрый поиск ответа от бота...")
+    for attempt in range(max_attempts):
+        await asyncio.sleep(check_interval)
+        
+        # Общий лимит на чтение истории для всех процессов
+        await telegram_limiter.acquire_async('history')
+        
+        # Получаем сообщения с настраиваемым лимитом
+        messages = await client.get_messages(TELEGRAM_BOT_USERNAME, limit=REQUEST_CONFIG['message_limit'])
+        
+        # Ищем новый ответ бота (подписки ИЛИ "нет подписок")
+        for msg in messages:
+            # Детальное логирование для диагностики
+            if not msg.out and msg.text:
+                logger.info(f"🔍 Проверяем сообщение: дата={msg.date}, наша_дата={our_message_time}, новее={(msg.date > our_message_time)}, текст={msg.text[:30]}...")
+                
+            # Делаем проверку времени менее строгой (разрешаем сообщения на 5 секунд раньше нашего)
+            time_threshold = our_message_time - timedelta(seconds=5)
+            if not msg.out and msg.date > time_threshold and is_bot_reply_text(msg.text):
+                logger.info(f"⚡ Быстро найден ответ бота (попытка {attempt+1}): {msg.text[:50]}...")
+                return msg.text
+        
+        # Если нашли любой новый ответ после 1.5 секунд - используем его
+        if attempt >= 7:  # После 1.5 секунд
+            time_threshold_fallback = our_message_time - timedelta(seconds=5)
+            for msg in messages:
+                if not msg.out and msg.text and msg.date > time_threshold_fallback:
+                    logger.info(f"Найден любой новый ответ бота (попытка {attempt+1}): {msg.text[:50]}...")
+                    return msg.text
     
-    last_request_time = time.time()
+    return None
+
+def create_telegram_client():
+    """Создает клиент с оптимизированными настройками для уменьшения flood wait"""
+    client_config = get_client_config()
+    return TelegramClient(
+        SESSION_NAME, 
+        API_ID, 
+        API_HASH,
+        **client_config
+    )
 
-async def send_message_and_get_response(message, use_extended_timeout=False):
+async def send_message_and_get_response(message, use_extended_timeout=False, client=None, progress_callback=None):
     """Отправляет сообщение боту и возвращает ответ
     
     Args:
         message: Текст сообщения для отправки
         use_extended_timeout: Использовать увеличенный таймаут для медленных операций
+        client: Уже подключенный TelegramClient (демон). Если не передан -
+            создается временный клиент, который отключается после ответа
+        progress_callback: Вызывается со стадией (REPLACE_KEY_STAGE_*) по ходу выполнения
     """
-    client = None
+    # Пока действует FloodWait - отвечаем сразу, не трогая Telegram
+    paused_for = telegram_limiter.paused_for()
+    if paused_for > 0:
+        logger.warning(f"🛑 Запросы к Telegram на паузе еще {paused_for:.0f} сек")
+        return f"{TELEGRAM_FLOOD_WAIT_PREFIX}: Telegram ограничил запросы, повторите через {paused_for:.0f}с"
+    
+    owns_client = client is None
     try:
-        # Создаем клиент с оптимизированными настройками для уменьшения flood wait
-        client_config = get_client_config()
-        client = TelegramClient(
-            SESSION_NAME, 
-            API_ID, 
-            API_HASH,
-            **client_config
-        )
-        
-        # Проверяем существование сессии
-        session_file = f"{SESSION_NAME}.session"
-        if not os.path.exists(session_file):
-            logger.info("🔐 Сессия не найдена, требуется авторизация в Telegram")
-            print("🔐 Первый запуск - требуется авторизация в Telegram")
-            print(f"📱 Номер телефона: {PHONE_NUMBER}")
+        if owns_client:
+            client = create_telegram_client()
             
-        await client.start(phone=PHONE_NUMBER)
-        
-        # Обеспечиваем минимальный интервал между запросами
-        await ensure_request_interval()
-        
-        logger.info(f"Отправка сообщения боту {TELEGRAM_BOT_USERNAME}: {message}")
-        
-        # Отправляем сообщение
-        result = await client.send_message(TELEGRAM_BOT_USERNAME, message)
-        logger.info(f"Сообщение отправлено: {result.id}")
+            # Проверяем существование сессии
+            session_file = f"{SESSION_NAME}.session"
+            if not os.path.exists(session_file):
+                logger.info("🔐 Сессия не найдена, требуется авторизация в Telegram")
+                print("🔐 Первый запуск - требуется авторизация в Telegram")
+                print(f"📱 Номер телефона: {PHONE_NUMBER}")
+                
+            await client.start(phone=PHONE_NUMBER)
         
-        # Выбираем таймауты в зависимости от типа операции
-        if use_extended_timeout:
-            max_attempts = REQUEST_CONFIG['extended_max_attempts']
-            check_interval = REQUEST_CONFIG['extended_check_interval']
-            logger.info(f"⏰ Использован расширенный таймаут: {max_attempts} попыток × {check_interval}с = {max_attempts * check_interval}с")
-        else:
-            max_attempts = REQUEST_CONFIG['max_attempts']
-            check_interval = REQUEST_CONFIG['check_interval']
-            logger.info(f"⏰ Использован стандартный таймаут: {max_attempts} попыток × {check_interval}с = {max_attempts * check_interval}с")
+        # Подписываемся на ответы ДО отправки, чтобы не пропустить быстрый ответ бота
+        listener = None
+        if REQUEST_CONFIG['use_update_events']:
+            listener = await get_reply_listener(client, TELEGRAM_BOT_USERNAME)
+        waiter = None
+        if listener and listener.available:
+            waiter = listener.subscribe(
+                message,
+                progress_callback=progress_callback,
+                second_message_timeout=REQUEST_CONFIG['replace_key_second_message_timeout']
+            )
         
-        # БЫСТРЫЙ опрос с минимальным ожиданием
-        logger.info("Быстрый поиск ответа от бота...")
-        our_message_time = result.date
-        for attempt in range(max_attempts):
-            await asyncio.sleep(check_interval)
+        try:
+            # Общий лимит на отправку сообщений для всех процессов
+            await telegram_limiter.acquire_async('send_message')
             
-            # Обеспечиваем интервал перед запросом сообщений
-            await ensure_request_interval()
+            logger.info(f"Отправка сообщения боту {TELEGRAM_BOT_USERNAME}: {message}")
             
-            # Получаем сообщения с настраиваемым лимитом
-            messages = await client.get_messages(TELEGRAM_BOT_USERNAME, limit=REQUEST_CONFIG['message_limit'])
+            # Отправляем сообщение
+            result = await client.send_message(TELEGRAM_BOT_USERNAME, message)
+            logger.info(f"Сообщение отправлено: {result.id}")
+            if progress_callback:
+                progress_callback(REPLACE_KEY_STAGE_COMMAND_SENT)
             
-            # Ищем новый ответ бота (подписки ИЛИ "нет подписок")
-            for msg in messages:
-                # Детальное логирование для диагностики
-                if not msg.out and msg.text:
-                    logger.info(f"🔍 Проверяем сообщение: дата={msg.date}, наша_дата={our_message_time}, новее={(msg.date > our_message_time)}, текст={msg.text[:30]}...")
-                    
-                # Делаем проверку времени менее строгой (разрешаем сообщения на 5 секунд раньше нашего)
-                time_threshold = our_message_time - timedelta(seconds=5)
-                if (not msg.out and msg.text and msg.date > time_threshold and 
-                    (("**Название:**" in msg.text or "Название:" in msg.text) or
-                     ("подписок нет" in msg.text.lower() or "подписки нет" in msg.text.lower() or "нет подписок" in msg.text.lower()) or
-                     ("новая подписка успешно добавлена" in msg.text.lower()) or
-                     ("вот ваш ключ" in msg.text.lower()))):
-                    logger.info(f"⚡ Быстро найден ответ бота (попытка {attempt+1}): {msg.text[:50]}...")
-                    return parse_bot_response(msg.text)
+            # Выбираем таймауты в зависимости от типа операции
+            if use_extended_timeout:
+                max_attempts = REQUEST_CONFIG['extended_max_attempts']
+                check_interval = REQUEST_CONFIG['extended_check_interval']
+                logger.info(f"⏰ Использован расширенный таймаут: {max_attempts} попыток × {check_interval}с = {max_attempts * check_interval}с")
+            else:
+                max_attempts = REQUEST_CONFIG['max_attempts']
+                check_interval = REQUEST_CONFIG['check_interval']
+                logger.info(f"⏰ Использован стандартный таймаут: {max_attempts} попыток × {check_interval}с = {max_attempts * check_interval}с")
+            
+            our_message_time = result.date
             
-            # Если нашли любой новый ответ после 1.5 секунд - используем его
-            if attempt >= 7:  # После 1.5 секунд
-                time_threshold_fallback = our_message_time - timedelta(seconds=5)
-                for msg in messages:
-                    if not msg.out and msg.text and msg.date > time_threshold_fallback:
-                        logger.info(f"Найден любой новый ответ бота (попытка {attempt+1}): {msg.text[:50]}...")
-                        return parse_bot_response(msg.text)
+            if waiter:
+                logger.info("📡 Ждем ответ бота через обновления...")
+                listener.mark_sent(waiter, result.id)
+                reply_text = await waiter.wait_for_reply(timeout=max_attempts * check_interval)
+                if reply_text:
+                    logger.info(f"⚡ Получен ответ бота через обновления: {reply_text[:50]}...")
+                    return parse_bot_response(reply_text)
+            else:
+                reply_text = await poll_for_reply(client, our_message_time, max_attempts, check_interval)
+                if reply_text:
+                    return parse_bot_response(reply_text)
+        finally:
+            if waiter:
+                listener.unsubscribe(waiter)
         
         # КРИТИЧНО: НЕ ищем старые ответы с подписками, так как они могут быть от других клиентов!
         # Если бот не ответил, возвращаем сообщение о том, что нет ответа
         logger.warning("⚠️ Бот не ответил на запрос в течение таймаута")
         logger.warning("🚨 НЕ используем старые ответы во избежание смешивания данных клиентов!")
         
-        # Обеспечиваем интервал перед последним запросом
-        await ensure_request_interval()
+        # Общий лимит на чтение истории перед последним запросом
+        await telegram_limiter.acquire_async('history')
         
         # Проверяем только последние сообщения после нашего запроса
         messages = await client.get_messages(TELEGRAM_BOT_USERNAME, limit=10)
@@ -150,6 +187,9 @@ async def send_message_and_get_response(message, use_extended_timeout=False):
         time_threshold = our_message_time - timedelta(seconds=5)
         for msg in messages:
             if (not msg.out and msg.text and msg.date > time_threshold):
+                # Ответ мог уже уйти другому параллельному запросу
+                if waiter and (msg.id <= result.id or not listener.claim(msg)):
+                    continue
                 logger.info(f"Найден поздний ответ бота: {msg.text[:50]}...")
                 return parse_bot_response(msg.text)
         
@@ -157,13 +197,18 @@ async def send_message_and_get_response(message, use_extended_timeout=False):
         logger.error("🚨 ТАЙМАУТ: Бот не ответил на запрос")
         return "❌ Бот не ответил на запрос в течение таймаута"
         
+    except FloodWaitError as e:
+        # Ставим на паузу все процессы ровно на время, которое назвал Telegram
+        telegram_limiter.pause(e.seconds, reason=f"FloodWait {e.seconds}s")
+        return f"{TELEGRAM_FLOOD_WAIT_PREFIX}: Telegram ограничил запросы, повторите через {e.seconds}с"
+    
     except Exception as e:
         error_msg = f"Ошибка отправки сообщения: {str(e)}"
         logger.error(error_msg)
         return f"❌ {error_msg}"
     
     finally:
-        if client and client.is_connected():
+        if owns_client and client and client.is_connected():
             await client.disconnect()
 
 def parse_bot_response(response_text):
@@ -322,6 +367,12 @@ def parse_bot_response(response_text):
         logger.error(f"Ошибка парсинга ответа бота: {e}")
         return f"Ответ бота получен, но произошла ошибка парсинга:\n\n{response_text}"
 
+def requires_extended_timeout(message):
+    """Определяет, требуется ли расширенный таймаут
+    Для операций замены ключа нужно больше времени (бот отправляет 2 сообщения)
+    """
+    return message.startswith("Заменить ключ")
+
 async def main():
     """Главная функция"""
     if len(sys.argv) != 2:
@@ -330,9 +381,7 @@ async def main():
     
     message = sys.argv[1]
     
-    # Определяем, требуется ли расширенный таймаут
-    # Для операций замены ключа нужно больше времени
-    use_extended_timeout = message.startswith("Заменить ключ")
+    use_extended_timeout = requires_extended_timeout(message)
     
     try:
         # Отправляем сообщение и получаем ответ
@@ -1,10 +1,15 @@
 """
 Сервис для работы с Telegram
-Обертка над telegram_sender.py для удобного использования в приложении
+Обертка над Telegram демоном (telegram_daemon.py) для удобного использования в приложении.
+Если демон недоступен - используется старый путь через subprocess (telegram_sender.py)
 """
 import subprocess
 import logging
+import socket
+import json
+import time
 import sys
+import os
 from tenacity import (
     retry,
     stop_after_attempt,
@@ -13,15 +18,173 @@ from tenacity import (
     before_sleep_log
 )
 
-from backend.config.settings import TELEGRAM_SUBPROCESS_TIMEOUT, TELEGRAM_REPLACE_KEY_TIMEOUT
+from backend.config.settings import (
+    TELEGRAM_SUBPROCESS_TIMEOUT,
+    TELEGRAM_REPLACE_KEY_TIMEOUT,
+    TELEGRAM_DAEMON_ENABLED,
+    TELEGRAM_DAEMON_SOCKET,
+    TELEGRAM_DAEMON_AUTOSTART,
+    TELEGRAM_DAEMON_START_TIMEOUT,
+    TELEGRAM_DAEMON_LOG_FILE
+)
 from backend.config.constants import (
+    TELEGRAM_FLOOD_WAIT_PREFIX,
     TELEGRAM_MAX_RETRY_ATTEMPTS,
     TELEGRAM_RETRY_MIN_WAIT,
     TELEGRAM_RETRY_MAX_WAIT
 )
+from backend.core.rate_limiter import telegram_limiter
 
 logger = logging.getLogger(__name__)
 
+_last_daemon_spawn = 0
+
+
+class TelegramDaemonUnavailable(Exception):
+    """Демон не запущен или не принимает подключения"""
+
+
+def _daemon_request(payload: dict, timeout: float, progress_callback=None) -> dict:
+    """
+    Отправляет одну JSON команду демону и читает ответ.
+    Строки {"event": "progress"} до результата передаются в progress_callback
+    
+    Raises:
+        TelegramDaemonUnavailable: Сокет отсутствует или подключение отклонено
+        socket.timeout: Демон не ответил за timeout секунд
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(TELEGRAM_DAEMON_SOCKET)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise TelegramDaemonUnavailable(str(e))
+        
+        sock.sendall(json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n')
+        
+        deadline = time.time() + timeout
+        reader = sock.makefile('rb')
+        while True:
+            # Общий таймаут на весь ответ, а не на каждую строку прогресса
+            sock.settimeout(max(0.1, deadline - time.time()))
+            line = reader.readline()
+            if not line:
+                raise TelegramDaemonUnavailable("Демон закрыл соединение без ответа")
+            
+            result = json.loads(line.decode('utf-8'))
+            if result.get('event') == 'progress':
+                if progress_callback:
+                    progress_callback(result.get('stage'))
+                continue
+            
+            return result
+    finally:
+        sock.close()
+
+
+def is_telegram_daemon_running() -> bool:
+    """Проверяет что демон отвечает на ping"""
+    try:
+        return bool(_daemon_request({"command": "ping"}, timeout=2).get('pong'))
+    except (TelegramDaemonUnavailable, OSError, ValueError):
+        return False
+
+
+def ensure_telegram_daemon() -> bool:
+    """
+    Запускает Telegram демон если он еще не запущен
+    
+    Несколько воркеров могут вызвать функцию одновременно - лишние экземпляры
+    демона завершатся сами (демон держит эксклюзивную блокировку на lock файл)
+    
+    Returns:
+        True если демон отвечает
+    """
+    global _last_daemon_spawn
+    
+    if not TELEGRAM_DAEMON_ENABLED:
+        return False
+    
+    if is_telegram_daemon_running():
+        return True
+    
+    if not TELEGRAM_DAEMON_AUTOSTART:
+        return False
+    
+    # Не пытаемся перезапускать демон чаще раза в TELEGRAM_DAEMON_START_TIMEOUT
+    now = time.time()
+    if now - _last_daemon_spawn < TELEGRAM_DAEMON_START_TIMEOUT:
+        return False
+    _last_daemon_spawn = now
+    
+    logger.info(f"🚀 Запуск Telegram демона (лог: {TELEGRAM_DAEMON_LOG_FILE})...")
+    # Свой вывод у демона - он переживает воркер и не должен писать в его stdio
+    try:
+        daemon_output = open(TELEGRAM_DAEMON_LOG_FILE, 'ab')
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось открыть лог демона {TELEGRAM_DAEMON_LOG_FILE}: {e}")
+        daemon_output = subprocess.DEVNULL
+    try:
+        subprocess.Popen(
+            [sys.executable, '-m', 'backend.services.telegram_daemon', TELEGRAM_DAEMON_SOCKET],
+            stdin=subprocess.DEVNULL,
+            stdout=daemon_output,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+            close_fds=True
+        )
+    finally:
+        if daemon_output is not subprocess.DEVNULL:
+            daemon_output.close()
+    
+    deadline = now + TELEGRAM_DAEMON_START_TIMEOUT
+    while time.time() < deadline:
+        if os.path.exists(TELEGRAM_DAEMON_SOCKET) and is_telegram_daemon_running():
+            logger.info("✅ Telegram демон запущен")
+            return True
+        time.sleep(0.2)
+    
+    logger.warning("⚠️ Telegram демон не запустился, используем subprocess")
+    return False
+
+
+def _send_via_daemon(message: str, timeout: int, progress_callback=None) -> str:
+    """Отправляет сообщение через постоянное соединение демона"""
+    payload = {"message": message, "progress": progress_callback is not None}
+    result = _daemon_request(payload, timeout=timeout, progress_callback=progress_callback)
+    
+    if not result.get('success'):
+        error_msg = f"Ошибка Telegram демона: {result.get('error')}"
+        logger.error(f"❌ {error_msg}")
+        return f"❌ {error_msg}"
+    
+    # Тот же формат что печатал telegram_sender в stdout - парсеры не меняются
+    return json.dumps(result, ensure_ascii=False)
+
+
+def _send_via_subprocess(message: str, timeout: int) -> str:
+    """Запускает telegram_sender.py отдельным процессом (fallback без демона)"""
+    logger.debug("🔄 Режим Python: запуск через subprocess")
+    
+    python_executable = sys.executable
+    
+    result = subprocess.run(
+        [python_executable, '-m', 'backend.services.telegram_sender', message],
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+        check=False
+    )
+    
+    if result.returncode != 0:
+        error_msg = f"❌ Ошибка subprocess (код {result.returncode}): {result.stderr}"
+        logger.error(error_msg)
+        raise subprocess.SubprocessError(error_msg)
+    
+    logger.info("✅ Сообщение успешно отправлено через subprocess")
+    return result.stdout.strip()
+
 
 @retry(
     stop=stop_after_attempt(TELEGRAM_MAX_RETRY_ATTEMPTS),
@@ -30,13 +193,16 @@ logger = logging.getLogger(__name__)
     before_sleep=before_sleep_log(logger, logging.WARNING),
     reraise=True
 )
-def send_message_to_bot(message: str, timeout: int = None) -> str:
+def send_message_to_bot(message: str, timeout: int = None, progress_callback=None) -> str:
     """
-    Отправляет сообщение боту через subprocess с автоматическими повторами
+    Отправляет сообщение боту через Telegram демон с автоматическими повторами.
+    Если демон недоступен и не запускается - через subprocess
     
     Args:
         message: Текст сообщения для отправки
         timeout: Таймаут ожидания ответа (по умолчанию TELEGRAM_SUBPROCESS_TIMEOUT)
+        progress_callback: Вызывается со стадией выполнения (REPLACE_KEY_STAGE_*).
+            Только через демон - subprocess возвращает лишь итоговый ответ
         
     Returns:
         Ответ от бота или сообщение об ошибке
@@ -47,35 +213,34 @@ def send_message_to_bot(message: str, timeout: int = None) -> str:
     """
     actual_timeout = timeout if timeout is not None else TELEGRAM_SUBPROCESS_TIMEOUT
     
+    # Во время FloodWait не ждем таймаут, а сразу возвращаем ошибку
+    paused_for = telegram_limiter.paused_for()
+    if paused_for > 0:
+        logger.warning(f"🛑 Telegram на паузе (FloodWait) еще {paused_for:.0f} сек, запрос не отправляем")
+        return f"{TELEGRAM_FLOOD_WAIT_PREFIX}: Telegram ограничил запросы, повторите через {paused_for:.0f}с"
+    
     try:
         logger.info(f"📤 Отправка сообщения боту: {message[:50]}{'...' if len(message) > 50 else ''}")
         logger.info(f"⏱️ Таймаут ожидания: {actual_timeout}s")
-        logger.debug("🔄 Режим Python: запуск через subprocess")
-        
-        python_executable = sys.executable
-        
-        result = subprocess.run(
-            [python_executable, '-m', 'backend.services.telegram_sender', message],
-            capture_output=True,
-            text=True,
-            timeout=actual_timeout,
-            check=False
-        )
         
-        if result.returncode != 0:
-            error_msg = f"❌ Ошибка subprocess (код {result.returncode}): {result.stderr}"
-            logger.error(error_msg)
-            raise subprocess.SubprocessError(error_msg)
+        if TELEGRAM_DAEMON_ENABLED:
+            try:
+                response = _send_via_daemon(message, actual_timeout, progress_callback)
+                logger.info("✅ Сообщение отправлено через Telegram демон")
+                return response
+            except TelegramDaemonUnavailable:
+                if ensure_telegram_daemon():
+                    return _send_via_daemon(message, actual_timeout, progress_callback)
+                logger.warning("⚠️ Telegram демон недоступен, переключаемся на subprocess")
         
-        logger.info("✅ Сообщение успешно отправлено через subprocess")
-        return result.stdout.strip()
+        return _send_via_subprocess(message, actual_timeout)
         
-    except subprocess.TimeoutExpired as e:
-        logger.error(f"⏱️ Timeout при отправке сообщения через subprocess ({actual_timeout}s)")
+    except (subprocess.TimeoutExpired, socket.timeout) as e:
+        logger.error(f"⏱️ Timeout при отправке сообщения боту ({actual_timeout}s)")
         return f"❌ Timeout: Слишком долго ждем ответ от бота ({actual_timeout}s)"
     
     except Exception as e:
-        error_msg = f"Ошибка subprocess: {str(e)}"
+        error_msg = f"Ошибка отправки сообщения боту: {str(e)}"
         logger.error(f"❌ {error_msg}")
         return f"❌ {error_msg}"
 
@@ -94,7 +259,7 @@ def send_get_subscriptions_command(telegram_uid: str) -> str:
     return send_message_to_bot(message)
 
 
-def send_replace_key_command(telegram_uid: str, uuid: str) -> str:
+def send_replace_key_command(telegram_uid: str, uuid: str, progress_callback=None) -> str:
     """
     Отправляет команду для замены ключа подписки.
     Использует увеличенный timeout, т.к. бот отправляет 2 сообщения:
@@ -104,6 +269,7 @@ def send_replace_key_command(telegram_uid: str, uuid: str) -> str:
     Args:
         telegram_uid: Telegram UID пользователя
         uuid: UUID подписки для замены
+        progress_callback: Получает стадии "command_sent", "subscription_added", "key_received"
         
     Returns:
         Ответ от бота с новым ключом
@@ -112,5 +278,5 @@ def send_replace_key_command(telegram_uid: str, uuid: str) -> str:
     logger.info(f"🔄 Отправка команды замены ключа боту")
     logger.info(f"   UID: {telegram_uid}, UUID: {uuid}")
     logger.info(f"   Ожидаем ответ до {TELEGRAM_REPLACE_KEY_TIMEOUT}s (бот отправляет 2 сообщения)")
-    return send_message_to_bot(message, timeout=TELEGRAM_REPLACE_KEY_TIMEOUT)
+    return send_message_to_bot(message, timeout=TELEGRAM_REPLACE_KEY_TIMEOUT, progress_callback=progress_callback)
 
@@ -0,0 +1,272 @@
+"""
+Данные пользователя для виджета: подписки от Telegram бота и пользователь RemnaWave
+Обоим источникам нужен только telegram_uid, поэтому при промахе кеша они
+запрашиваются параллельно: бот - в потоке запроса, RemnaWave - в пуле
+USER_LOOKUP_WORKERS. Время загрузки - max(бот, RemnaWave), а не сумма.
+RemnaWave ждем не дольше USER_LOOKUP_DEADLINE от начала загрузки.
+Время и исход запросов к каждому источнику - в get_stats() (/health)
+
+Когда пользователь RemnaWave известен, его HWID устройства загружаются в фоне
+(HWID_PREFETCH_WORKERS) и кладутся в запись кеша рядом с remnawave_user -
+следующий клик агента, manage_keys, открывается без запросов к RemnaWave
+"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from backend.config.constants import (
+    USER_LOOKUP_WORKERS,
+    USER_LOOKUP_DEADLINE,
+    HWID_PREFETCH_WORKERS,
+    CACHE_NEGATIVE_REMNAWAVE_NOT_FOUND,
+    CACHE_NEGATIVE_REMNAWAVE_UNAUTHORIZED
+)
+from backend.config.settings import REMNA_DEVICES_CACHE_TTL
+from backend.core.cache_manager import bot_cache
+from backend.services.remnawave_service import remnawave_service
+from backend.services.subscription_service import get_subscriptions_coalesced
+
+logger = logging.getLogger(__name__)
+
+SOURCE_BOT = 'telegram_bot'
+SOURCE_REMNAWAVE = 'remnawave'
+SOURCE_HWID_PREFETCH = 'hwid_prefetch'
+
+# Поля записи кеша с заранее загруженными устройствами
+DEVICES_FIELD = 'remnawave_devices'
+DEVICES_UUID_FIELD = 'remnawave_devices_uuid'
+
+
+class LookupStats:
+    """Количество, исходы и время запросов по источникам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources = {}
+
+    def record(self, source, outcome, seconds):
+        with self._lock:
+            stats = self._sources.setdefault(source, {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0, "outcomes": {}})
+            stats["calls"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+
+    def count(self, source, outcome):
+        """Исход без отдельного вызова (сам вызов учтется, когда завершится)"""
+        with self._lock:
+            stats = self._sources.setdefault(source, {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0, "outcomes": {}})
+            stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                source: {
+                    "calls": stats["calls"],
+                    "avg_ms": round(stats["total_seconds"] * 1000 / stats["calls"], 1) if stats["calls"] else 0.0,
+                    "max_ms": round(stats["max_seconds"] * 1000, 1),
+                    "outcomes": dict(stats["outcomes"])
+                }
+                for source, stats in self._sources.items()
+            }
+
+
+lookup_stats = LookupStats()
+_executor = ThreadPoolExecutor(max_workers=USER_LOOKUP_WORKERS, thread_name_prefix="user-lookup")
+_prefetch_executor = ThreadPoolExecutor(max_workers=HWID_PREFETCH_WORKERS, thread_name_prefix="hwid-prefetch")
+_prefetching = set()
+_prefetch_lock = threading.Lock()
+
+
+def _bot_outcome(fetched):
+    if fetched is None:
+        return 'error'
+    return bot_cache.negative_kind(fetched) or 'ok'
+
+
+def fetch_remnawave_user(telegram_uid, use_cache=True):
+    """
+    Запрашивает пользователя RemnaWave (без записи в кеш подписок)
+
+    Args:
+        use_cache: Можно ли взять ответ из кеша RemnaWave (remnawave_cache)
+
+    Returns:
+        (remnawave_user_data, remnawave_error, negative_kind) - negative_kind
+        задан для ответов, которые кешируются со своим TTL
+    """
+    logger.info(f"🌊 Запрос данных RemnaWave для telegram_uid: {telegram_uid}")
+    started_at = time.time()
+    remnawave_user_data = None
+    remnawave_error = None
+    negative_kind = None
+    outcome = 'ok'
+
+    try:
+        remnawave_response = remnawave_service.get_user_by_telegram_id(telegram_uid, use_cache=use_cache)
+
+        if remnawave_response:
+            if remnawave_response.get('error') == 'not_found':
+                logger.info(f"ℹ️ У юзера нет подписки RemnaWave")
+                remnawave_error = "no_remnawave_subscription"
+                negative_kind = CACHE_NEGATIVE_REMNAWAVE_NOT_FOUND
+                outcome = 'not_found'
+            elif remnawave_response.get('error') == 'unauthorized':
+                logger.error(f"❌ RemnaWave API: неверный токен")
+                remnawave_error = "api_unauthorized"
+                negative_kind = CACHE_NEGATIVE_REMNAWAVE_UNAUTHORIZED
+                outcome = 'unauthorized'
+            else:
+                remnawave_user_data = remnawave_response
+                logger.info(f"✅ RemnaWave данные получены: {remnawave_user_data.get('username')} (shortUuid: {remnawave_user_data.get('shortUuid')})")
+        else:
+            logger.warning(f"⚠️ RemnaWave API не вернул данных")
+            remnawave_error = "api_no_response"
+            outcome = 'no_response'
+
+    except Exception as remna_error:
+        logger.error(f"❌ Ошибка запроса RemnaWave API: {remna_error}")
+        remnawave_error = f"api_error: {str(remna_error)}"
+        outcome = 'error'
+
+    lookup_stats.record(SOURCE_REMNAWAVE, outcome, time.time() - started_at)
+    return remnawave_user_data, remnawave_error, negative_kind
+
+
+def store_remnawave_result(client_id, telegram_uid, remnawave_user_data, remnawave_error, negative_kind):
+    """
+    Атомарно дописывает поля RemnaWave к записи с подписками (одна запись).
+    Если записи нет (ответ бота не сохранен) - ничего не пишем.
+    Сбои сети не кешируем - в следующий раз спросим снова
+    """
+    try:
+        if remnawave_user_data:
+            stored = bot_cache.merge(
+                client_id, telegram_uid,
+                {'remnawave_user': remnawave_user_data},
+                remove=['remnawave_error', 'remnawave_error_expires_at'],
+                create=False
+            )
+            if stored is not None:
+                logger.info("💾 RemnaWave данные сохранены в кеш")
+        elif negative_kind:
+            stored = bot_cache.merge(
+                client_id, telegram_uid,
+                bot_cache.negative_field('remnawave_error', remnawave_error, negative_kind),
+                remove=['remnawave_user'],
+                create=False
+            )
+            if stored is not None:
+                logger.info(f"💾 RemnaWave {negative_kind} сохранен в кеш на {bot_cache.negative_ttl(negative_kind)} сек")
+    except Exception as cache_error:
+        logger.error(f"❌ Ошибка сохранения RemnaWave в кеш: {cache_error}")
+
+
+def fetch_user_data(client_id, telegram_uid, client_name, started_at=None, deadline=USER_LOOKUP_DEADLINE,
+                    use_cache=True):
+    """
+    Параллельно запрашивает подписки у бота и пользователя RemnaWave
+
+    Результат RemnaWave не пишется в кеш - вызывающий сохраняет его через
+    store_remnawave_result после ответа бота; запись без подписок она не создает
+
+    Args:
+        started_at: Начало загрузки виджета (от него отсчитывается deadline)
+        use_cache: Можно ли взять пользователя из кеша RemnaWave (False - принудительное обновление)
+
+    Returns:
+        (fetched, remnawave) - fetched как у get_subscriptions_coalesced,
+        remnawave - кортеж fetch_remnawave_user
+    """
+    if started_at is None:
+        started_at = time.time()
+
+    remnawave_future = _executor.submit(fetch_remnawave_user, telegram_uid, use_cache)
+
+    bot_started_at = time.time()
+    try:
+        fetched = get_subscriptions_coalesced(client_id, telegram_uid, client_name)
+    except Exception as bot_error:
+        logger.error(f"❌ Ошибка запроса к боту: {bot_error}")
+        fetched = None
+    lookup_stats.record(SOURCE_BOT, _bot_outcome(fetched), time.time() - bot_started_at)
+
+    try:
+        remnawave = remnawave_future.result(timeout=max(0.0, started_at + deadline - time.time()))
+    except FutureTimeoutError:
+        logger.warning(f"⏰ RemnaWave не ответил за {deadline} сек загрузки виджета")
+        lookup_stats.count(SOURCE_REMNAWAVE, 'deadline')
+        remnawave = (None, "api_timeout", None)
+
+    logger.info(f"⚡ Бот и RemnaWave получены за {time.time() - bot_started_at:.2f} сек")
+    return fetched, remnawave
+
+
+def prefetched_devices(cached_data, user_uuid):
+    """Заранее загруженные устройства пользователя user_uuid из записи кеша или None"""
+    if not bot_cache.is_field_fresh(cached_data, DEVICES_FIELD):
+        return None
+    if cached_data.get(DEVICES_UUID_FIELD) != user_uuid:
+        return None
+    return cached_data[DEVICES_FIELD]
+
+
+def forget_prefetched_devices(client_id, telegram_uid):
+    """Убирает заранее загруженные устройства из записи (после удаления устройства)"""
+    bot_cache.merge(
+        client_id, telegram_uid, {},
+        remove=[DEVICES_FIELD, f"{DEVICES_FIELD}_expires_at", DEVICES_UUID_FIELD],
+        create=False
+    )
+
+
+def prefetch_devices(client_id, telegram_uid, user_uuid, cached_data=None):
+    """
+    Запускает фоновую загрузку HWID устройств (одна на пользователя за раз)
+
+    Args:
+        cached_data: Запись кеша - если в ней есть свежие устройства, загрузка не нужна
+    """
+    if cached_data and prefetched_devices(cached_data, user_uuid) is not None:
+        return
+
+    key = str(telegram_uid)
+    with _prefetch_lock:
+        if key in _prefetching:
+            return
+        _prefetching.add(key)
+
+    _prefetch_executor.submit(_prefetch_devices, key, client_id, telegram_uid, user_uuid)
+
+
+def _prefetch_devices(key, client_id, telegram_uid, user_uuid):
+    started_at = time.time()
+    outcome = 'ok'
+    try:
+        devices_response = remnawave_service.get_hwid_devices(user_uuid)
+        if not devices_response or devices_response.get('error'):
+            # Ошибку покажет сама manage_keys при обычном запросе
+            outcome = devices_response.get('error', 'error') if devices_response else 'no_response'
+            return
+
+        # Запись могли удалить, пока шла загрузка (delete_client_cache) - не восстанавливаем
+        stored = bot_cache.merge(client_id, telegram_uid, {
+            **bot_cache.timed_field(DEVICES_FIELD, devices_response, REMNA_DEVICES_CACHE_TTL),
+            DEVICES_UUID_FIELD: user_uuid
+        }, create=False)
+        if stored is None:
+            outcome = 'no_record'
+            return
+        logger.info(f"📲 HWID устройства загружены заранее: telegram_uid={telegram_uid}")
+    except Exception as e:
+        outcome = 'exception'
+        logger.error(f"❌ Ошибка фоновой загрузки HWID устройств: {e}")
+    finally:
+        lookup_stats.record(SOURCE_HWID_PREFETCH, outcome, time.time() - started_at)
+        with _prefetch_lock:
+            _prefetching.discard(key)
+
+
+def get_stats():
+    return lookup_stats.get_stats()
@@ -14,6 +14,11 @@ from backend.utils.subscription_utils import (
     process_subscriptions_list,
     sort_subscriptions
 )
+from backend.utils.cache_schema import (
+    prepare_subscriptions_data,
+    upgrade_cache_data,
+    cached_subscriptions
+)
 from backend.utils.webhook_parsers import (
     extract_telegram_uid_from_webhook,
     extract_telegram_username_from_webhook,
@@ -33,6 +38,9 @@ __all__ = [
     'process_subscription',
     'process_subscriptions_list',
     'sort_subscriptions',
+    'prepare_subscriptions_data',
+    'upgrade_cache_data',
+    'cached_subscriptions',
     'extract_telegram_uid_from_webhook',
     'extract_telegram_username_from_webhook',
     'extract_client_name_from_webhook',
@@ -0,0 +1,88 @@
+"""
+Версионированный формат данных записи кеша подписок
+
+Версия 1 (без поля schema_version): сырые подписки от бота в 'subscriptions'
+или просто список подписок (совсем старый формат).
+Версия 2: подписки хранятся уже обработанными process_subscription
+(status, days_left_*, type, quickinstall_encoded) в порядке бота, рядом -
+дата обработки. Чтение в тот же день отдает их как есть; после полуночи
+зависящие от даты поля пересчитываются
+
+Старые записи переводятся лениво при чтении (BotResponseCache.set_migrator)
+или разом:
+    python -m backend.utils.cache_schema migrate
+"""
+import sys
+import logging
+from datetime import date
+
+from backend.config.constants import CACHE_SCHEMA_VERSION
+from backend.utils.subscription_utils import process_subscriptions_list
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_FIELD = 'schema_version'
+PROCESSED_ON_FIELD = 'processed_on'
+
+
+def prepare_subscriptions_data(data: dict) -> dict:
+    """
+    Приводит данные записи к текущей версии: обрабатывает подписки и ставит версию
+    
+    Args:
+        data: Словарь записи с сырыми подписками в 'subscriptions'
+        
+    Returns:
+        Новый словарь в формате CACHE_SCHEMA_VERSION
+    """
+    prepared = dict(data)
+    prepared['subscriptions'] = process_subscriptions_list(data.get('subscriptions') or [])
+    prepared[PROCESSED_ON_FIELD] = date.today().isoformat()
+    prepared[SCHEMA_VERSION_FIELD] = CACHE_SCHEMA_VERSION
+    return prepared
+
+
+def upgrade_cache_data(data):
+    """
+    Переводит данные записи старой версии в текущую
+    
+    Returns:
+        Новые данные или None, если запись уже в текущем формате
+    """
+    if isinstance(data, dict) and data.get(SCHEMA_VERSION_FIELD) == CACHE_SCHEMA_VERSION:
+        return None
+    
+    if isinstance(data, list):
+        # Совсем старый формат - просто список подписок
+        data = {'subscriptions': data}
+    elif not isinstance(data, dict):
+        logger.warning(f"⚠️ Неизвестный формат данных кеша: {type(data)}")
+        data = {}
+    
+    return prepare_subscriptions_data(data)
+
+
+def cached_subscriptions(data: dict) -> list:
+    """
+    Обработанные подписки записи текущей версии
+    Если запись обработана не сегодня, дни и статусы пересчитываются
+    """
+    subscriptions = data.get('subscriptions') or []
+    if data.get(PROCESSED_ON_FIELD) != date.today().isoformat():
+        return process_subscriptions_list(subscriptions)
+    return subscriptions
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("Использование: python -m backend.utils.cache_schema migrate")
+        sys.exit(1)
+    
+    from backend.core.cache_manager import bot_cache
+    
+    migrated = bot_cache.migrate_all(upgrade_cache_data)
+    print(f"✅ Записей переведено в формат версии {CACHE_SCHEMA_VERSION}: {migrated}")
+
+
+if __name__ == "__main__":
+    main()
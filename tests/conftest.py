@@ -0,0 +1,8 @@
+"""
+Общие настройки тестов: кеш и блокировки - во временном каталоге
+(глобальные bot_cache / invalidation_bus создаются при импорте модулей)
+"""
+import os
+import tempfile
+
+os.environ.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='usedesk-test-cache-'))
@@ -0,0 +1,30 @@
+"""
+Поврежденные записи кеша: decode бросает только ValueError, хранилище отдает промах
+"""
+import pytest
+
+from backend.core.cache_codecs import CacheCodec, COMPRESSIONS
+from backend.core.cache_storage import FileCacheStorage
+
+VALUE = {'subscriptions': [{'name': f"Подписка {i}", 'uuid': f"{i:032x}"} for i in range(50)]}
+
+
+@pytest.mark.parametrize('compression', [name for name in COMPRESSIONS if name != 'none'])
+def test_truncated_compressed_payload_raises_value_error(compression):
+    encoded = CacheCodec('json', compression, compress_min_bytes=0).encode(VALUE)
+
+    with pytest.raises(ValueError):
+        CacheCodec.decode(encoded[:len(encoded) // 2])
+
+
+def test_truncated_compressed_record_is_a_miss(tmp_path):
+    codec = CacheCodec('json', 'zlib', compress_min_bytes=0)
+    storage = FileCacheStorage(tmp_path, codec=codec)
+    storage.write('720001', {'data': VALUE, 'timestamp': 0, 'created_at': 0, 'expires_at': 2 ** 40})
+
+    for path in tmp_path.rglob('*'):
+        if path.is_file() and not path.name.startswith('.'):
+            raw = path.read_bytes()
+            path.write_bytes(raw[:len(raw) // 2])
+
+    assert storage.read('720001') is None
@@ -0,0 +1,104 @@
+"""
+BotResponseCache: свежая → устаревшая (отдается, одно фоновое обновление) → истекшая,
+параллельные merge одной записи
+"""
+import threading
+import time
+
+import pytest
+
+from backend.core.cache_manager import BotResponseCache
+from backend.core.cache_storage import FileCacheStorage, SQLiteCacheStorage
+from backend.core.invalidation_bus import InvalidationBus
+
+
+def make_cache(tmp_path, **kwargs):
+    return BotResponseCache(
+        cache_dir=str(tmp_path / "cache"), storage=FileCacheStorage(tmp_path / "cache"),
+        bus=InvalidationBus(tmp_path / "bus"), **kwargs
+    )
+
+
+def wait_revalidated(cache, timeout=5):
+    deadline = time.time() + timeout
+    while cache._revalidating and time.time() < deadline:
+        time.sleep(0.01)
+    assert not cache._revalidating
+
+
+def test_stale_while_revalidate(tmp_path):
+    cache = make_cache(tmp_path, default_ttl=300, stale_ttl=100)
+    release = threading.Event()
+    calls = []
+
+    def revalidator(client_id, telegram_uid, stale_data):
+        calls.append(stale_data)
+        release.wait(5)
+        cache.set(client_id, telegram_uid, {'version': 'fresh'})
+
+    cache.set_revalidator(revalidator)
+
+    cache.set('client-1', 42, {'version': 'first'})
+    assert cache.get('client-1', 42) == {'version': 'first'}
+    assert calls == []
+
+    # Истекла, но в окне stale-while-revalidate: отдается, обновление - одно на все запросы
+    now = time.time()
+    cache._write('client-1', 42, cache._make_record({'version': 'stale'}, expires_at=now - 10))
+    for _ in range(5):
+        assert cache.get('client-1', 42) == {'version': 'stale'}
+    assert cache.get('client-2', 42) == {'version': 'stale'}
+
+    release.set()
+    wait_revalidated(cache)
+    assert calls == [{'version': 'stale'}]
+    assert cache.get('client-1', 42) == {'version': 'fresh'}
+
+    assert cache._stats['stale_hits'] == 6
+    assert cache._stats['revalidations'] == 1
+
+    # За пределами окна запись не отдается и удаляется
+    cache._write('client-1', 42, cache._make_record({'version': 'expired'}, expires_at=now - 101))
+    assert cache.get('client-1', 42) is None
+    assert cache._stats['expired'] == 1
+    assert cache.storage.read(42) is None
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('engine', ['file', 'sqlite'])
+def test_concurrent_merges_keep_all_fields(tmp_path, engine):
+    def make_worker_cache():
+        # Отдельный экземпляр - как другой воркер: свои threading.Lock, общий lock файл полосы
+        if engine == 'sqlite':
+            storage = SQLiteCacheStorage(tmp_path / "cache" / "bot_cache.sqlite3")
+        else:
+            storage = FileCacheStorage(tmp_path / "cache")
+        return BotResponseCache(cache_dir=str(tmp_path / "cache"), storage=storage, bus=InvalidationBus(tmp_path / "bus"))
+
+    caches = [make_worker_cache(), make_worker_cache()]
+    threads_count = 16
+    rounds = 5
+    barrier = threading.Barrier(threads_count)
+    errors = []
+
+    def merge_fields(number):
+        cache = caches[number % len(caches)]
+        try:
+            barrier.wait(5)
+            for round_number in range(rounds):
+                cache.merge('client-1', 42, {f"field_{number}_{round_number}": number})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=merge_fields, args=(number,)) for number in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    data = caches[0].storage.read(42)['data']
+    assert data == {
+        f"field_{number}_{round_number}": number
+        for number in range(threads_count) for round_number in range(rounds)
+    }
@@ -0,0 +1,86 @@
+"""
+Формат данных записи кеша подписок: перевод v1 → текущая версия, пересчет
+дат на следующий день, разовый перевод всего кеша
+"""
+from datetime import date, timedelta
+
+from backend.config.constants import CACHE_SCHEMA_VERSION
+from backend.core.cache_manager import BotResponseCache
+from backend.core.cache_storage import FileCacheStorage
+from backend.core.invalidation_bus import InvalidationBus
+from backend.utils.cache_schema import (
+    PROCESSED_ON_FIELD,
+    SCHEMA_VERSION_FIELD,
+    cached_subscriptions,
+    upgrade_cache_data,
+)
+
+
+def expires_in(days):
+    return (date.today() + timedelta(days=days)).strftime('%d.%m.%Y')
+
+
+def test_upgrade_v1_record():
+    data = {'subscriptions': [{'name': 'VPN', 'expires': expires_in(30)}], 'client_id': 'c1'}
+
+    upgraded = upgrade_cache_data(data)
+
+    assert upgraded[SCHEMA_VERSION_FIELD] == CACHE_SCHEMA_VERSION
+    assert upgraded[PROCESSED_ON_FIELD] == date.today().isoformat()
+    assert upgraded['client_id'] == 'c1'
+    assert upgraded['subscriptions'][0]['status']
+    assert 'status' not in data['subscriptions'][0]
+    assert upgrade_cache_data(upgraded) is None
+
+
+def test_upgrade_bare_list():
+    upgraded = upgrade_cache_data([{'name': 'VPN', 'expires': expires_in(30)}])
+
+    assert upgraded[SCHEMA_VERSION_FIELD] == CACHE_SCHEMA_VERSION
+    assert [subscription['name'] for subscription in upgraded['subscriptions']] == ['VPN']
+
+
+def test_upgrade_unknown_format():
+    upgraded = upgrade_cache_data("garbage")
+
+    assert upgraded['subscriptions'] == []
+    assert upgraded[SCHEMA_VERSION_FIELD] == CACHE_SCHEMA_VERSION
+
+
+def test_cached_subscriptions_reprocessed_next_day():
+    data = upgrade_cache_data({'subscriptions': [{'name': 'VPN', 'expires': expires_in(1)}]})
+    fresh = data['subscriptions']
+    assert cached_subscriptions(data) is fresh
+
+    # Обработано вчера - дни до окончания считаются заново
+    stale = {
+        **data,
+        PROCESSED_ON_FIELD: (date.today() - timedelta(days=1)).isoformat(),
+        'subscriptions': [{**fresh[0], 'days_left_short': 'stale', 'status': 'stale'}],
+    }
+    reprocessed = cached_subscriptions(stale)
+
+    assert reprocessed[0]['days_left_short'] == fresh[0]['days_left_short']
+    assert reprocessed[0]['status'] == fresh[0]['status']
+
+
+def test_migrate_all_is_idempotent(tmp_path):
+    storage = FileCacheStorage(tmp_path / "cache")
+    cache = BotResponseCache(cache_dir=str(tmp_path / "cache"), storage=storage, bus=InvalidationBus(tmp_path / "bus"))
+    subscription = {'name': 'VPN', 'expires': expires_in(30)}
+    cache.set('c1', 1, {'subscriptions': [subscription]})
+    cache.set('c2', 2, [subscription])
+    cache.set('c3', 3, upgrade_cache_data({'subscriptions': [subscription]}))
+    before = {telegram_uid: storage.read(telegram_uid) for telegram_uid in (1, 2, 3)}
+
+    assert cache.migrate_all(upgrade_cache_data) == 2
+    after = {telegram_uid: storage.read(telegram_uid) for telegram_uid in (1, 2, 3)}
+    assert cache.migrate_all(upgrade_cache_data) == 0
+
+    assert after[3] == before[3]
+    for telegram_uid in (1, 2, 3):
+        assert after[telegram_uid]['data'][SCHEMA_VERSION_FIELD] == CACHE_SCHEMA_VERSION
+        # Перевод формата не продлевает и не молодит запись
+        assert after[telegram_uid]['created_at'] == before[telegram_uid]['created_at']
+        assert after[telegram_uid]['expires_at'] == before[telegram_uid]['expires_at']
+    assert {telegram_uid: storage.read(telegram_uid) for telegram_uid in (1, 2, 3)} == after
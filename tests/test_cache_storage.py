@@ -0,0 +1,305 @@
+"""
+Движки хранения кеша: индекс client_id, вытеснение, чистка истекших, блокировки
+(Redis - на fakeredis, тесты пропускаются без него)
+"""
+import json
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from backend.core.cache_manager import BotResponseCache
+from backend.core.cache_storage import FileCacheStorage, RedisCacheStorage, SQLiteCacheStorage
+from backend.core.invalidation_bus import InvalidationBus
+
+
+def make_record(data, created_at=None, ttl=300):
+    created_at = time.time() if created_at is None else created_at
+    return {
+        'data': data,
+        'created_at': datetime.fromtimestamp(created_at, timezone.utc).isoformat(),
+        'expires_at': datetime.fromtimestamp(created_at + ttl, timezone.utc).isoformat(),
+    }
+
+
+@pytest.fixture
+def redis_storage():
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisCacheStorage(client=fakeredis.FakeRedis(), prefix="test:", lock_timeout=1)
+
+
+def test_redis_write_read(redis_storage):
+    record = make_record({'subscriptions': [{'id': 1}]})
+    redis_storage.write(42, record)
+
+    assert redis_storage.read(42) == record
+    assert redis_storage.read(43) is None
+    assert redis_storage.stats()['total_entries'] == 1
+
+
+def test_redis_link_and_delete_clean_index(redis_storage):
+    redis_storage.write(1, make_record('a'))
+    redis_storage.write(2, make_record('b'))
+    redis_storage.link('client-1', 1)
+    redis_storage.link('client-1', 2)
+    redis_storage.link('client-2', 1)
+
+    assert sorted(redis_storage.telegram_uids('client-1')) == ['1', '2']
+
+    assert redis_storage.delete(1) is True
+    assert redis_storage.delete(1) is False
+
+    assert redis_storage.telegram_uids('client-1') == ['2']
+    assert redis_storage.telegram_uids('client-2') == []
+    client = redis_storage.client
+    assert not client.exists("test:links:1")
+    assert client.zscore("test:expires", "1") is None
+    assert client.zscore("test:lru", "1") is None
+    assert client.zscore("test:lfu", "1") is None
+    assert client.hget("test:sizes", "1") is None
+
+
+def test_redis_eviction_order(redis_storage):
+    now = time.time()
+    for telegram_uid in (1, 2, 3):
+        redis_storage.write(telegram_uid, make_record(telegram_uid, created_at=now - 100))
+    redis_storage.record_access({
+        1: (now - 10, 5),
+        2: (now - 50, 1),
+        3: (now - 30, 3),
+    })
+
+    lru = redis_storage.eviction_candidates('lru', 10)
+    lfu = redis_storage.eviction_candidates('lfu', 2)
+
+    assert [telegram_uid for telegram_uid, _ in lru] == ['2', '3', '1']
+    assert all(size > 0 for _, size in lru)
+    assert [telegram_uid for telegram_uid, _ in lfu] == ['2', '3']
+
+
+def test_redis_delete_expired_in_batches(redis_storage, monkeypatch):
+    now = time.time()
+    for telegram_uid in range(1200):
+        redis_storage.write(telegram_uid, make_record(telegram_uid, created_at=now - 1000, ttl=10))
+    redis_storage.write('fresh', make_record('fresh'))
+
+    calls = []
+    original = redis_storage.client.zrangebyscore
+
+    def counting_zrangebyscore(*args, **kwargs):
+        result = original(*args, **kwargs)
+        calls.append(len(result))
+        return result
+
+    monkeypatch.setattr(redis_storage.client, 'zrangebyscore', counting_zrangebyscore)
+
+    assert redis_storage.delete_expired(now) == 1200
+    assert calls == [500, 500, 200, 0]
+    assert redis_storage.read('fresh') is not None
+    assert redis_storage.stats()['total_entries'] == 1
+
+
+def test_redis_lock_released(redis_storage):
+    with redis_storage.lock(7):
+        assert redis_storage.client.exists("test:lock:7")
+    assert not redis_storage.client.exists("test:lock:7")
+
+
+def test_redis_lock_keeps_foreign_owner(redis_storage):
+    # Наша блокировка истекла и досталась другой реплике - ее не снимаем
+    with redis_storage.lock(7):
+        redis_storage.client.set("test:lock:7", "other-replica")
+    assert redis_storage.client.get("test:lock:7") == b"other-replica"
+
+
+def test_redis_lock_release_error_is_logged(redis_storage, monkeypatch, caplog):
+    class ConflictPipeline:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+        def watch(self, key):
+            raise RuntimeError("watched key changed")
+
+    with redis_storage.lock(7):
+        monkeypatch.setattr(redis_storage.client, 'pipeline', ConflictPipeline)
+
+    assert "не снята" in caplog.text
+
+
+def test_file_delete_drops_index_links(tmp_path):
+    storage = FileCacheStorage(tmp_path)
+    storage.write(1, make_record('a'))
+    storage.write(2, make_record('b'))
+    storage.link('client-1', 1)
+    storage.link('client-1', 2)
+    storage.link('client-2', 1)
+
+    assert storage.delete(1) is True
+
+    assert storage.telegram_uids('client-1') == ['2']
+    assert storage.telegram_uids('client-2') == []
+    assert not (tmp_path / "clients" / "client-2").exists()
+    assert not (tmp_path / "links" / "1").exists()
+    assert storage.stats()['indexed_clients'] == 1
+
+
+def test_sqlite_delete_drops_index_links(tmp_path):
+    storage = SQLiteCacheStorage(tmp_path / "cache.sqlite3")
+    storage.write(1, make_record('a'))
+    storage.write(2, make_record('b'))
+    storage.link('client-1', 1)
+    storage.link('client-2', 2)
+
+    assert storage.delete(1) is True
+
+    assert storage.telegram_uids('client-1') == []
+    assert storage.stats()['indexed_clients'] == 1
+
+
+def test_file_links_built_for_existing_index(tmp_path):
+    marker = tmp_path / "clients" / "client-1" / "1"
+    marker.parent.mkdir(parents=True)
+    marker.touch()
+
+    storage = FileCacheStorage(tmp_path)
+    storage.write(1, make_record('a'))
+    storage.delete(1)
+
+    assert not marker.exists()
+    assert storage.stats()['indexed_clients'] == 0
+
+
+def test_file_delete_expired_and_clear_remove_empty_client_dirs(tmp_path):
+    storage = FileCacheStorage(tmp_path)
+    now = time.time()
+    storage.write(1, make_record('old', created_at=now - 1000, ttl=10))
+    storage.write(2, make_record('fresh'))
+    storage.link('client-1', 1)
+    storage.link('client-2', 2)
+
+    assert storage.delete_expired(now) == 1
+    assert sorted(path.name for path in (tmp_path / "clients").iterdir()) == ['client-2']
+    assert [path.name for path in (tmp_path / "links").iterdir()] == ['2']
+
+    assert storage.clear() == 1
+    assert list((tmp_path / "clients").iterdir()) == []
+    assert list((tmp_path / "links").iterdir()) == []
+
+
+def test_file_evict_scans_once_and_cleans_index(tmp_path, monkeypatch):
+    storage = FileCacheStorage(tmp_path / "cache")
+    cache = BotResponseCache(
+        cache_dir=str(tmp_path / "cache"), storage=storage, max_entries=9, max_bytes=0,
+        bus=InvalidationBus(tmp_path / "bus")
+    )
+    for number in range(30):
+        cache.set(f"client-{number}", number, {'number': number})
+
+    scans = []
+    original = storage.eviction_candidates
+
+    def counting_candidates(policy, limit):
+        scans.append(limit)
+        return original(policy, limit)
+
+    monkeypatch.setattr(storage, 'eviction_candidates', counting_candidates)
+
+    report = cache.evict(batch_size=5, pause=0)
+
+    assert report['evicted'] == 21
+    assert report['batches'] == 5
+    assert len(scans) == 1
+    stats = storage.stats()
+    assert stats['total_entries'] == 9
+    assert stats['indexed_clients'] == 9
+
+
+def test_sqlite_round_trip_and_client_index(tmp_path):
+    storage = SQLiteCacheStorage(tmp_path / "cache.sqlite3")
+    record = make_record({'subscriptions': [{'id': 1, 'name': 'Подписка'}]})
+    storage.write(42, record)
+    storage.link('client-1', 42)
+    storage.link('client-1', 42)
+
+    assert storage.read(42) == record
+    assert storage.read(43) is None
+    assert storage.telegram_uids('client-1') == ['42']
+
+    cache = BotResponseCache(cache_dir=str(tmp_path), storage=storage, bus=InvalidationBus(tmp_path / "bus"))
+    assert cache.get_by_client_id('client-1') == record['data']
+    assert cache.get_by_client_id('client-2') is None
+
+
+def test_sqlite_imports_legacy_json_files(tmp_path):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    now = time.time()
+    # Старый формат: файл на пару client_id + telegram_uid, запись с полем timestamp
+    (json_dir / "client_c1_42.json").write_text(json.dumps({'data': 'old', 'timestamp': now - 100}))
+    (json_dir / "client_c2_42.json").write_text(json.dumps({'data': 'new', 'timestamp': now - 10}))
+    (json_dir / "client_c3_7.json").write_text(json.dumps({'data': 'other', 'timestamp': now - 10}))
+
+    storage = SQLiteCacheStorage(tmp_path / "cache.sqlite3", import_from=json_dir)
+
+    assert storage.read(42)['data'] == 'new'
+    assert storage.read(7)['data'] == 'other'
+    assert storage.telegram_uids('c1') == ['42']
+    assert storage.telegram_uids('c2') == ['42']
+    assert storage.telegram_uids('c3') == ['7']
+    assert storage._get_meta('json_imported_at')
+
+    # Повторный запуск не импортирует заново
+    storage.delete(7)
+    storage = SQLiteCacheStorage(tmp_path / "cache.sqlite3", import_from=json_dir)
+    assert storage.read(7) is None
+
+
+def test_sqlite_migrates_bot_cache_table(tmp_path):
+    db_path = tmp_path / "cache.sqlite3"
+    now = time.time()
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE bot_cache (client_id TEXT NOT NULL, telegram_uid TEXT NOT NULL, data TEXT NOT NULL, "
+        "timestamp REAL NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL, "
+        "PRIMARY KEY (client_id, telegram_uid))"
+    )
+    conn.executemany(
+        "INSERT INTO bot_cache VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            ('c1', '42', json.dumps('new'), now - 10, now - 10, now + 300),
+            ('c2', '42', json.dumps('old'), now - 100, now - 100, now + 200),
+            ('c3', '7', json.dumps('other'), now - 10, now - 10, now + 300),
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+    storage = SQLiteCacheStorage(db_path)
+
+    assert storage.read(42)['data'] == 'new'
+    assert storage.read(7)['data'] == 'other'
+    assert sorted(storage.telegram_uids('c2')) == ['42']
+    assert storage.stats()['indexed_clients'] == 3
+    tables = {row[0] for row in storage._connection().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'bot_cache' not in tables
+
+
+def test_sqlite_delete_expired_prunes_client_index(tmp_path):
+    storage = SQLiteCacheStorage(tmp_path / "cache.sqlite3")
+    now = time.time()
+    storage.write(1, make_record('old', created_at=now - 1000, ttl=10))
+    storage.write(2, make_record('fresh'))
+    storage.link('client-1', 1)
+    storage.link('client-2', 1)
+    storage.link('client-2', 2)
+
+    assert storage.delete_expired(now) == 1
+
+    assert storage.read(1) is None
+    assert storage.telegram_uids('client-1') == []
+    assert storage.telegram_uids('client-2') == ['2']
+    assert storage.stats()['indexed_clients'] == 1
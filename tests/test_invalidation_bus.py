@@ -0,0 +1,29 @@
+"""
+Шина инвалидаций между процессами
+"""
+import os
+
+from backend.core.invalidation_bus import InvalidationBus
+
+
+def test_forked_workers_reopen_the_bus(tmp_path):
+    bus = InvalidationBus(tmp_path / "bus", slots=64, slot_size=128)
+    received = []
+    bus.subscribe('test', received.append)
+
+    # Как gunicorn --preload: шина открыта до fork, воркеры публикуют одновременно
+    children = []
+    for worker in range(4):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for i in range(10):
+                    bus.publish('test', f"{worker}:{i}")
+                os._exit(0 if bus._pid == os.getpid() else 1)
+            except BaseException:
+                os._exit(2)
+        children.append(pid)
+
+    assert all(os.waitpid(pid, 0)[1] == 0 for pid in children)
+    bus.poll()
+    assert sorted(received) == sorted(f"{worker}:{i}" for worker in range(4) for i in range(10))
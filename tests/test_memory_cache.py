@@ -0,0 +1,86 @@
+"""
+LRU в памяти: лимиты по числу записей и байтам, TTL, копии при чтении и записи
+"""
+from backend.core import memory_cache
+from backend.core.memory_cache import MemoryLRU
+
+
+def test_evicts_least_recently_used_by_count():
+    lru = MemoryLRU(max_entries=3, max_bytes=10_000, ttl=60)
+    for key in ('a', 'b', 'c'):
+        lru.set(key, {'key': key})
+
+    assert lru.get('a') == {'key': 'a'}
+    lru.set('d', {'key': 'd'})
+
+    assert lru.get('b') is None
+    assert [key for key in ('a', 'c', 'd') if lru.get(key) is not None] == ['a', 'c', 'd']
+    assert lru.get_stats()['evictions'] == 1
+
+
+def test_evicts_by_bytes():
+    lru = MemoryLRU(max_entries=100, max_bytes=25, ttl=60)
+    lru.set('a', 'x', size=10)
+    lru.set('b', 'y', size=10)
+    lru.set('c', 'z', size=10)
+
+    assert lru.get('a') is None
+    assert lru.get('b') == 'y'
+    assert lru.get('c') == 'z'
+    assert lru.get_stats()['bytes'] == 20
+
+    # Запись больше всего лимита не кешируется и не вытесняет остальные
+    lru.set('huge', 'big', size=26)
+    assert lru.get('huge') is None
+    assert lru.get_stats()['entries'] == 2
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(memory_cache.time, 'time', lambda: now[0])
+    lru = MemoryLRU(max_entries=10, max_bytes=10_000, ttl=60)
+    lru.set('a', {'value': 1})
+
+    now[0] += 60
+    assert lru.get('a') == {'value': 1}
+    now[0] += 1
+    assert lru.get('a') is None
+
+    stats = lru.get_stats()
+    assert stats['expired'] == 1
+    assert stats['entries'] == 0
+
+
+def test_zero_ttl_disables_memory():
+    lru = MemoryLRU(max_entries=10, max_bytes=10_000, ttl=0)
+    lru.set('a', {'value': 1})
+
+    assert lru.get('a') is None
+    assert lru.get_stats()['entries'] == 0
+
+
+def test_get_and_set_return_isolated_copies():
+    lru = MemoryLRU(max_entries=10, max_bytes=10_000, ttl=60)
+    data = {'subscriptions': [{'id': 1}]}
+    lru.set('a', data)
+    data['subscriptions'].append({'id': 2})
+
+    first = lru.get('a')
+    first['subscriptions'][0]['id'] = 99
+
+    assert lru.get('a') == {'subscriptions': [{'id': 1}]}
+
+
+def test_hit_and_miss_counters():
+    lru = MemoryLRU(max_entries=10, max_bytes=10_000, ttl=60)
+    lru.set('a', 1)
+    lru.get('a')
+    lru.get('a')
+    lru.get('missing')
+    lru.delete('a')
+    lru.get('a')
+
+    stats = lru.get_stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+    assert stats['hit_rate'] == 0.5
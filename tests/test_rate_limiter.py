@@ -0,0 +1,27 @@
+"""
+Общий token bucket: запросы без резервирования не переписывают файл состояния
+"""
+from backend.core.rate_limiter import TokenBucketLimiter
+
+
+def test_queries_do_not_write_state(tmp_path):
+    state_file = tmp_path / "limits.json"
+    limiter = TokenBucketLimiter(state_file, {'send': {'rate': 1.0, 'burst': 2}})
+    limiter.reserve('send')
+    before = state_file.stat().st_mtime_ns, state_file.read_text()
+
+    assert limiter.paused_for() == 0.0
+    assert 1.0 <= limiter.available('send') <= 2.0
+    assert limiter.get_stats()['send']['requests'] == 1
+
+    assert (state_file.stat().st_mtime_ns, state_file.read_text()) == before
+
+
+def test_pause_is_shared(tmp_path):
+    state_file = tmp_path / "limits.json"
+    first = TokenBucketLimiter(state_file, {'send': {'rate': 1.0, 'burst': 2}})
+    second = TokenBucketLimiter(state_file, {'send': {'rate': 1.0, 'burst': 2}})
+
+    first.pause(30)
+
+    assert 29 < second.paused_for() <= 30
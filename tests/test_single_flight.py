@@ -0,0 +1,16 @@
+"""
+Межпроцессные блокировки single-flight: фиксированный набор lock файлов
+"""
+from backend.core.single_flight import SingleFlight
+
+
+def test_lock_files_are_striped(tmp_path):
+    (tmp_path / ("a" * 40 + ".lock")).touch()
+    flight = SingleFlight(lock_dir=tmp_path, stripes=8)
+
+    for i in range(200):
+        assert flight.do(f"subscriptions:{i}", lambda: i) == i
+
+    lock_files = list(tmp_path.glob("*.lock"))
+    assert 0 < len(lock_files) <= 8
+    assert all(path.name.startswith("flight_") for path in lock_files)
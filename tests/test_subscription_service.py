@@ -0,0 +1,46 @@
+"""
+Ответы бота в том виде, в котором их возвращает send_message_to_bot
+(демон и telegram_sender оборачивают текст в {"success": true, "response": ...})
+"""
+import json
+
+import pytest
+
+from backend.config.constants import CACHE_NEGATIVE_BOT_TIMEOUT
+from backend.core.cache_manager import bot_cache
+from backend.services import subscription_service
+
+
+def _daemon_response(text):
+    return json.dumps({"success": True, "response": text}, ensure_ascii=False)
+
+
+@pytest.fixture
+def bot_reply(monkeypatch):
+    def set_reply(response):
+        monkeypatch.setattr(subscription_service, 'send_message_to_bot', lambda message: response)
+    return set_reply
+
+
+def test_wrapped_timeout_is_negative_cached(bot_reply):
+    bot_reply(_daemon_response("❌ Бот не ответил на запрос в течение таймаута"))
+
+    result = subscription_service.fetch_subscriptions('client-timeout', '700001', 'Клиент')
+
+    assert result['no_subscriptions'] is True
+    assert bot_cache.negative_kind(result) == CACHE_NEGATIVE_BOT_TIMEOUT
+    cached = bot_cache.get('client-timeout', '700001')
+    assert bot_cache.negative_kind(cached) == CACHE_NEGATIVE_BOT_TIMEOUT
+
+
+@pytest.mark.parametrize('response', [
+    # Пауза демона / FloodWaitError в telegram_sender - внутри обертки
+    _daemon_response("❌ FloodWait: Telegram ограничил запросы, повторите через 30с"),
+    # Проверка паузы в send_message_to_bot - без обертки
+    "❌ FloodWait: Telegram ограничил запросы, повторите через 30с",
+])
+def test_flood_wait_is_an_error(bot_reply, response):
+    bot_reply(response)
+
+    assert subscription_service.fetch_subscriptions('client-flood', '700002', 'Клиент') is None
+    assert bot_cache.get('client-flood', '700002') is None
@@ -0,0 +1,87 @@
+"""
+Маршрутизация ответов бота между параллельными командами
+"""
+import asyncio
+from types import SimpleNamespace
+
+from backend.services.telegram_replies import (
+    BotReplyListener,
+    get_reply_listener,
+    CLAIMED_IDS_LIMIT,
+    UNROUTED_LIMIT
+)
+
+
+def _message(message_id, text, reply_to=None):
+    return SimpleNamespace(id=message_id, text=text, reply_to_msg_id=reply_to)
+
+
+def _reply(telegram_uid):
+    return f"Подписки пользователя {telegram_uid}\n**Название:** iPhone"
+
+
+def test_reply_with_uid_waits_for_its_owner():
+    listener = BotReplyListener(client=None, bot_username="@bot")
+    first = listener.subscribe("Узнать подписки\n111111")
+    second = listener.subscribe("Узнать подписки\n222222")
+    listener.mark_sent(first, 10)
+
+    # Ответ второму пришел раньше, чем он узнал id своей команды (11)
+    listener._route(_message(12, _reply("222222")))
+    assert not first.done
+    assert not second.done
+
+    listener.mark_sent(second, 11)
+    assert second.done
+    assert not first.done
+
+
+def test_reply_with_uid_goes_to_owner_not_oldest():
+    listener = BotReplyListener(client=None, bot_username="@bot")
+    first = listener.subscribe("Узнать подписки\n111111")
+    second = listener.subscribe("Узнать подписки\n222222")
+    listener.mark_sent(first, 10)
+    listener.mark_sent(second, 11)
+
+    listener._route(_message(12, _reply("222222")))
+
+    assert second.done
+    assert not first.done
+
+
+def test_concurrent_first_calls_start_one_listener():
+    class FakeClient:
+        def __init__(self):
+            self.handlers = []
+
+        async def get_input_entity(self, username):
+            await asyncio.sleep(0.01)
+            return username
+
+        def add_event_handler(self, handler, event):
+            self.handlers.append(handler)
+
+    async def run():
+        client = FakeClient()
+        listeners = await asyncio.gather(*(get_reply_listener(client, "@bot") for _ in range(5)))
+        return client, listeners
+
+    client, listeners = asyncio.run(run())
+
+    assert len(client.handlers) == 1
+    assert all(listener is listeners[0] for listener in listeners)
+    assert listeners[0].available
+
+
+def test_claimed_ids_and_unrouted_are_bounded():
+    listener = BotReplyListener(client=None, bot_username="@bot")
+    # Всегда есть ожидающий - очистка "когда никого нет" не срабатывает
+    pending = listener.subscribe("Узнать подписки\n333333")
+
+    for message_id in range(CLAIMED_IDS_LIMIT * 3):
+        listener.claim(_message(message_id, None))
+        listener._route(_message(message_id, _reply("333333")))
+
+    assert len(listener._claimed_ids) <= CLAIMED_IDS_LIMIT
+    assert len(listener._unrouted) <= UNROUTED_LIMIT
+    assert not pending.done
@@ -0,0 +1,48 @@
+"""
+Поля RemnaWave дописываются только к записи с подписками
+"""
+from backend.config.constants import CACHE_NEGATIVE_REMNAWAVE_NOT_FOUND
+from backend.core.cache_manager import bot_cache
+from backend.services import user_lookup
+
+
+def test_remnawave_result_without_subscriptions_record_is_not_cached():
+    user_lookup.store_remnawave_result('client-rw', '710001', {'uuid': 'u-1'}, None, None)
+    user_lookup.store_remnawave_result('client-rw', '710001', None, 'no_remnawave_subscription',
+                                       CACHE_NEGATIVE_REMNAWAVE_NOT_FOUND)
+
+    assert bot_cache.get('client-rw', '710001') is None
+
+
+def test_remnawave_result_is_merged_into_subscriptions_record():
+    bot_cache.set('client-rw', '710002', {'subscriptions': [], 'client_name': 'Клиент'})
+
+    user_lookup.store_remnawave_result('client-rw', '710002', {'uuid': 'u-2'}, None, None)
+
+    cached = bot_cache.get('client-rw', '710002')
+    assert cached['remnawave_user'] == {'uuid': 'u-2'}
+    assert cached['client_name'] == 'Клиент'
+
+
+def test_prefetched_devices_without_record_are_not_cached(monkeypatch):
+    monkeypatch.setattr(user_lookup.remnawave_service, 'get_hwid_devices',
+                        lambda user_uuid: {'devices': [], 'total': 0})
+
+    user_lookup._prefetching.add('710003')
+    user_lookup._prefetch_devices('710003', 'client-rw', '710003', 'u-3')
+    user_lookup.forget_prefetched_devices('client-rw', '710003')
+
+    assert bot_cache.get('client-rw', '710003') is None
+
+
+def test_forget_prefetched_devices_keeps_subscriptions():
+    bot_cache.set('client-rw', '710004', {
+        'subscriptions': [],
+        **bot_cache.timed_field(user_lookup.DEVICES_FIELD, {'devices': [], 'total': 0}, 60),
+        user_lookup.DEVICES_UUID_FIELD: 'u-4'
+    })
+
+    user_lookup.forget_prefetched_devices('client-rw', '710004')
+
+    cached = bot_cache.get('client-rw', '710004')
+    assert cached == {'subscriptions': []}